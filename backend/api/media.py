@@ -0,0 +1,131 @@
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import quote
+import anyio
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 1024 * 1024
+
+class RangeFileResponse(Response):
+    """
+    Streams bytes [start, end] of a file.
+
+    When the ASGI server advertises the zero-copy extension the kernel sends the file directly
+    (sendfile); otherwise the range is read in chunks off the event loop.
+    """
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if scope["method"].upper() == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file.fileno(), "offset": self.start, "count": count, "more_body": False})
+            return
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank while streaming: close the body instead of hanging the client
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def parse_range_header(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parses a single "bytes=" range into inclusive (start, end) offsets.
+
+    Returns None when the header is malformed or asks for several ranges (the whole file is then
+    served), and raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first or last).isdigit() or (first and last and not last.isdigit()):
+        return None
+    if first == "":
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError(f"Range {range_header} outside of {size} bytes")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Range {range_header} outside of {size} bytes")
+    return start, min(end, size - 1)
+
+def _not_modified_since(header: str | None, mtime: float) -> bool:
+    if not header:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def media_file_response(request: Request, path: Path, filename: str | None = None, media_type: str = "application/octet-stream") -> Response:
+    """
+    Builds a download response for a file on disk with HTTP caching and seeking support.
+
+    Handles conditional GET (If-None-Match / If-Modified-Since -> 304), single byte ranges
+    (206 / 416, honouring If-Range) so video players can seek without fetching the whole file.
+    """
+    stat_result = os.stat(path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+    size = stat_result.st_size
+    etag = f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": last_modified,
+        "cache-control": "no-cache",
+    }
+    if filename:
+        headers["content-disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+    elif _not_modified_since(request.headers.get("if-modified-since"), stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+        try:
+            byte_range = parse_range_header(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            headers["content-length"] = str(end - start + 1)
+            return RangeFileResponse(path, start, end, 206, headers, media_type)
+
+    headers["content-length"] = str(size)
+    return RangeFileResponse(path, 0, size - 1, 200, headers, media_type)
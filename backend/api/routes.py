@@ -2,9 +2,10 @@ import uuid
 import asyncio
 import os
 import time
-import hashlib
-from fastapi import APIRouter, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import APIRouter, HTTPException, BackgroundTasks, UploadFile, File, Query, Request, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Literal
 
 from backend.models.schemas import (
     CloneVoiceResponse,
@@ -13,28 +14,19 @@ from backend.models.schemas import (
     JobStatusResponse,
     ModelStatusResponse,
     ModelDownloadRequest,
-    ModelDownloadProgressResponse
+    ModelDownloadProgressResponse,
+    QueueStatusResponse
 )
-from backend.storage.db import save_voice, save_job, get_job, get_voice
-from backend.services.job_service import JobService
+from backend.storage.assets import ASSET_STORE
+from backend.storage.db import save_voice, save_job, get_job, get_voice, update_job_status, list_jobs, count_jobs_by_status
+from backend.services.job_service import JobService, JOB_SCHEDULER
+from backend.services.scheduler import QueueFullError
+from backend.services.event_bus import JOB_EVENTS
 from backend.utils.logger import app_logger
+from backend.utils.model_downloader import MODEL_DOWNLOADS
 
 api_router = APIRouter()
 
-# Ensure voice directory exists
-VOICE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "voices")
-os.makedirs(VOICE_DIR, exist_ok=True)
-
-# Global mock model download state (in memory)
-MODEL_DOWNLOAD_STATE = {
-    "Wan t2v 1.3B": {"status": "ready", "progress": 100},
-    "Hunyuan Avatar": {"status": "not_downloaded", "progress": 0},
-    "Wan Multitalk": {"status": "not_downloaded", "progress": 0},
-    "Wan FantasySpeaking": {"status": "not_downloaded", "progress": 0},
-    "Wan t2v 14B": {"status": "not_downloaded", "progress": 0},
-    "LTX-2": {"status": "not_downloaded", "progress": 0},
-}
-
 def build_script(script_mode: str, script_input: str) -> str:
     if script_mode == "manual":
         return script_input
@@ -48,73 +40,51 @@ def build_script(script_mode: str, script_input: str) -> str:
 
 @api_router.get("/models/status", response_model=list[ModelStatusResponse])
 def get_models_status():
-    """Returns the readiness status of all models."""
+    """Returns the readiness of all models, with real downloaded bytes and throughput."""
     return [
-        ModelStatusResponse(model_id=k, status=v["status"], progress=v["progress"]) 
-        for k, v in MODEL_DOWNLOAD_STATE.items()
+        ModelStatusResponse(model_id=model_id, **MODEL_DOWNLOADS.status(model_id))
+        for model_id in MODEL_DOWNLOADS.model_ids()
     ]
 
-async def simulate_download(model_id: str):
-    """Simulates a background download."""
-    MODEL_DOWNLOAD_STATE[model_id]["status"] = "downloading"
-    MODEL_DOWNLOAD_STATE[model_id]["progress"] = 0
-    
-    for i in range(10):
-        await asyncio.sleep(0.5)
-        MODEL_DOWNLOAD_STATE[model_id]["progress"] += 10
-        
-    MODEL_DOWNLOAD_STATE[model_id]["status"] = "ready"
-    MODEL_DOWNLOAD_STATE[model_id]["progress"] = 100
-
 @api_router.post("/models/download")
 def start_model_download(payload: ModelDownloadRequest, background_tasks: BackgroundTasks):
-    """Initiates a download for a specific model."""
-    if payload.model_id not in MODEL_DOWNLOAD_STATE:
+    """Initiates (or resumes) the checkpoint download of a specific model."""
+    if payload.model_id not in MODEL_DOWNLOADS.model_ids():
         raise HTTPException(status_code=404, detail="Model unknown")
     
-    if MODEL_DOWNLOAD_STATE[payload.model_id]["status"] == "downloading":
+    if MODEL_DOWNLOADS.is_downloading(payload.model_id):
         return {"status": "already_downloading"}
         
-    background_tasks.add_task(simulate_download, payload.model_id)
+    background_tasks.add_task(MODEL_DOWNLOADS.download, payload.model_id)
     return {"status": "started"}
 
 @api_router.get("/models/download/{model_id}", response_model=ModelDownloadProgressResponse)
 def get_model_download_progress(model_id: str):
     """Polling endpoint for download progress."""
-    if model_id not in MODEL_DOWNLOAD_STATE:
+    if model_id not in MODEL_DOWNLOADS.model_ids():
         raise HTTPException(status_code=404, detail="Model unknown")
     
-    state = MODEL_DOWNLOAD_STATE[model_id]
-    return ModelDownloadProgressResponse(
-        model_id=model_id,
-        status=state["status"],
-        progress=state["progress"]
-    )
+    return ModelDownloadProgressResponse(model_id=model_id, **MODEL_DOWNLOADS.status(model_id))
 
 @api_router.post("/voice/clone", response_model=CloneVoiceResponse)
 async def clone_voice(audio_file: UploadFile = File(...)):
     """
-    接收用户上传的音频文件，保存到本地，并返回其路径作为真正克隆时需要的 voice_id
+    接收用户上传的音频文件，流式写入内容寻址存储（相同音频只保存一份），并返回其路径作为真正克隆时需要的 voice_id
     """
     app_logger.info(f"Received request to upload voice cloning audio: {audio_file.filename}")
     try:
-        content = await audio_file.read()
-        file_hash = hashlib.md5(content).hexdigest()[:10]
-        ext = os.path.splitext(audio_file.filename)[1]
+        ext = os.path.splitext(audio_file.filename or "")[1]
         if not ext:
             ext = ".wav" # default extension
-        
-        safe_filename = f"voice_{file_hash}{ext}"
-        file_path = os.path.join(VOICE_DIR, safe_filename)
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
-            
-        if not get_voice(file_path):
-            save_voice(file_path, engine="wan2gp", status="ready")
-            
+
+        file_path, _ = await ASSET_STORE.save_upload(audio_file, "voices", ext)
+        voice_id = str(file_path)
+
+        if not await asyncio.to_thread(get_voice, voice_id):
+            await asyncio.to_thread(save_voice, voice_id, "wan2gp", "ready")
+
         return CloneVoiceResponse(
-            voice_id=file_path, # Returns absolute file path, used by KugelAudio/Avatar
+            voice_id=voice_id, # Returns absolute file path, used by KugelAudio/Avatar
             status="ready",
             engine="wan2gp" # Voice cloning usually performed by TTS in Wan2GP
         )
@@ -123,8 +93,11 @@ async def clone_voice(audio_file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail="Voice upload failed")
 
 @api_router.post("/jobs", response_model=CreateJobResponse)
-def create_job(payload: CreateJobRequest, background_tasks: BackgroundTasks):
-    voice_record = get_voice(payload.voice_id)
+async def create_job(payload: CreateJobRequest):
+    if JOB_SCHEDULER.is_full:
+        raise HTTPException(status_code=429, detail="任务队列已满，请稍后再试")
+
+    voice_record = await asyncio.to_thread(get_voice, payload.voice_id)
     if not voice_record:
         raise HTTPException(status_code=400, detail="无效 voice_id，请先完成声音克隆")
 
@@ -150,30 +123,34 @@ def create_job(payload: CreateJobRequest, background_tasks: BackgroundTasks):
         "generated_script": generated_script,
     }
     
-    save_job(job_data)
+    await asyncio.to_thread(save_job, job_data)
     app_logger.info(f"Registered new job: {job_id} with preferred engine {initial_engine}")
     
-    # Dispatch worker to process the job in background
-    background_tasks.add_task(
-        JobService.process_job_async,
-        job_id=job_id,
-        voice_id=payload.voice_id,
-        avatar_url=payload.avatar_url,
-        script_text=generated_script,
-        preferred_engine=initial_engine,
-        wangp_model=payload.wangp_model
-    )
+    # Hand the job to the model-affinity scheduler
+    try:
+        await JobService.submit_job(
+            job_id=job_id,
+            voice_id=payload.voice_id,
+            avatar_url=payload.avatar_url,
+            script_text=generated_script,
+            preferred_engine=initial_engine,
+            wangp_model=payload.wangp_model,
+            seed=payload.seed
+        )
+    except QueueFullError:
+        update_job_status(job_id, {"status": "failed", "message": "任务队列已满，请稍后再试"})
+        raise HTTPException(status_code=429, detail="任务队列已满，请稍后再试")
 
     return CreateJobResponse(job_id=job_id, selected_engine=initial_engine, wangp_model=payload.wangp_model)
 
-@api_router.get("/jobs/{job_id}", response_model=JobStatusResponse)
-def get_job_status(job_id: str):
-    record = get_job(job_id)
-    if not record:
-        raise HTTPException(status_code=404, detail="任务不存在")
+@api_router.get("/queue/status", response_model=QueueStatusResponse)
+def get_queue_status():
+    """Reports scheduler queue depth, resident models and the model reloads the queue will cost."""
+    return QueueStatusResponse(**JOB_SCHEDULER.stats())
 
+def _to_job_status_response(record: dict) -> JobStatusResponse:
     return JobStatusResponse(
-        job_id=job_id,
+        job_id=record["job_id"],
         status=record["status"],
         progress=record["progress"],
         message=record["message"],
@@ -184,7 +161,89 @@ def get_job_status(job_id: str):
         result_url=record.get("result_url") if record["status"] == "completed" else None
     )
 
-from fastapi.responses import FileResponse
+@api_router.get("/jobs", response_model=list[JobStatusResponse])
+def list_job_statuses(
+    status: Literal["queued", "running", "completed", "failed"] | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0)
+):
+    """Lists jobs newest first, optionally filtered by status."""
+    return [_to_job_status_response(record) for record in list_jobs(status, limit, offset)]
+
+@api_router.get("/jobs/stats")
+def get_job_stats() -> dict:
+    """Returns the number of jobs per status."""
+    return count_jobs_by_status()
+
+@api_router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+def get_job_status(job_id: str):
+    record = get_job(job_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    return _to_job_status_response(record)
+
+SSE_KEEPALIVE_SECONDS = 15
+
+def _format_job_event(event_id: int, record: dict) -> str:
+    payload = _to_job_status_response(record).model_dump_json()
+    return f"id: {event_id}\ndata: {payload}\n\n"
+
+@api_router.get("/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    last_event_id: str | None = Header(None, alias="Last-Event-ID"),
+    resume_from: int | None = Query(None, alias="last_event_id")
+):
+    """
+    Server-sent events stream of job progress, fed by the in-process job event bus.
+
+    Sends the current status first, then one event per update until the job completes or fails.
+    A client reconnecting with Last-Event-ID (header, or last_event_id query) only gets the
+    current status again if it changed while disconnected.
+    """
+    if resume_from is None and last_event_id and last_event_id.isdigit():
+        resume_from = int(last_event_id)
+
+    queue, record, current_id = JOB_EVENTS.subscribe(job_id)
+    if record is None:
+        # First listener since startup: seed the bus once from the database
+        record = get_job(job_id)
+        if not record:
+            JOB_EVENTS.unsubscribe(job_id, queue)
+            raise HTTPException(status_code=404, detail="任务不存在")
+        JOB_EVENTS.seed(job_id, record)
+
+    async def event_stream():
+        try:
+            yield "retry: 2000\n\n"
+            if resume_from != current_id:
+                yield _format_job_event(current_id, record)
+            if record["status"] in ("completed", "failed"):
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                record.update(event["data"])
+                yield _format_job_event(event["id"], record)
+                if record["status"] in ("completed", "failed"):
+                    return
+        finally:
+            JOB_EVENTS.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+from backend.api.media import media_file_response
 from backend.utils.config import OUTPUTS_DIR
 
 @api_router.get("/jobs/{job_id}/result")
@@ -195,8 +254,9 @@ def get_job_result(job_id: str):
         
     return {"status": "ready", "url": f"/api/jobs/{job_id}/download", "filename": f"{job_id}.mp4"}
 
-@api_router.get("/jobs/{job_id}/download")
-def download_job_result(job_id: str):
+@api_router.api_route("/jobs/{job_id}/download", methods=["GET", "HEAD"])
+def download_job_result(job_id: str, request: Request):
+    """Serves the rendered video with Range (seeking) and conditional GET support."""
     record = get_job(job_id)
     if not record or record["status"] != "completed":
         raise HTTPException(status_code=404, detail="Result not ready or job not found")
@@ -209,8 +269,9 @@ def download_job_result(job_id: str):
     if not expected_path.exists():
         raise HTTPException(status_code=404, detail="Video file is missing from disk")
         
-    return FileResponse(
-        path=expected_path,
+    return media_file_response(
+        request,
+        expected_path,
         filename=f"InfiniteTalk_{job_id}.mp4",
         media_type="video/mp4"
     )
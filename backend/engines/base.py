@@ -9,6 +9,11 @@ class BaseEngineAdapter(abc.ABC):
         """The identifier of the engine (e.g., 'wan2gp')."""
         pass
 
+    @property
+    def reports_progress(self) -> bool:
+        """Whether the engine updates the job progress itself (otherwise it is simulated)."""
+        return False
+
     @abc.abstractmethod
     async def process_job(
         self,
@@ -16,10 +21,13 @@ class BaseEngineAdapter(abc.ABC):
         voice_id: str,
         avatar_url: str,
         script_text: str,
-        wangp_model: str = "Wan t2v 1.3B"
+        wangp_model: str = "Wan t2v 1.3B",
+        slot: int = 0,
+        seed: int | None = None
     ) -> str:
         """
-        Executes the AI task.
+        Executes the AI task on the worker slot (device) chosen by the scheduler.
+        seed, when given, fixes the render seed instead of drawing a random one.
         Should raise an Exception if the execution fails.
         Returns the resulting file URL/path.
         """
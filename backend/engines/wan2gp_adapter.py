@@ -1,18 +1,36 @@
 import asyncio
 import os
-import shutil
 import subprocess
 from pathlib import Path
 from backend.engines.base import BaseEngineAdapter
 from backend.utils.logger import app_logger
 from backend.utils.config import OUTPUTS_DIR, DATA_DIR
+from backend.storage.assets import ASSET_STORE
+from backend.services.result_cache import RESULT_CACHE
 
 class Wan2GPAdapter(BaseEngineAdapter):
     @property
     def name(self) -> str:
         return "wan2gp"
 
-    async def process_job(self, job_id, voice_id, avatar_url, script_text, wangp_model="Wan t2v 1.3B") -> str:
+    @property
+    def reports_progress(self) -> bool:
+        return True # structured wgp.py progress events (step, window, ETA)
+
+    @staticmethod
+    def resolve_model_type(wangp_model: str) -> tuple[str, bool]:
+        """Maps a frontend model selection to (native WanGP model_type, is_avatar)."""
+        if "Hunyuan Avatar" in wangp_model:
+            return "hunyuan_avatar", True
+        elif "Multitalk" in wangp_model:
+            return "multitalk", True
+        elif "Fantasy" in wangp_model:
+            return "fantasy", True
+        elif "14B" in wangp_model:
+            return "t2v", False
+        return "t2v_1.3B", False # default fallback
+
+    async def process_job(self, job_id, voice_id, avatar_url, script_text, wangp_model="Wan t2v 1.3B", slot=0, seed=None) -> str:
         app_logger.info(f"[Wan2GP] Starting generation for job {job_id}")
         
         # 1. Verify Native Repo Exists
@@ -37,25 +55,63 @@ class Wan2GPAdapter(BaseEngineAdapter):
         sample_mp4 = DATA_DIR / "models" / "sample.mp4"
         
         # Use our centralized native executor wrapper
-        from backend.utils.wan2gp_runner import run_native_wan2gp_job
-        
+        from backend.utils.wan2gp_runner import run_native_wan2gp_job, place_wan2gp_output
+
+        settings = await self.build_settings(voice_id, avatar_url, script_text, wangp_model, seed)
+        cache_key = await self.cache_key_for(settings, voice_id)
+
+        async def render():
+            generated_file = await run_native_wan2gp_job(job_id, settings, is_voice_clone=False, slot=slot)
+            # Rename into place (same filesystem as the job dir), no copy of the video
+            await asyncio.to_thread(place_wan2gp_output, generated_file, output_file)
+            # Simulated renders (no torch) must not be served once the real engine is installed
+            return not generated_file.stem.endswith("_mocked")
+
+        try:
+            # Identical requests reuse a finished render or join the one in progress
+            if await RESULT_CACHE.render_once(cache_key, output_file, render):
+                app_logger.info(f"[Wan2GP] Reused cached render {cache_key[:12]} for job {job_id}")
+            else:
+                app_logger.info(f"[Wan2GP] Native inference generated successfully at {output_file}")
+            return f"/api/jobs/{job_id}/result"
+        except Exception as e:
+            app_logger.error(f"[Wan2GP] Native Exec failed: {str(e)}")
+            raise e
+
+    @staticmethod
+    async def cache_key_for(settings: dict, voice_id) -> str | None:
+        """Result cache key of a wgp.py task, None when its seed is random (the render is not reproducible)."""
+        if settings["params"].get("seed", -1) < 0:
+            return None
+        return await asyncio.to_thread(RESULT_CACHE.key_for, settings["params"], {"voice": voice_id})
+
+    async def request_cache_key(self, voice_id, avatar_url, script_text, wangp_model="Wan t2v 1.3B", seed=None) -> str | None:
+        if seed is None:
+            return None # random seed, nothing to look up (and no avatar to fetch)
+        settings = await self.build_settings(voice_id, avatar_url, script_text, wangp_model, seed)
+        return await self.cache_key_for(settings, voice_id)
+
+    async def lookup_cached(self, job_id, cache_key) -> str | None:
+        """Returns the result URL when an identical request was already rendered (output placed for job_id), else None."""
+        if cache_key is not None and await RESULT_CACHE.lookup(cache_key, OUTPUTS_DIR / f"{job_id}_wan2gp.mp4"):
+            return f"/api/jobs/{job_id}/result"
+        return None
+
+    @staticmethod
+    def is_rendering(cache_key) -> bool:
+        return RESULT_CACHE.is_inflight(cache_key)
+
+    async def join_render(self, job_id, cache_key) -> str | None:
+        """Waits for the identical render in progress and returns the result URL, None if it failed."""
+        if await RESULT_CACHE.wait_inflight(cache_key, OUTPUTS_DIR / f"{job_id}_wan2gp.mp4"):
+            return f"/api/jobs/{job_id}/result"
+        return None
+
+    async def build_settings(self, voice_id, avatar_url, script_text, wangp_model="Wan t2v 1.3B", seed=None) -> dict:
+        """Builds the wgp.py task for a request (fetching the avatar image when it is a URL). Without a seed wgp.py draws a random one."""
         # Mapping frontend selection to actual Native WanGP models
-        frontend_model = wangp_model
-        model_type = "t2v_1.3B" # default fallback
-        is_avatar = False
-        
-        if "Hunyuan Avatar" in frontend_model:
-            model_type = "hunyuan_avatar"
-            is_avatar = True
-        elif "Multitalk" in frontend_model:
-            model_type = "multitalk"
-            is_avatar = True
-        elif "Fantasy" in frontend_model:
-            model_type = "fantasy"
-            is_avatar = True
-        elif "14B" in frontend_model:
-            model_type = "t2v"
-            
+        model_type, is_avatar = self.resolve_model_type(wangp_model)
+
         settings = {
             "id": 1,
             "params": {
@@ -64,28 +120,22 @@ class Wan2GPAdapter(BaseEngineAdapter):
                 "resolution": "480x832", # Portrait is good for humans
             }
         }
+        if seed is not None:
+            settings["params"]["seed"] = seed
         
         # Inject custom avatar prompts if this is an Avatar model
         if is_avatar:
             audio_path = voice_id
             img_path = avatar_url
-            import urllib.request
-            import tempfile
-            from urllib.parse import urlparse
 
             if img_path:
                 if img_path.startswith("http://") or img_path.startswith("https://"):
-                    app_logger.info(f"[Wan2GP] Downloading avatar image from {img_path}")
+                    app_logger.info(f"[Wan2GP] Fetching avatar image from {img_path}")
                     try:
-                        parsed_url = urlparse(img_path)
-                        ext = os.path.splitext(parsed_url.path)[1]
-                        if not ext:
-                            ext = ".jpg"
-                        tmp_img_file = tempfile.NamedTemporaryFile(delete=False, suffix=ext, dir=OUTPUTS_DIR)
-                        urllib.request.urlretrieve(img_path, tmp_img_file.name)
-                        tmp_img_file.close()
-                        img_path = tmp_img_file.name
-                        app_logger.info(f"[Wan2GP] Downloaded avatar to {img_path}")
+                        # Cached by URL and content hash; only re-downloaded when the ETag/size changes
+                        cached_path, _ = await ASSET_STORE.fetch_url(img_path, "avatars")
+                        img_path = str(cached_path)
+                        app_logger.info(f"[Wan2GP] Avatar available at {img_path}")
                     except Exception as e:
                         app_logger.error(f"[Wan2GP] Failed to download avatar image: {e}")
                         # Will pass original path, likely failing later
@@ -94,22 +144,4 @@ class Wan2GPAdapter(BaseEngineAdapter):
                 settings["params"]["image_prompt_type"] = "I" # Reference Image
             
             app_logger.info(f"[Wan2GP] Avatar Mode active. Audio Guide: {audio_path}")
-            
-        try:
-            generated_file = await run_native_wan2gp_job(job_id, settings, is_voice_clone=False)
-            
-            # Copy to final destination
-            import shutil
-            shutil.copy(generated_file, output_file)
-            
-            # Clean up temp folder
-            try:
-                shutil.rmtree(generated_file.parent)
-            except:
-                pass
-                
-            app_logger.info(f"[Wan2GP] Native inference generated successfully at {output_file}")
-            return f"/api/jobs/{job_id}/result"
-        except Exception as e:
-            app_logger.error(f"[Wan2GP] Native Exec failed: {str(e)}")
-            raise e
+        return settings
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import contextlib
 import multiprocessing
 from fastapi import FastAPI
@@ -18,9 +19,21 @@ async def lifespan(app: FastAPI):
     setup_environment()
     from backend.utils.downloader import download_mock_models
     download_mock_models()
+    from backend.services.job_service import JOB_SCHEDULER
+    from backend.utils.wan2gp_runner import resolve_worker_devices, configure_wan2gp_workers
+    devices = await asyncio.to_thread(resolve_worker_devices)
+    configure_wan2gp_workers(devices)
+    JOB_SCHEDULER.start(devices)
     yield
     # Shutdown
     app_logger.info("Shutting down All-in-one Backend MVP...")
+    await JOB_SCHEDULER.stop()
+    from backend.utils.wan2gp_runner import shutdown_wan2gp_worker
+    await shutdown_wan2gp_worker()
+    from backend.utils.model_downloader import MODEL_DOWNLOADS
+    MODEL_DOWNLOADS.cancel_all() # partial files resume on the next download request
+    from backend.storage.db import close_db
+    close_db()
 
 app = FastAPI(title="All-in-one Local Backend", version="0.1.0", lifespan=lifespan)
 
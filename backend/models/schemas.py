@@ -13,6 +13,7 @@ class CreateJobRequest(BaseModel):
     script_input: str = Field(min_length=1)
     preferred_engine: Literal["auto", "wan2gp", "infinitetalk"] = "auto"
     wangp_model: str = "Wan t2v 1.3B" # Changed to accept any string without validation failure
+    seed: int | None = Field(default=None, ge=0) # Fixed render seed; without one each render draws a random seed and is never cached
 
 class CreateJobResponse(BaseModel):
     job_id: str
@@ -32,13 +33,31 @@ class JobStatusResponse(BaseModel):
 
 class ModelStatusResponse(BaseModel):
     model_id: str
-    status: Literal["ready", "not_downloaded", "downloading"]
+    status: Literal["ready", "not_downloaded", "downloading", "failed"]
     progress: int
+    bytes_done: int = 0
+    bytes_total: int = 0
+    throughput: float = 0.0 # bytes per second
+    error: str | None = None
 
 class ModelDownloadRequest(BaseModel):
     model_id: str
 
 class ModelDownloadProgressResponse(BaseModel):
     model_id: str
-    status: Literal["ready", "not_downloaded", "downloading"]
+    status: Literal["ready", "not_downloaded", "downloading", "failed"]
     progress: int
+    bytes_done: int = 0
+    bytes_total: int = 0
+    throughput: float = 0.0 # bytes per second
+    error: str | None = None
+
+class QueueStatusResponse(BaseModel):
+    queue_depth: int
+    max_queue_size: int
+    concurrency: int
+    running: int
+    resident_model_types: list[str]
+    expected_model_switches: int
+    model_switches: int
+    slots: list[dict] = []
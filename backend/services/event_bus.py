@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+class _JobChannel:
+    def __init__(self):
+        self.last_id = 0
+        self.state: dict = {}
+        self.seeded = False # state holds the full job record, not only the updates seen so far
+        self.subscribers: list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+
+class JobEventBus:
+    """
+    In-process pub/sub for job progress.
+
+    Each channel keeps the latest merged job record and a per-job sequence id. Subscribers get
+    every later update as {"id": seq, "data": updates}; a client reconnecting with the id it last
+    saw only receives the current record if something changed meanwhile. publish() is
+    thread-safe; subscriber queues belong to the event loop they subscribed from.
+    """
+
+    def __init__(self, max_jobs: int = 1024):
+        self.max_jobs = max_jobs
+        self._channels: OrderedDict[str, _JobChannel] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _channel(self, job_id: str) -> _JobChannel:
+        channel = self._channels.get(job_id)
+        if channel is None:
+            channel = self._channels[job_id] = _JobChannel()
+            # Forget the oldest jobs nobody is listening to
+            for old_id in list(self._channels):
+                if len(self._channels) <= self.max_jobs:
+                    break
+                if not self._channels[old_id].subscribers:
+                    del self._channels[old_id]
+        else:
+            self._channels.move_to_end(job_id)
+        return channel
+
+    def seed(self, job_id: str, record: dict):
+        """Provides the full job record; updates already published take precedence over it."""
+        with self._lock:
+            channel = self._channel(job_id)
+            channel.state = {**record, **channel.state}
+            channel.seeded = True
+
+    def publish(self, job_id: str, updates: dict):
+        with self._lock:
+            channel = self._channel(job_id)
+            channel.last_id += 1
+            channel.state.update(updates)
+            event = {"id": channel.last_id, "data": dict(updates)}
+            subscribers = list(channel.subscribers)
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                pass # Subscriber loop already closed
+
+    def subscribe(self, job_id: str) -> tuple[asyncio.Queue, dict | None, int]:
+        """
+        Registers a listener from a running event loop.
+
+        Returns (queue, record, last_id): the queue receiving every later event, the current job
+        record (None if the bus has not been seeded with it yet) and the id of the latest event.
+        """
+        queue = asyncio.Queue()
+        with self._lock:
+            channel = self._channel(job_id)
+            channel.subscribers.append((asyncio.get_running_loop(), queue))
+            record = dict(channel.state) if channel.seeded else None
+            return queue, record, channel.last_id
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is not None:
+                channel.subscribers = [(loop, q) for loop, q in channel.subscribers if q is not queue]
+
+JOB_EVENTS = JobEventBus()
@@ -3,10 +3,15 @@ import traceback
 from backend.storage.db import update_job_status
 from backend.engines.wan2gp_adapter import Wan2GPAdapter
 from backend.engines.infinitetalk_adapter import InfiniteTalkAdapter
+from backend.services.scheduler import JobScheduler, QueueFullError
+from backend.utils.wan2gp_runner import get_wan2gp_slot_status
+from backend.utils.config import JOB_CONCURRENCY, JOB_QUEUE_SIZE, JOB_MAX_SKIPS
 from backend.utils.logger import worker_logger
 
 WAN2GP_ENGINE = Wan2GPAdapter()
 INFINITETALK_ENGINE = InfiniteTalkAdapter()
+# Jobs waiting for an identical render in progress (kept referenced until they finish)
+JOINING_TASKS: set[asyncio.Task] = set()
 
 class JobService:
     @staticmethod
@@ -34,21 +39,80 @@ class JobService:
             pass # Routine cancellation is fine
 
     @staticmethod
-    async def process_job_async(job_id: str, voice_id: str, avatar_url: str, script_text: str, preferred_engine: str, wangp_model: str = "Wan t2v 1.3B"):
+    async def submit_job(job_id: str, voice_id: str, avatar_url: str, script_text: str, preferred_engine: str, wangp_model: str = "Wan t2v 1.3B", seed: int | None = None):
+        """
+        Queues a job on the model-affinity scheduler. Raises QueueFullError when the queue is at capacity.
+
+        A wan2gp request with an explicit seed identical to one already rendered completes right away from
+        the result cache, one identical to a render in progress waits for it without taking a render slot.
+        """
+        if preferred_engine == "wan2gp":
+            try:
+                cache_key = await WAN2GP_ENGINE.request_cache_key(voice_id, avatar_url, script_text, wangp_model, seed)
+                result_url = await WAN2GP_ENGINE.lookup_cached(job_id, cache_key)
+            except Exception as e:
+                worker_logger.warning(f"Result cache lookup failed for {job_id}: {e}")
+                cache_key = result_url = None
+            if result_url:
+                update_job_status(job_id, {"status": "completed", "progress": 100, "message": "完成（复用已有结果）", "result_url": result_url})
+                worker_logger.info(f"Job {job_id} served from the result cache.")
+                return
+            if WAN2GP_ENGINE.is_rendering(cache_key):
+                task = asyncio.create_task(JobService._join_identical_render(job_id, cache_key, voice_id, avatar_url, script_text, preferred_engine, wangp_model, seed))
+                JOINING_TASKS.add(task)
+                task.add_done_callback(JOINING_TASKS.discard)
+                return
+        await JobService._schedule(job_id, voice_id, avatar_url, script_text, preferred_engine, wangp_model, seed)
+
+    @staticmethod
+    async def _join_identical_render(job_id: str, cache_key: str, voice_id: str, avatar_url: str, script_text: str, preferred_engine: str, wangp_model: str, seed: int | None):
+        """Completes a job with the output of the identical render in progress, queues it if that render fails."""
+        update_job_status(job_id, {"message": "等待相同任务完成..."})
+        try:
+            result_url = await WAN2GP_ENGINE.join_render(job_id, cache_key)
+        except Exception as e:
+            worker_logger.warning(f"Joining the identical render failed for {job_id}: {e}")
+            result_url = None
+        if result_url:
+            update_job_status(job_id, {"status": "completed", "progress": 100, "message": "完成（复用已有结果）", "result_url": result_url})
+            worker_logger.info(f"Job {job_id} served by an identical render.")
+            return
+        try:
+            await JobService._schedule(job_id, voice_id, avatar_url, script_text, preferred_engine, wangp_model, seed)
+        except QueueFullError:
+            update_job_status(job_id, {"status": "failed", "message": "任务队列已满，请稍后再试"})
+
+    @staticmethod
+    async def _schedule(job_id: str, voice_id: str, avatar_url: str, script_text: str, preferred_engine: str, wangp_model: str, seed: int | None):
+        model_type, _ = Wan2GPAdapter.resolve_model_type(wangp_model)
+        await JOB_SCHEDULER.submit(
+            job_id,
+            model_type,
+            voice_id=voice_id,
+            avatar_url=avatar_url,
+            script_text=script_text,
+            preferred_engine=preferred_engine,
+            wangp_model=wangp_model,
+            seed=seed
+        )
+
+    @staticmethod
+    async def process_job_async(job_id: str, voice_id: str, avatar_url: str, script_text: str, preferred_engine: str, wangp_model: str = "Wan t2v 1.3B", slot: int = 0, seed: int | None = None):
         """The main orchestration function running in the background."""
-        worker_logger.info(f"Worker picked up job {job_id} requesting engine '{preferred_engine}'")
+        worker_logger.info(f"Worker slot {slot} picked up job {job_id} requesting engine '{preferred_engine}'")
         update_job_status(job_id, {"status": "running", "message": "解析空间特征...", "progress": 10})
         
-        progress_task = asyncio.create_task(JobService._update_progress_loop(job_id))
+        primary_engine = JobService._get_engine(preferred_engine)
+        # Simulated steps only for engines without real progress, they would fight its updates
+        progress_task = None if primary_engine.reports_progress else asyncio.create_task(JobService._update_progress_loop(job_id))
 
         try:
-            primary_engine = JobService._get_engine(preferred_engine)
             selected_engine = primary_engine.name
             update_job_status(job_id, {"selected_engine": selected_engine})
             
             try:
                  # Attempt processing with the primary engine
-                 result_url = await primary_engine.process_job(job_id, voice_id, avatar_url, script_text, wangp_model)
+                 result_url = await primary_engine.process_job(job_id, voice_id, avatar_url, script_text, wangp_model, slot=slot, seed=seed)
             except Exception as e:
                 # Fallback Strategy: If infinitetalk fails, fallback to wan2gp natively.
                 if selected_engine == "infinitetalk":
@@ -64,12 +128,14 @@ class JobService:
                     })
                     
                     fallback_engine = JobService._get_engine("wan2gp")
-                    result_url = await fallback_engine.process_job(job_id, voice_id, avatar_url, script_text, wangp_model)
+                    if fallback_engine.reports_progress and progress_task is not None:
+                        progress_task.cancel()
+                    result_url = await fallback_engine.process_job(job_id, voice_id, avatar_url, script_text, wangp_model, slot=slot, seed=seed)
                 else:
                     raise e # No fallback available for wan2gp failure
 
             # Success Path
-            if not progress_task.done():
+            if progress_task is not None and not progress_task.done():
                 progress_task.cancel()
             update_job_status(job_id, {
                 "status": "completed",
@@ -80,7 +146,7 @@ class JobService:
             worker_logger.info(f"Job {job_id} successfully finalized using {selected_engine}.")
             
         except Exception as failed_err:
-            if not progress_task.done():
+            if progress_task is not None and not progress_task.done():
                 progress_task.cancel()
             err_trace = traceback.format_exc()
             worker_logger.error(f"Job {job_id} failed permanently.\n{err_trace}")
@@ -88,3 +154,11 @@ class JobService:
                 "status": "failed",
                 "message": f"遭遇致命错误: {str(failed_err)}"
             })
+
+JOB_SCHEDULER = JobScheduler(
+    JobService.process_job_async,
+    max_queue_size=JOB_QUEUE_SIZE,
+    concurrency=JOB_CONCURRENCY,
+    max_skips=JOB_MAX_SKIPS,
+    slot_status=get_wan2gp_slot_status
+)
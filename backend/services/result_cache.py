@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from backend.storage.assets import ASSET_STORE
+from backend.storage.db import get_cached_result, save_cached_result, touch_cached_result, delete_cached_results, list_cached_results
+from backend.utils.config import RESULT_CACHE_DIR, OUTPUTS_MAX_GB, RESULT_CACHE_ENABLED
+from backend.utils.logger import app_logger
+
+# Bump when the way settings are built changes what a given key renders
+CACHE_VERSION = 1
+
+def link_output(source: Path, target: Path):
+    """Gives target the content of source as a hardlink (no copy), copying only if links are unsupported."""
+    if target.exists():
+        target.unlink()
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class ResultCache:
+    """
+    Deduplicates renders of identical requests.
+
+    The key hashes the normalized generation params, with every input file replaced by its
+    content hash, plus the content hashes of inputs that are not in the params (the voice).
+    A finished render is hardlinked into cache_dir under its key, and a hit is hardlinked from
+    there to the new job's output name. Identical requests running at the same time share one
+    render. The cached links are kept under max_bytes by deleting the least recently used ones;
+    job outputs are separate links and stay downloadable.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _normalize(value):
+        if isinstance(value, str):
+            value = value.strip()
+            if value and not value.startswith(("http://", "https://", "data:")) and os.path.isfile(value):
+                return f"sha256:{ASSET_STORE.content_hash(value)}"
+            return value
+        if isinstance(value, dict):
+            return {k: ResultCache._normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [ResultCache._normalize(v) for v in value]
+        return value
+
+    def key_for(self, params: dict, inputs: dict | None = None) -> str:
+        """Hashes params and extra inputs (file paths are replaced by their content hash). Blocking."""
+        payload = {
+            "version": CACHE_VERSION,
+            "params": self._normalize(params),
+            "inputs": self._normalize(inputs or {}),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+    def _lookup_sync(self, key: str, output_file: Path) -> bool:
+        entry = get_cached_result(key)
+        if entry is None:
+            return False
+        source = Path(entry["path"])
+        if not source.exists():
+            delete_cached_results([key])
+            return False
+        link_output(source, output_file)
+        touch_cached_result(key, time.time())
+        return True
+
+    async def lookup(self, key: str, output_file: Path) -> bool:
+        """Places a cached render at output_file. Returns False on a miss."""
+        if not self.enabled:
+            return False
+        return await asyncio.to_thread(self._lookup_sync, key, output_file)
+
+    def is_inflight(self, key: str | None) -> bool:
+        return self.enabled and key is not None and key in self._inflight
+
+    async def wait_inflight(self, key: str, output_file: Path) -> bool:
+        """
+        Waits for the identical render in progress, if any, and places its output at output_file.
+        Returns False when there is none or when it failed.
+        """
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            return False
+        app_logger.info(f"[ResultCache] Waiting for identical render {key[:12]} already in progress")
+        source = await asyncio.shield(inflight)
+        if source is None:
+            return False
+        await asyncio.to_thread(link_output, source, output_file)
+        return True
+
+    async def render_once(self, key: str | None, output_file: Path, render) -> bool:
+        """
+        Produces output_file from the cache, from an identical in-flight render, or by awaiting
+        render() (which must write output_file, and returns False when the result must not be
+        cached). A None key (non reproducible render) always renders. Returns True when no
+        render was needed.
+        """
+        if not self.enabled or key is None:
+            await render()
+            return False
+
+        while True:
+            if await self.lookup(key, output_file):
+                return True
+            if not self.is_inflight(key):
+                break
+            if await self.wait_inflight(key, output_file):
+                return True
+            # The other render failed: try again ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if await render() is not False:
+                await asyncio.to_thread(self._store_sync, key, output_file)
+            future.set_result(output_file)
+        finally:
+            if not future.done():
+                future.set_result(None)
+            del self._inflight[key]
+        return False
+
+    def _store_sync(self, key: str, output_file: Path):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        cached_file = self.cache_dir / f"{key}{output_file.suffix}"
+        link_output(output_file, cached_file)
+        save_cached_result(key, str(cached_file), cached_file.stat().st_size, time.time())
+        self._evict_sync(keep=cached_file)
+
+    def _evict_sync(self, keep: Path | None = None):
+        """
+        Deletes the least recently used cached renders (never keep) until they fit in max_bytes.
+        Only the links in cache_dir are deleted: the job outputs sharing their data stay in place.
+        """
+        entries = []
+        for entry in list_cached_results():
+            path = Path(entry["path"])
+            if path.parent != self.cache_dir or not path.exists():
+                # Gone, or registered before renders got their own cache link (a job output): forget it
+                delete_cached_results([entry["cache_key"]])
+                continue
+            entries.append((entry["last_used_at"], entry["cache_key"], path, path.stat().st_size))
+
+        total = sum(size for _, _, _, size in entries)
+        for _, key, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError as e:
+                app_logger.warning(f"[ResultCache] Could not evict {path}: {e}")
+                continue
+            delete_cached_results([key])
+            total -= size
+            app_logger.info(f"[ResultCache] Evicted {path.name} ({size} bytes)")
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_DIR, int(OUTPUTS_MAX_GB * 1024 ** 3), enabled=RESULT_CACHE_ENABLED)
@@ -0,0 +1,200 @@
+import asyncio
+import time
+import traceback
+from dataclasses import dataclass, field
+from backend.utils.logger import worker_logger
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the scheduler queue is at capacity."""
+    pass
+
+@dataclass
+class ScheduledJob:
+    job_id: str
+    model_type: str
+    kwargs: dict
+    enqueued_at: float = field(default_factory=time.time)
+    skips: int = 0 # How many times a younger job was dispatched ahead of this one
+
+@dataclass
+class WorkerSlot:
+    """One render worker, normally bound to one GPU."""
+    index: int
+    device: str = "" # value passed to wgp.py --gpu, "" for the default device
+    resident_model_type: str | None = None
+    free_vram: int | None = None # bytes, as last reported by the worker
+    busy: bool = False
+
+def pick_next_index(model_types: list[str], skips: list[int], resident_model_type: str | None, max_skips: int, reserved: set | frozenset = frozenset()) -> int:
+    """
+    Chooses which queued job a slot should run next.
+
+    Jobs are kept in arrival order. A slot prefers the oldest job matching the model it already
+    has loaded, unless some older job has been passed over max_skips times (starvation bound),
+    in which case the oldest such job runs first. Otherwise it leaves jobs for models resident
+    on other idle slots (reserved) to those slots, and takes the oldest remaining job.
+    """
+    for i, job_skips in enumerate(skips):
+        if job_skips >= max_skips:
+            return i
+    if resident_model_type is not None:
+        for i, model_type in enumerate(model_types):
+            if model_type == resident_model_type:
+                return i
+    for i, model_type in enumerate(model_types):
+        if model_type not in reserved:
+            return i
+    return 0
+
+def order_idle_slots(slots: list[WorkerSlot], queued_model_types: set) -> list[WorkerSlot]:
+    """Slots holding a model some queued job needs go first, then the ones with the most free VRAM."""
+    return sorted(slots, key=lambda s: (s.resident_model_type not in queued_model_types, -(s.free_vram or 0), s.index))
+
+class JobScheduler:
+    """
+    Bounded, model-affinity job queue dispatching to one worker slot per device.
+
+    Each slot remembers the model_type its worker has loaded and pulls the next job sharing
+    that type, so queued "Hunyuan Avatar" / "Multitalk" / "t2v 1.3B" jobs are grouped instead of
+    forcing a checkpoint reload on every switch. With several idle slots, the one already holding
+    the needed model wins, then the one reporting the most free VRAM.
+
+    The runner is called as runner(job_id=..., slot=index, **kwargs); slot_status(index), when
+    given, returns the (resident_model_type, free_vram) reported by that slot's worker after a
+    job. Any coroutine works as runner, so dispatch can be exercised without GPUs.
+    """
+
+    def __init__(self, runner, max_queue_size: int = 32, concurrency: int = 1, max_skips: int = 3, slot_status=None):
+        self.runner = runner
+        self.max_queue_size = max_queue_size
+        self.max_skips = max_skips
+        self.slot_status = slot_status
+        self.slots = [WorkerSlot(index=i) for i in range(max(1, concurrency))]
+        self.running: dict[str, str] = {} # job_id -> model_type
+        self.model_switches = 0
+        self._queue: list[ScheduledJob] = []
+        self._tasks: set[asyncio.Task] = set()
+        self._started = False
+
+    @property
+    def concurrency(self) -> int:
+        return len(self.slots)
+
+    @property
+    def resident_model_types(self) -> list[str | None]:
+        return [slot.resident_model_type for slot in self.slots]
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._queue) >= self.max_queue_size
+
+    def start(self, devices: list[str] | None = None):
+        """Starts dispatching. devices, when given, creates one slot per device."""
+        if self._started:
+            return
+        if devices:
+            self.slots = [WorkerSlot(index=i, device=device) for i, device in enumerate(devices)]
+        self._started = True
+        worker_logger.info(f"Job scheduler started with {self.concurrency} slot(s) {[s.device or 'default' for s in self.slots]}, queue size {self.max_queue_size}")
+        self._dispatch()
+
+    async def stop(self):
+        self._started = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def submit(self, job_id: str, model_type: str, **kwargs):
+        if self.is_full:
+            raise QueueFullError(f"Job queue is full ({self.max_queue_size} jobs)")
+        self._queue.append(ScheduledJob(job_id=job_id, model_type=model_type, kwargs=kwargs))
+        worker_logger.info(f"Queued job {job_id} ({model_type}), queue depth {self.queue_depth}")
+        self._dispatch()
+
+    def expected_model_switches(self) -> int:
+        """Number of model reloads needed to drain the current queue under the affinity policy."""
+        resident = list(self.resident_model_types)
+        model_types = [job.model_type for job in self._queue]
+        skips = [job.skips for job in self._queue]
+        switches = 0
+        slot = 0
+        while model_types:
+            reserved = {m for i, m in enumerate(resident) if i != slot and m is not None}
+            index = pick_next_index(model_types, skips, resident[slot], self.max_skips, reserved)
+            for i in range(index):
+                skips[i] += 1
+            model_type = model_types.pop(index)
+            skips.pop(index)
+            if model_type != resident[slot]:
+                switches += 1
+                resident[slot] = model_type
+            slot = (slot + 1) % self.concurrency
+        return switches
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_size": self.max_queue_size,
+            "concurrency": self.concurrency,
+            "running": len(self.running),
+            "resident_model_types": [m for m in self.resident_model_types if m is not None],
+            "expected_model_switches": self.expected_model_switches(),
+            "model_switches": self.model_switches,
+            "slots": [
+                {"index": s.index, "device": s.device, "busy": s.busy, "resident_model_type": s.resident_model_type, "free_vram": s.free_vram}
+                for s in self.slots
+            ],
+        }
+
+    def _dispatch(self):
+        """Assigns queued jobs to idle slots until one of them runs out."""
+        while self._started and self._queue:
+            idle = [slot for slot in self.slots if not slot.busy]
+            if not idle:
+                return
+            idle = order_idle_slots(idle, {job.model_type for job in self._queue})
+            slot = idle[0]
+            reserved = {s.resident_model_type for s in idle[1:] if s.resident_model_type is not None}
+            index = pick_next_index(
+                [job.model_type for job in self._queue],
+                [job.skips for job in self._queue],
+                slot.resident_model_type,
+                self.max_skips,
+                reserved,
+            )
+            for job in self._queue[:index]:
+                job.skips += 1
+            job = self._queue.pop(index)
+            slot.busy = True
+            task = asyncio.create_task(self._run(slot, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, slot: WorkerSlot, job: ScheduledJob):
+        if job.model_type != slot.resident_model_type:
+            self.model_switches += 1
+        slot.resident_model_type = job.model_type
+        self.running[job.job_id] = job.model_type
+        worker_logger.info(f"Slot {slot.index} ({slot.device or 'default'}) dispatching job {job.job_id} ({job.model_type}) after {time.time() - job.enqueued_at:.1f}s in queue")
+        try:
+            await self.runner(job_id=job.job_id, slot=slot.index, **job.kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            worker_logger.error(f"Scheduler slot {slot.index} runner crashed on {job.job_id}.\n{traceback.format_exc()}")
+        finally:
+            self.running.pop(job.job_id, None)
+            if self.slot_status is not None:
+                # The worker knows what it really holds (fallback engines, failed loads, ...)
+                resident_model_type, free_vram = self.slot_status(slot.index)
+                if resident_model_type is not None:
+                    slot.resident_model_type = resident_model_type
+                if free_vram is not None:
+                    slot.free_vram = free_vram
+            slot.busy = False
+            self._dispatch()
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlparse
+from backend.utils.config import ASSETS_DIR
+from backend.utils.logger import app_logger
+
+CHUNK_SIZE = 1024 * 1024
+
+class AssetStore:
+    """
+    Content-addressed store for uploaded voices and avatar images.
+
+    Files live at {root}/{kind}/{sha256[:2]}/{sha256}{ext}, so identical content is stored once
+    and reused across jobs. Uploads and downloads are streamed in chunks while hashing, and all
+    blocking file/network I/O runs in worker threads to keep the event loop free.
+    Fetched URLs are remembered in {root}/url_cache with their ETag/Last-Modified and size, and
+    revalidated with a conditional GET instead of being downloaded again.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.url_cache_dir = root / "url_cache"
+
+    def path_for(self, kind: str, digest: str, ext: str) -> Path:
+        return self.root / kind / digest[:2] / f"{digest}{ext}"
+
+    def _new_temp_file(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        return tempfile.NamedTemporaryFile(delete=False, dir=self.root, suffix=".part")
+
+    def _commit(self, temp_path: str, kind: str, digest: str, ext: str) -> Path:
+        final_path = self.path_for(kind, digest, ext)
+        if final_path.exists():
+            # Same content already stored: keep the existing copy
+            os.remove(temp_path)
+        else:
+            final_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temp_path, final_path)
+        return final_path
+
+    def content_hash(self, path: str | Path) -> str:
+        """sha256 of a file's content; free for files of the store, whose name is their hash."""
+        path = Path(path)
+        try:
+            path.resolve().relative_to(self.root.resolve())
+            if len(path.stem) == 64:
+                return path.stem
+        except ValueError:
+            pass
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    async def save_upload(self, upload, kind: str, ext: str) -> tuple[Path, str]:
+        """Streams a FastAPI UploadFile into the store. Returns (path, sha256)."""
+        hasher = hashlib.sha256()
+        temp_file = await asyncio.to_thread(self._new_temp_file)
+        try:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                await asyncio.to_thread(temp_file.write, chunk)
+            await asyncio.to_thread(temp_file.close)
+            digest = hasher.hexdigest()
+            path = await asyncio.to_thread(self._commit, temp_file.name, kind, digest, ext)
+            return path, digest
+        except BaseException:
+            temp_file.close()
+            if os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
+            raise
+
+    async def fetch_url(self, url: str, kind: str, default_ext: str = ".jpg") -> tuple[Path, str]:
+        """Returns (path, sha256) of the content at url, downloading it only if it changed."""
+        return await asyncio.to_thread(self._fetch_url_sync, url, kind, default_ext)
+
+    def _fetch_url_sync(self, url: str, kind: str, default_ext: str) -> tuple[Path, str]:
+        cache_file = self.url_cache_dir / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+        cached = None
+        if cache_file.exists():
+            try:
+                cached = json.loads(cache_file.read_text(encoding="utf-8"))
+                cached_path = Path(cached["path"])
+                if not cached_path.exists() or cached_path.stat().st_size != cached["size"]:
+                    cached = None
+            except (ValueError, KeyError, OSError):
+                cached = None
+
+        request = urllib.request.Request(url)
+        if cached is not None:
+            if cached.get("etag"):
+                request.add_header("If-None-Match", cached["etag"])
+            if cached.get("last_modified"):
+                request.add_header("If-Modified-Since", cached["last_modified"])
+
+        try:
+            response = urllib.request.urlopen(request, timeout=30)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and cached is not None:
+                return Path(cached["path"]), cached["sha256"]
+            raise
+
+        with response:
+            headers = response.headers
+            expected_size = int(headers["Content-Length"]) if headers.get("Content-Length", "").isdigit() else None
+            # Servers without validators: reuse the cached copy when the size still matches
+            if cached is not None and not headers.get("ETag") and not headers.get("Last-Modified") and expected_size == cached["size"]:
+                return Path(cached["path"]), cached["sha256"]
+
+            ext = os.path.splitext(urlparse(url).path)[1] or default_ext
+            hasher = hashlib.sha256()
+            size = 0
+            temp_file = self._new_temp_file()
+            try:
+                with temp_file:
+                    while True:
+                        chunk = response.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                        temp_file.write(chunk)
+                        size += len(chunk)
+                if expected_size is not None and size != expected_size:
+                    raise IOError(f"Incomplete download of {url}: {size}/{expected_size} bytes")
+            except BaseException:
+                if os.path.exists(temp_file.name):
+                    os.remove(temp_file.name)
+                raise
+
+        digest = hasher.hexdigest()
+        path = self._commit(temp_file.name, kind, digest, ext)
+        self.url_cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps({
+            "url": url,
+            "path": str(path),
+            "sha256": digest,
+            "size": size,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }), encoding="utf-8")
+        app_logger.info(f"[Assets] Cached {url} as {path.name}")
+        return path, digest
+
+ASSET_STORE = AssetStore(ASSETS_DIR)
@@ -1,24 +1,182 @@
+import queue
 import sqlite3
+import threading
+import time
 from sqlite3 import Connection, Cursor
 from pathlib import Path
-from backend.utils.config import DB_PATH
+from backend.utils.config import DB_PATH, DB_PROGRESS_FLUSH_INTERVAL
 from backend.utils.logger import app_logger
+from backend.services.event_bus import JOB_EVENTS
+
+# Keys that only describe in-flight progress. Updates touching nothing else are coalesced.
+PROGRESS_KEYS = {"progress", "message"}
+
+INSERT_VOICE_SQL = "INSERT INTO voices (voice_id, engine, status) VALUES (?, ?, ?)"
+SELECT_VOICE_SQL = "SELECT * FROM voices WHERE voice_id = ?"
+SELECT_JOB_SQL = "SELECT * FROM jobs WHERE job_id = ?"
+SELECT_RESULT_SQL = "SELECT * FROM result_cache WHERE cache_key = ?"
+UPSERT_RESULT_SQL = '''
+    INSERT INTO result_cache (cache_key, path, size, last_used_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT(cache_key) DO UPDATE SET path = excluded.path, size = excluded.size, last_used_at = excluded.last_used_at
+'''
+INSERT_JOB_SQL = '''
+    INSERT INTO jobs (
+        job_id, voice_id, avatar_url, script_mode, script_input,
+        preferred_engine, selected_engine, status, progress, message, generated_script
+    ) VALUES (
+        :job_id, :voice_id, :avatar_url, :script_mode, :script_input,
+        :preferred_engine, :selected_engine, :status, :progress, :message, :generated_script
+    )
+'''
+
+_local = threading.local()
 
 def get_db_connection() -> Connection:
-    """Gets a connection to the SQLite database."""
+    """Opens a new WAL-mode connection to the SQLite database."""
     # Ensure the directory exists
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # WAL lets status polling read while the writer thread commits progress
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+def _read_connection() -> Connection:
+    """Returns this thread's long-lived read connection, so prepared statements are reused across calls."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = get_db_connection()
+        _local.conn = conn
     return conn
 
+class _JobStoreWriter:
+    """
+    Single writer thread owning the only write connection.
+
+    Inserts are executed in order and waited on by the caller. Job updates are merged into a
+    per-job pending dict; progress-only updates are flushed at most once per interval per job,
+    while any other change (status, result_url, ...) is flushed on the next loop iteration.
+    Updates being flushed stay visible to readers (_flushing) until their transaction commits, and
+    readers hold the lock across their row read and merge so they never miss a just-committed update.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._requests = queue.Queue()
+        self._pending: dict[str, dict] = {}
+        self._flushing: dict[str, dict] = {}
+        self._urgent: set[str] = set()
+        self._last_flush: dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def execute(self, sql: str, params):
+        """Runs a write statement on the writer thread and waits for its commit."""
+        self._ensure_started()
+        done = threading.Event()
+        result = {}
+        self._requests.put((sql, params, done, result))
+        done.wait()
+        if "error" in result:
+            raise result["error"]
+
+    def update_job(self, job_id: str, updates: dict):
+        self._ensure_started()
+        with self._lock:
+            self._pending.setdefault(job_id, {}).update(updates)
+            if not PROGRESS_KEYS.issuperset(updates):
+                self._urgent.add(job_id)
+        self._requests.put(None) # wake up the writer
+
+    def consistent_read(self) -> threading.RLock:
+        """Lock to hold while reading job rows and merging their pending updates."""
+        return self._lock
+
+    def pending_updates(self, job_id: str) -> dict:
+        with self._lock:
+            return {**self._flushing.get(job_id, {}), **self._pending.get(job_id, {})}
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._requests.put("stop")
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self):
+        conn = get_db_connection()
+        try:
+            while True:
+                try:
+                    request = self._requests.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    request = None
+
+                if request == "stop":
+                    self._flush(conn, force=True)
+                    return
+                if request is not None:
+                    sql, params, done, result = request
+                    try:
+                        conn.execute(sql, params)
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        result["error"] = e
+                    finally:
+                        done.set()
+                self._flush(conn)
+        finally:
+            conn.close()
+
+    def _flush(self, conn: Connection, force: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            due = {}
+            for job_id, updates in self._pending.items():
+                if force or job_id in self._urgent or now - self._last_flush.get(job_id, 0) >= self.flush_interval:
+                    due[job_id] = updates
+            for job_id in due:
+                del self._pending[job_id]
+                self._urgent.discard(job_id)
+                self._last_flush[job_id] = now
+            self._flushing.update(due)
+        if not due:
+            return
+
+        try:
+            for job_id, updates in due.items():
+                # Sorted keys keep the SQL text stable so sqlite reuses the prepared statement
+                keys = sorted(updates)
+                set_clauses = [f"{k} = ?" for k in keys] + ["updated_at = CURRENT_TIMESTAMP"]
+                query = f"UPDATE jobs SET {', '.join(set_clauses)} WHERE job_id = ?"
+                conn.execute(query, [updates[k] for k in keys] + [job_id])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            app_logger.error(f"Failed to flush job updates: {e}")
+        finally:
+            with self._lock:
+                for job_id in due:
+                    self._flushing.pop(job_id, None)
+
+_writer = _JobStoreWriter(DB_PROGRESS_FLUSH_INTERVAL)
+
 def init_db():
     """Initializes the database schemas."""
     app_logger.info("Initializing database schemas...")
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        
+
         # Jobs Table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS jobs (
@@ -39,7 +197,9 @@ def init_db():
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         ''')
-        
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at ON jobs (status, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)")
+
         # Voice Models Table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS voices (
@@ -49,7 +209,18 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         ''')
-        
+
+        # Rendered outputs reusable by identical requests (see backend/services/result_cache.py)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache (
+            cache_key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
         conn.commit()
         app_logger.info("Database schemas initialized.")
     except Exception as e:
@@ -58,65 +229,80 @@ def init_db():
     finally:
         conn.close()
 
+def close_db():
+    """Flushes coalesced job updates and stops the writer thread."""
+    _writer.close()
+
 def save_voice(voice_id: str, engine: str, status: str):
-    conn = get_db_connection()
-    try:
-        conn.execute(
-            "INSERT INTO voices (voice_id, engine, status) VALUES (?, ?, ?)",
-            (voice_id, engine, status)
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    _writer.execute(INSERT_VOICE_SQL, (voice_id, engine, status))
 
 def get_voice(voice_id: str) -> dict | None:
-    conn = get_db_connection()
-    try:
-        cursor = conn.execute("SELECT * FROM voices WHERE voice_id = ?", (voice_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    row = _read_connection().execute(SELECT_VOICE_SQL, (voice_id,)).fetchone()
+    return dict(row) if row else None
 
 def save_job(job_data: dict):
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO jobs (
-                job_id, voice_id, avatar_url, script_mode, script_input,
-                preferred_engine, selected_engine, status, progress, message, generated_script
-            ) VALUES (
-                :job_id, :voice_id, :avatar_url, :script_mode, :script_input,
-                :preferred_engine, :selected_engine, :status, :progress, :message, :generated_script
-            )
-        ''', job_data)
-        conn.commit()
-    finally:
-        conn.close()
+    _writer.execute(INSERT_JOB_SQL, job_data)
+    JOB_EVENTS.seed(job_data["job_id"], job_data)
 
 def update_job_status(job_id: str, updates: dict):
-    conn = get_db_connection()
-    try:
-        set_clauses = []
-        values = []
-        for k, v in updates.items():
-            set_clauses.append(f"{k} = ?")
-            values.append(v)
-            
-        set_clauses.append("updated_at = CURRENT_TIMESTAMP")
-        values.append(job_id)
-        
-        query = f"UPDATE jobs SET {', '.join(set_clauses)} WHERE job_id = ?"
-        conn.execute(query, values)
-        conn.commit()
-    finally:
-        conn.close()
+    """
+    Queues a job update on the writer thread without blocking the caller.
+
+    Progress-only updates are coalesced to one write per job per DB_PROGRESS_FLUSH_INTERVAL.
+    Reads through get_job/list_jobs see queued updates immediately, and every update is
+    published on the job event bus for streaming clients.
+    """
+    _writer.update_job(job_id, updates)
+    JOB_EVENTS.publish(job_id, updates)
 
 def get_job(job_id: str) -> dict | None:
-    conn = get_db_connection()
-    try:
-        cursor = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    with _writer.consistent_read():
+        row = _read_connection().execute(SELECT_JOB_SQL, (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job.update(_writer.pending_updates(job_id))
+    return job
+
+def list_jobs(status: str | None = None, limit: int = 50, offset: int = 0) -> list[dict]:
+    """Lists jobs newest first, optionally filtered by status (served by the status/created_at indexes)."""
+    conn = _read_connection()
+    with _writer.consistent_read():
+        if status:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (status, limit, offset)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job.update(_writer.pending_updates(job["job_id"]))
+            jobs.append(job)
+    return jobs
+
+def count_jobs_by_status() -> dict[str, int]:
+    rows = _read_connection().execute("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status").fetchall()
+    return {row["status"]: row["total"] for row in rows}
+
+def get_cached_result(cache_key: str) -> dict | None:
+    row = _read_connection().execute(SELECT_RESULT_SQL, (cache_key,)).fetchone()
+    return dict(row) if row else None
+
+def save_cached_result(cache_key: str, path: str, size: int, last_used_at: float):
+    _writer.execute(UPSERT_RESULT_SQL, (cache_key, path, size, last_used_at))
+
+def touch_cached_result(cache_key: str, last_used_at: float):
+    _writer.execute("UPDATE result_cache SET last_used_at = ? WHERE cache_key = ?", (last_used_at, cache_key))
+
+def delete_cached_results(cache_keys: list[str]):
+    for cache_key in cache_keys:
+        _writer.execute("DELETE FROM result_cache WHERE cache_key = ?", (cache_key,))
+
+def list_cached_results() -> list[dict]:
+    return [dict(row) for row in _read_connection().execute("SELECT * FROM result_cache").fetchall()]
@@ -0,0 +1,140 @@
+import hashlib
+import http.client
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from backend.utils import model_downloader
+from backend.utils.model_downloader import RangedDownload
+
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d+)")
+PAYLOAD = os.urandom(64 * 1024)
+
+class StandInServer:
+    """Local HTTP server standing in for the checkpoint host, with switchable Range support."""
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.accept_ranges = True
+        self.truncate_after = None # bytes sent per response before dropping the connection
+        self.served: list[tuple[int, int]] = [] # (start, end) of every body sent, end inclusive
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/model.safetensors"
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                size = len(stand_in.payload)
+                match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+                if match and stand_in.accept_ranges:
+                    start, end = int(match.group(1)), min(int(match.group(2)), size - 1)
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                    self.send_header("Accept-Ranges", "bytes")
+                else:
+                    start, end = 0, size - 1
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("ETag", '"stand-in"')
+                self.end_headers()
+
+                body = stand_in.payload[start:end + 1]
+                if stand_in.truncate_after is not None and len(body) > 1:
+                    body = body[:stand_in.truncate_after]
+                with stand_in._lock:
+                    stand_in.served.append((start, start + len(body) - 1))
+                try:
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass # the probe closes its response without reading the body
+                if len(body) < end - start + 1:
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def served_bytes(self, min_length: int = 2) -> int:
+        with self._lock:
+            return sum(end - start + 1 for start, end in self.served if end - start + 1 >= min_length)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+@pytest.fixture
+def server():
+    with StandInServer(PAYLOAD) as stand_in:
+        yield stand_in
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Lets a 64 KB payload be split into several ranges
+    monkeypatch.setattr(model_downloader, "CHUNK_SIZE", 1024)
+
+def test_multi_range_download(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    download = RangedDownload(server.url, dest, parts=4, expected_sha256=hashlib.sha256(PAYLOAD).hexdigest())
+
+    assert download.run() == dest
+    assert dest.read_bytes() == PAYLOAD
+    assert len(download.ranges) == 4
+    assert all(r["done"] == r["end"] - r["start"] + 1 for r in download.ranges)
+    assert not download.part_path.exists()
+    assert not download.state_path.exists()
+
+def test_resume_from_persisted_state(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    server.truncate_after = 5000
+    with pytest.raises((IOError, http.client.HTTPException)):
+        RangedDownload(server.url, dest, parts=4).run()
+
+    state = RangedDownload.read_state(dest)
+    assert state is not None and state["size"] == len(PAYLOAD)
+    resumed_bytes = sum(r["done"] for r in state["ranges"])
+    assert resumed_bytes > 0
+    assert not dest.exists()
+
+    # A new downloader (as after a restart) continues from the state left on disk
+    server.truncate_after = None
+    server.served.clear()
+    download = RangedDownload(server.url, dest, parts=4, expected_sha256=hashlib.sha256(PAYLOAD).hexdigest())
+    download.run()
+
+    assert dest.read_bytes() == PAYLOAD
+    assert server.served_bytes() == len(PAYLOAD) - resumed_bytes
+    assert not download.state_path.exists()
+
+def test_hash_mismatch(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    download = RangedDownload(server.url, dest, parts=4, expected_sha256="0" * 64)
+
+    with pytest.raises(ValueError, match="Hash mismatch"):
+        download.run()
+    # Corrupt data is discarded instead of being resumed
+    assert not dest.exists()
+    assert not download.part_path.exists()
+    assert not download.state_path.exists()
+
+def test_server_without_range_support(server, tmp_path):
+    server.accept_ranges = False
+    dest = tmp_path / "model.safetensors"
+    download = RangedDownload(server.url, dest, parts=4, expected_sha256=hashlib.sha256(PAYLOAD).hexdigest())
+
+    download.run()
+    assert dest.read_bytes() == PAYLOAD
+    assert len(download.ranges) == 1
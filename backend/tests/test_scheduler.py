@@ -0,0 +1,80 @@
+import asyncio
+from backend.services.scheduler import JobScheduler
+
+GB = 1024 ** 3
+
+class MockWorker:
+    """Stands in for a warm wgp worker: loads the job's model and reports what it holds."""
+
+    def __init__(self, resident_model_type: str | None, free_vram: int):
+        self.resident_model_type = resident_model_type
+        self.free_vram = free_vram
+
+class MockPool:
+    def __init__(self, *workers: MockWorker):
+        self.workers = list(workers)
+        self.dispatched: list[tuple[str, int]] = [] # (job_id, slot)
+
+    async def runner(self, job_id: str, slot: int, model: str):
+        self.dispatched.append((job_id, slot))
+        self.workers[slot].resident_model_type = model
+        await asyncio.sleep(0)
+
+    def slot_status(self, slot: int) -> tuple[str | None, int | None]:
+        worker = self.workers[slot]
+        return worker.resident_model_type, worker.free_vram
+
+def make_scheduler(pool: MockPool) -> JobScheduler:
+    scheduler = JobScheduler(pool.runner, concurrency=len(pool.workers), slot_status=pool.slot_status)
+    scheduler.start(devices=[str(i) for i in range(len(pool.workers))])
+    for slot, worker in zip(scheduler.slots, pool.workers):
+        slot.resident_model_type, slot.free_vram = worker.resident_model_type, worker.free_vram
+    return scheduler
+
+async def drain(scheduler: JobScheduler):
+    while scheduler.queue_depth or scheduler.running or any(slot.busy for slot in scheduler.slots):
+        await asyncio.sleep(0.01)
+    await scheduler.stop()
+
+def test_dispatch_prefers_resident_model():
+    async def scenario():
+        # The slot with the most free VRAM loses to the one already holding the model
+        pool = MockPool(MockWorker("hunyuan_avatar", 20 * GB), MockWorker("multitalk", 4 * GB))
+        scheduler = make_scheduler(pool)
+        await scheduler.submit("talk", "multitalk", model="multitalk")
+        await scheduler.submit("avatar", "hunyuan_avatar", model="hunyuan_avatar")
+        await drain(scheduler)
+        return pool, scheduler
+
+    pool, scheduler = asyncio.run(scenario())
+    assert dict(pool.dispatched) == {"talk": 1, "avatar": 0}
+    assert scheduler.model_switches == 0
+
+def test_dispatch_prefers_free_vram_without_resident_model():
+    async def scenario():
+        pool = MockPool(MockWorker("multitalk", 4 * GB), MockWorker("hunyuan_avatar", 12 * GB))
+        scheduler = make_scheduler(pool)
+        await scheduler.submit("t2v", "t2v_1.3B", model="t2v_1.3B")
+        await drain(scheduler)
+        return pool, scheduler
+
+    pool, scheduler = asyncio.run(scenario())
+    assert pool.dispatched == [("t2v", 1)]
+    assert scheduler.resident_model_types == ["multitalk", "t2v_1.3B"]
+
+def test_dispatch_follows_reported_worker_status():
+    async def scenario():
+        pool = MockPool(MockWorker(None, 16 * GB), MockWorker(None, 8 * GB))
+        scheduler = make_scheduler(pool)
+        # Loading the model costs slot 0 most of its VRAM, which its worker reports afterwards
+        pool.workers[0].free_vram = 2 * GB
+        await scheduler.submit("first", "multitalk", model="multitalk")
+        await drain(scheduler)
+        scheduler.start()
+        await scheduler.submit("second", "fantasy", model="fantasy")
+        await drain(scheduler)
+        return pool, scheduler
+
+    pool, scheduler = asyncio.run(scenario())
+    assert pool.dispatched == [("first", 0), ("second", 1)]
+    assert [slot.free_vram for slot in scheduler.slots] == [2 * GB, 8 * GB]
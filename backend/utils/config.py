@@ -17,12 +17,38 @@ DATA_DIR = EXEC_DIR / "data"
 UPLOADS_DIR = DATA_DIR / "uploads"
 CACHE_DIR = DATA_DIR / "cache"
 OUTPUTS_DIR = DATA_DIR / "outputs"
+RESULT_CACHE_DIR = OUTPUTS_DIR / "result_cache" # hardlinks to cached renders, on the same filesystem as the outputs
+ASSETS_DIR = DATA_DIR / "assets"
 LOGS_DIR = EXEC_DIR / "logs"
 
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
 
 DB_PATH = DATA_DIR / "sqlite.db"
+# Progress-only job updates are written at most once per job per interval (seconds)
+DB_PROGRESS_FLUSH_INTERVAL = float(os.getenv("DB_PROGRESS_FLUSH_INTERVAL", "1.0"))
 
 # Server configuration
 PORT = int(os.getenv("PORT", "8000"))
 HOST = os.getenv("HOST", "127.0.0.1")
+
+# Wan2GP execution: "persistent" keeps one warm wgp.py --serve worker alive between jobs,
+# "oneshot" spawns a fresh wgp.py --process per job.
+WAN2GP_WORKER_MODE = os.getenv("WAN2GP_WORKER_MODE", "persistent")
+
+# Job scheduling: one render slot per GPU, bounded queue, and how many times a queued job may be
+# overtaken by jobs for the already-loaded model before it is forced to run next.
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "1"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+JOB_MAX_SKIPS = int(os.getenv("JOB_MAX_SKIPS", "3"))
+
+# Render devices, one warm worker each: "auto" (every visible CUDA device), a list such as
+# "cuda:0,cuda:1", or empty for JOB_CONCURRENCY workers on the default device.
+WAN2GP_GPUS = os.getenv("WAN2GP_GPUS", "")
+
+# Result cache: identical requests reuse a finished render; the cached renders (links in RESULT_CACHE_DIR)
+# are trimmed, least recently used first, when they grow beyond OUTPUTS_MAX_GB. Job outputs are never deleted.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+OUTPUTS_MAX_GB = float(os.getenv("OUTPUTS_MAX_GB", "50"))
+
+# Model checkpoint downloads: number of concurrent byte ranges fetched per file
+MODEL_DOWNLOAD_PARTS = int(os.getenv("MODEL_DOWNLOAD_PARTS", "4"))
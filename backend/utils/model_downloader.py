@@ -0,0 +1,365 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from backend.utils.config import MODEL_DOWNLOAD_PARTS
+from backend.utils.logger import app_logger
+from backend.utils.wan2gp_runner import locate_wan2gp
+
+CHUNK_SIZE = 1024 * 1024
+STATE_SAVE_INTERVAL = 1.0 # seconds between persisted per-file state snapshots
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Frontend model names -> WanGP model definitions (wan2gp_core/defaults/{model_type}.json)
+MODEL_CATALOG = {
+    "Wan t2v 1.3B": "t2v_1.3B",
+    "Hunyuan Avatar": "hunyuan_avatar",
+    "Wan Multitalk": "multitalk",
+    "Wan FantasySpeaking": "fantasy",
+    "Wan t2v 14B": "t2v",
+    "LTX-2": "ltx2_19B",
+}
+
+def pick_checkpoint(choices: list[str]) -> str:
+    """Same default choice as wgp.get_model_filename: int8 (then fp8) quantized, bf16 preferred."""
+    if len(choices) <= 1:
+        return choices[0]
+    for token in ("int8", "fp8"):
+        quantized = [url for url in choices if token in os.path.basename(url).lower()]
+        if quantized:
+            bf16 = [url for url in quantized if "bf16" in os.path.basename(url).lower()]
+            return (bf16 or quantized)[0]
+    return choices[0]
+
+def resolve_model_files(defaults_dir: Path, model_type: str) -> list[str]:
+    """Returns the checkpoint URLs (transformer and modules) WanGP loads for a model type."""
+    urls = []
+    definition = json.loads((defaults_dir / f"{model_type}.json").read_text(encoding="utf-8"))["model"]
+    for module_choices in definition.get("modules", []):
+        if isinstance(module_choices, list) and module_choices:
+            urls.append(pick_checkpoint(module_choices))
+
+    choices = definition.get("URLs", [])
+    for _ in range(10):
+        # "URLs": "i2v" reuses the checkpoints of another model definition
+        if not isinstance(choices, str):
+            break
+        choices = json.loads((defaults_dir / f"{choices}.json").read_text(encoding="utf-8"))["model"].get("URLs", [])
+    if isinstance(choices, list) and choices:
+        urls.append(pick_checkpoint(choices))
+    return urls
+
+def verify_sha256(computed_hash: str, expected_hash: str | None):
+    """Raises ValueError on mismatch (same contract as wan2gp_core/shared/tools/sha256_verify.py)."""
+    if expected_hash is None:
+        return
+    expected_hash = expected_hash.lower().strip()
+    if computed_hash != expected_hash:
+        raise ValueError(f"Hash mismatch!\nExpected:  {expected_hash}\nComputed:  {computed_hash}")
+
+class _LinkedHeadersRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Keeps the headers of the redirect response: HuggingFace puts the LFS sha256 in X-Linked-Etag there."""
+
+    def __init__(self):
+        self.linked_headers = {}
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        for name in ("X-Linked-Etag", "X-Linked-Size"):
+            if headers.get(name):
+                self.linked_headers[name] = headers[name].strip('"')
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+class RangedDownload:
+    """
+    Resumable download of one file over several concurrent HTTP byte ranges.
+
+    Ranges are written into {dest}.part at their offsets, and their progress is persisted in
+    {dest}.download.json so an interrupted download continues where it stopped, also after a
+    restart. The sha256 is computed while downloading by following the contiguous completed
+    prefix of the file, and checked before the file is renamed to its final name.
+    """
+
+    def __init__(self, url: str, dest: Path, parts: int = 4, expected_sha256: str | None = None, timeout: float = 30):
+        self.url = url
+        self.dest = Path(dest)
+        self.part_path = self.dest.with_name(self.dest.name + ".part")
+        self.state_path = self.dest.with_name(self.dest.name + ".download.json")
+        self.parts = max(1, parts)
+        self.expected_sha256 = expected_sha256
+        self.timeout = timeout
+        self.size = 0
+        self.ranges: list[dict] = [] # [{"start", "end", "done"}], end inclusive
+        self.throughput = 0.0 # bytes/s, smoothed
+        self._lock = threading.Lock()
+        self._errors: list[BaseException] = []
+        self._cancelled = threading.Event()
+
+    @property
+    def bytes_done(self) -> int:
+        with self._lock:
+            return sum(r["done"] for r in self.ranges)
+
+    @staticmethod
+    def read_state(dest: Path) -> dict | None:
+        """Returns the persisted state of an unfinished download of dest, if any."""
+        state_path = Path(dest).with_name(Path(dest).name + ".download.json")
+        try:
+            return json.loads(state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _probe(self) -> tuple[int, str | None, bool]:
+        """Returns (size, validator, accepts_ranges) using a one-byte range request."""
+        handler = _LinkedHeadersRedirectHandler()
+        opener = urllib.request.build_opener(handler)
+        request = urllib.request.Request(self.url, headers={"Range": "bytes=0-0"})
+        with opener.open(request, timeout=self.timeout) as response:
+            headers = response.headers
+            content_range = headers.get("Content-Range", "")
+            if response.status == 206 and "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                size, accepts_ranges = int(content_range.rsplit("/", 1)[1]), True
+            else:
+                size, accepts_ranges = int(headers.get("Content-Length") or 0), False
+            validator = handler.linked_headers.get("X-Linked-Etag") or headers.get("ETag") or headers.get("Last-Modified")
+
+        linked_etag = (handler.linked_headers.get("X-Linked-Etag") or "").lower()
+        if self.expected_sha256 is None and SHA256_PATTERN.match(linked_etag):
+            self.expected_sha256 = linked_etag
+        return size, validator, accepts_ranges
+
+    def _plan(self, size: int, validator: str | None, accepts_ranges: bool):
+        state = self.read_state(self.dest)
+        if (state and accepts_ranges and state.get("url") == self.url and state.get("size") == size
+                and state.get("validator") == validator and self.part_path.exists()):
+            self.ranges = state["ranges"]
+            self.expected_sha256 = self.expected_sha256 or state.get("sha256")
+            app_logger.info(f"[Downloader] Resuming {self.dest.name} at {self.bytes_done}/{size} bytes")
+            return
+
+        parts = self.parts if accepts_ranges and size >= self.parts * CHUNK_SIZE else 1
+        step = -(-size // parts) if size else 0
+        self.ranges = [{"start": i * step, "end": min((i + 1) * step, size) - 1, "done": 0} for i in range(parts)]
+        self.dest.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.part_path, "wb") as f:
+            if size:
+                f.truncate(size)
+
+    def _save_state(self, validator: str | None):
+        with self._lock:
+            state = {"url": self.url, "size": self.size, "validator": validator, "sha256": self.expected_sha256, "ranges": [dict(r) for r in self.ranges]}
+        temp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        temp_path.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(temp_path, self.state_path)
+
+    def _fetch_range(self, byte_range: dict, use_range: bool):
+        try:
+            headers = {}
+            offset = byte_range["start"] + byte_range["done"]
+            if use_range:
+                if offset > byte_range["end"]:
+                    return
+                headers["Range"] = f"bytes={offset}-{byte_range['end']}"
+            request = urllib.request.Request(self.url, headers=headers)
+            with urllib.request.urlopen(request, timeout=self.timeout) as response, open(self.part_path, "r+b") as f:
+                f.seek(offset)
+                while not self._cancelled.is_set():
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    f.flush() # the hashing loop reads these bytes back through another handle
+                    with self._lock:
+                        byte_range["done"] += len(chunk)
+            if not self._cancelled.is_set() and self.size and byte_range["start"] + byte_range["done"] <= byte_range["end"]:
+                raise IOError(f"Connection closed early for range {byte_range['start']}-{byte_range['end']}")
+        except BaseException as e:
+            self._errors.append(e)
+            self._cancelled.set()
+
+    def _contiguous_end(self) -> int:
+        """Offset up to which the file has no holes."""
+        with self._lock:
+            end = 0
+            for r in self.ranges:
+                end = r["start"] + r["done"]
+                if end <= r["end"]:
+                    break
+            return end
+
+    def run(self, on_progress=None) -> Path:
+        """Downloads (or resumes) the file, verifies it and returns the final path."""
+        size, validator, accepts_ranges = self._probe()
+        self.size = size
+        self._plan(size, validator, accepts_ranges)
+
+        threads = [
+            threading.Thread(target=self._fetch_range, args=(r, accepts_ranges), name=f"download-{self.dest.name}-{i}", daemon=True)
+            for i, r in enumerate(self.ranges)
+        ]
+        for thread in threads:
+            thread.start()
+
+        hasher = hashlib.sha256()
+        hashed = 0
+        last_done, last_time, last_save = self.bytes_done, time.monotonic(), 0.0
+        # Unbuffered: a buffered reader would serve read-ahead bytes cached while they were still holes
+        with open(self.part_path, "rb", buffering=0) as reader:
+            while True:
+                alive = any(thread.is_alive() for thread in threads)
+                # Hash the bytes that became contiguous since the last pass (still in the page cache)
+                contiguous_end = self._contiguous_end() if size else self.bytes_done
+                reader.seek(hashed)
+                while hashed < contiguous_end:
+                    chunk = reader.read(min(CHUNK_SIZE, contiguous_end - hashed))
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    hashed += len(chunk)
+
+                now = time.monotonic()
+                done = self.bytes_done
+                if now > last_time:
+                    rate = (done - last_done) / (now - last_time)
+                    self.throughput = rate if self.throughput == 0 else 0.7 * self.throughput + 0.3 * rate
+                last_done, last_time = done, now
+                if now - last_save >= STATE_SAVE_INTERVAL or not alive:
+                    self._save_state(validator)
+                    last_save = now
+                if on_progress is not None:
+                    on_progress(done, size, self.throughput)
+                if not alive:
+                    break
+                time.sleep(0.5)
+
+        if self._errors:
+            raise self._errors[0]
+        if self._cancelled.is_set():
+            raise InterruptedError(f"Download of {self.dest.name} was cancelled")
+
+        try:
+            verify_sha256(hasher.hexdigest(), self.expected_sha256)
+        except ValueError:
+            # Corrupt data cannot be resumed: start over next time
+            self.part_path.unlink(missing_ok=True)
+            self.state_path.unlink(missing_ok=True)
+            raise
+        os.replace(self.part_path, self.dest)
+        self.state_path.unlink(missing_ok=True)
+        app_logger.info(f"[Downloader] {self.dest.name} downloaded and verified ({size} bytes, sha256 {hasher.hexdigest()[:12]}...)")
+        return self.dest
+
+class ModelDownloadManager:
+    """
+    Downloads WanGP checkpoints into the wan2gp_core checkpoint folder (where wgp.py looks first)
+    and reports real per-model progress from the files on disk and the running downloads.
+    """
+
+    def __init__(self, parts: int = 4):
+        self.parts = parts
+        self._active: dict[str, list[RangedDownload]] = {}
+        self._errors: dict[str, str] = {}
+        self._ckpts_dir = None
+        self._defaults_dir = None
+
+    def _locate(self):
+        if self._ckpts_dir is None:
+            repo_path, _, _ = locate_wan2gp()
+            self._ckpts_dir = repo_path / "ckpts"
+            self._defaults_dir = repo_path / "defaults"
+        return self._ckpts_dir, self._defaults_dir
+
+    def model_ids(self) -> list[str]:
+        return list(MODEL_CATALOG)
+
+    def files_for(self, model_id: str) -> list[tuple[str, Path]]:
+        ckpts_dir, defaults_dir = self._locate()
+        try:
+            urls = resolve_model_files(defaults_dir, MODEL_CATALOG[model_id])
+        except (OSError, ValueError, KeyError):
+            return []
+        return [(url, ckpts_dir / os.path.basename(url)) for url in urls]
+
+    def status(self, model_id: str) -> dict:
+        """Returns {"status", "progress", "bytes_done", "bytes_total", "throughput", "error"} for a model."""
+        files = self.files_for(model_id)
+        active = {download.dest: download for download in self._active.get(model_id, [])}
+        bytes_done = bytes_total = 0
+        throughput = 0.0
+        all_present = bool(files)
+        for _, dest in files:
+            if dest in active:
+                download = active[dest]
+                bytes_done += download.bytes_done
+                bytes_total += download.size
+                throughput += download.throughput
+                all_present = False
+            elif dest.exists():
+                size = dest.stat().st_size
+                bytes_done += size
+                bytes_total += size
+            else:
+                all_present = False
+                state = RangedDownload.read_state(dest)
+                if state:
+                    # Partial download left by an earlier run, resumed on the next request
+                    bytes_done += sum(r["done"] for r in state["ranges"])
+                    bytes_total += state["size"]
+
+        if model_id in self._active:
+            status = "downloading"
+        elif all_present:
+            status = "ready"
+        elif model_id in self._errors:
+            status = "failed"
+        else:
+            status = "not_downloaded"
+        progress = 100 if status == "ready" else int(bytes_done * 100 / bytes_total) if bytes_total else 0
+        return {
+            "status": status,
+            "progress": min(progress, 100),
+            "bytes_done": bytes_done,
+            "bytes_total": bytes_total,
+            "throughput": throughput,
+            "error": self._errors.get(model_id),
+        }
+
+    def is_downloading(self, model_id: str) -> bool:
+        return model_id in self._active
+
+    async def download(self, model_id: str):
+        """Downloads every missing checkpoint of a model (runs the transfers in worker threads)."""
+        if model_id in self._active:
+            return
+        self._errors.pop(model_id, None)
+        missing = [(url, dest) for url, dest in self.files_for(model_id) if not dest.exists()]
+        downloads = [RangedDownload(url, dest, parts=self.parts) for url, dest in missing]
+        self._active[model_id] = downloads
+        app_logger.info(f"[Downloader] Downloading {len(downloads)} file(s) for {model_id}")
+        try:
+            for download in downloads:
+                await asyncio.to_thread(download.run)
+        except asyncio.CancelledError:
+            for download in downloads:
+                download.cancel()
+            raise
+        except Exception as e:
+            app_logger.error(f"[Downloader] Download of {model_id} failed: {e}")
+            self._errors[model_id] = str(e)
+        finally:
+            del self._active[model_id]
+
+    def cancel_all(self):
+        """Stops running transfers; their persisted state lets them resume later."""
+        for downloads in self._active.values():
+            for download in downloads:
+                download.cancel()
+
+MODEL_DOWNLOADS = ModelDownloadManager(parts=MODEL_DOWNLOAD_PARTS)
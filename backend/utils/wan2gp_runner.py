@@ -1,23 +1,28 @@
 import asyncio
+import os
 import sys
 import json
 import re
+import shutil
+import subprocess
 from pathlib import Path
-from backend.utils.config import EXEC_DIR, OUTPUTS_DIR, DATA_DIR
+from backend.utils.config import EXEC_DIR, OUTPUTS_DIR, DATA_DIR, WAN2GP_WORKER_MODE, WAN2GP_GPUS, JOB_CONCURRENCY
 from backend.utils.logger import app_logger
+from backend.utils.wan2gp_worker import Wan2GPWorker, Wan2GPWorkerPool, split_worker_reply
 from backend.storage.db import update_job_status
 
-async def run_native_wan2gp_job(job_id, settings, is_voice_clone=False):
+PROGRESS_PATTERN = re.compile(r'(\d+)%')
+
+# Warm workers (persistent mode only), one per device slot, created lazily on their first job
+_worker_pool: Wan2GPWorkerPool | None = None
+_worker_devices: list[str] = [""]
+
+def locate_wan2gp():
     """
-    Executes a headless job via the bundled wan2gp_core/wgp.py script.
-    
-    Args:
-        job_id (str): The ID of the job or voice record.
-        settings (dict): The dictionary parameters to be written to job_queue.json.
-        is_voice_clone (bool): Whether this is updating a voice row instead of a job row.
+    Locates the bundled wan2gp_core and its Python interpreter.
     
     Returns:
-        Path: The path to the generated output file (mp4 or wav/audio), or raises RuntimeError.
+        tuple: (repo_path, venv_python, wgp_script)
     """
     if getattr(sys, 'frozen', False):
         env_root = Path(sys.executable).parent
@@ -44,7 +49,17 @@ async def run_native_wan2gp_job(job_id, settings, is_voice_clone=False):
             venv_python = repo_path / "python_env" / "python.exe"
             wgp_script = repo_path / "wgp.py"
 
-    import subprocess
+    return repo_path, venv_python, wgp_script
+
+def resolve_wan2gp_env():
+    """
+    Locates wan2gp_core and checks that its interpreter can import torch.
+
+    Returns:
+        tuple: (repo_path, venv_python, wgp_script, has_torch)
+    """
+    repo_path, venv_python, wgp_script = locate_wan2gp()
+
     has_torch = False
     if venv_python.exists():
         try:
@@ -54,13 +69,179 @@ async def run_native_wan2gp_job(job_id, settings, is_voice_clone=False):
         except:
             pass
 
+    return repo_path, venv_python, wgp_script, has_torch
+
+def discover_cuda_devices(venv_python: Path) -> list[str]:
+    """Asks the wan2gp interpreter how many CUDA devices it sees."""
+    try:
+        res = subprocess.run([str(venv_python), "-c", "import torch; print(torch.cuda.device_count())"], capture_output=True, timeout=60)
+        count = int(res.stdout.decode().strip().splitlines()[-1]) if res.returncode == 0 else 0
+    except Exception:
+        count = 0
+    return [f"cuda:{i}" for i in range(count)]
+
+def resolve_worker_devices() -> list[str]:
+    """
+    Returns the device of each render slot, from WAN2GP_GPUS:
+    "auto" -> one slot per visible CUDA device, "cuda:0,cuda:1" -> those devices,
+    empty -> JOB_CONCURRENCY slots on the default device.
+    """
+    if WAN2GP_GPUS.lower() == "auto":
+        _, venv_python, _ = locate_wan2gp()
+        devices = discover_cuda_devices(venv_python) if venv_python.exists() else []
+        if devices:
+            return devices
+        app_logger.warning("[Wan2GP-Runner] No CUDA device discovered, using the default device.")
+    elif WAN2GP_GPUS:
+        return [device.strip() for device in WAN2GP_GPUS.split(",") if device.strip()]
+    return [""] * max(1, JOB_CONCURRENCY)
+
+def configure_wan2gp_workers(devices: list[str]):
+    global _worker_devices
+    _worker_devices = devices or [""]
+    if _worker_pool is not None:
+        _worker_pool.configure(_worker_devices)
+
+def get_wan2gp_worker_pool(venv_python: Path, wgp_script: Path, repo_path: Path) -> Wan2GPWorkerPool:
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = Wan2GPWorkerPool(lambda device: Wan2GPWorker(venv_python, wgp_script, repo_path, gpu=device), _worker_devices)
+    return _worker_pool
+
+def get_wan2gp_slot_status(slot: int) -> tuple[str | None, int | None]:
+    """(resident model_type, free VRAM) of a slot's warm worker, for the scheduler."""
+    if _worker_pool is None:
+        return None, None
+    return _worker_pool.slot_status(slot)
+
+async def shutdown_wan2gp_worker():
+    """Stops the persistent workers, if any were started."""
+    if _worker_pool is not None:
+        await _worker_pool.stop_all()
+
+def handle_wan2gp_output_line(job_id, line_text, is_voice_clone=False):
+    """Parses one line of wgp.py console output into a job progress update."""
+    app_logger.debug(f"[Wan2GP-STDOUT] {line_text}")
+
+    # Check for progress indicators
+    match = PROGRESS_PATTERN.search(line_text)
+
+    # HuggingFace download regex: 'pytorch_model.bin:  45%' or 'Downloading: 25%'
+    is_downloading = "ownload" in line_text or ".safetensors" in line_text or ".bin" in line_text or ".pth" in line_text
+
+    if match:
+        try:
+            percent = int(match.group(1))
+            if is_voice_clone:
+                msg = f"语音克隆模型加载中: {percent}%..." if is_downloading else "正在提取特征..."
+                pass # We do not currently have a progress bar integer column for voice in the UI schema, just states.
+            else:
+                msg = f"正在下载庞大的AI模型 (请耐心等待...): {percent}%" if is_downloading else "正在渲染视频帧..."
+                # If downloading, scale progress from 0 to 10%. If rendering, scale from 10% to 90%
+                if is_downloading:
+                    overall_prog = int(percent * 0.1)
+                else:
+                    overall_prog = 10 + int(percent * 0.8)
+
+                update_job_status(job_id, {"progress": overall_prog, "message": msg})
+        except:
+            pass
+    elif "RuntimeError" in line_text or "Exception" in line_text:
+        app_logger.error(f"[Wan2GP-Runner] Error snippet caught: {line_text}")
+
+class Wan2GPProgress:
+    """
+    Turns wgp.py output into job status updates.
+
+    Render progress comes from the structured JSON events of the worker. Console lines are only
+    regex-scanned while a model is loading, which is when checkpoint download bars appear.
+    """
+
+    def __init__(self, job_id, is_voice_clone=False):
+        self.job_id = job_id
+        self.is_voice_clone = is_voice_clone
+        self.loading = True
+
+    def on_line(self, line_text):
+        if self.loading:
+            handle_wan2gp_output_line(self.job_id, line_text, self.is_voice_clone)
+        elif "RuntimeError" in line_text or "Exception" in line_text:
+            app_logger.error(f"[Wan2GP-Runner] Error snippet caught: {line_text}")
+
+    def on_event(self, event):
+        kind = event.get("event")
+        if kind == "status":
+            self.loading = event.get("phase") == "loading"
+            if self.loading and not self.is_voice_clone:
+                update_job_status(self.job_id, {"message": "正在加载AI模型..."})
+        elif kind == "progress":
+            self.loading = False
+            if self.is_voice_clone:
+                return
+            step = event.get("step") or 0
+            total_steps = max(event.get("total_steps") or 1, 1)
+            total_windows = max(event.get("total_windows") or 1, 1)
+            window_no = min(max(event.get("window_no") or 1, 1), total_windows)
+
+            # Rendering spans 10% to 90% across all sliding windows
+            fraction = (window_no - 1 + min(step / total_steps, 1)) / total_windows
+            details = f"步骤 {step}/{total_steps}"
+            if total_windows > 1:
+                details += f", 窗口 {window_no}/{total_windows}"
+            if event.get("eta") is not None:
+                details += f", 预计剩余 {format_eta(event['eta'])}"
+            update_job_status(self.job_id, {"progress": 10 + int(fraction * 80), "message": f"正在渲染视频帧 ({details})..."})
+        elif kind == "task_error":
+            app_logger.error(f"[Wan2GP-Runner] Task error reported by engine: {event.get('error')}")
+
+def format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60:02d}秒"
+    return f"{seconds}秒"
+
+def place_wan2gp_output(generated_file: Path, output_file: Path) -> Path:
+    """
+    Moves a finished render from its job directory to its final name and removes the job directory.
+
+    Job directories live under OUTPUTS_DIR, so this is an atomic rename on the same filesystem:
+    readers never see a partial file and multi-GB videos are not duplicated. A copy is only made
+    when the two paths are on different volumes.
+    """
+    try:
+        os.replace(generated_file, output_file)
+    except OSError:
+        # Cross-device: copy next to the destination, then rename into place
+        partial_file = output_file.with_name(output_file.name + ".part")
+        shutil.copyfile(generated_file, partial_file)
+        os.replace(partial_file, output_file)
+    shutil.rmtree(generated_file.parent, ignore_errors=True)
+    return output_file
+
+async def run_native_wan2gp_job(job_id, settings, is_voice_clone=False, slot=0):
+    """
+    Executes a headless job via the bundled wan2gp_core/wgp.py script.
+
+    In persistent mode the job is sent to a warm `wgp.py --serve` worker that keeps the
+    model loaded between jobs; in oneshot mode a fresh `wgp.py --process` is spawned.
+
+    Args:
+        job_id (str): The ID of the job or voice record.
+        settings (dict): The dictionary parameters to be written to job_queue.json.
+        is_voice_clone (bool): Whether this is updating a voice row instead of a job row.
+        slot (int): Scheduler slot, selects the device (and warm worker) that renders the job.
+
+    Returns:
+        Path: The path to the generated output file (mp4 or wav/audio), or raises RuntimeError.
+    """
+    repo_path, venv_python, wgp_script, has_torch = resolve_wan2gp_env()
+
     if not has_torch:
         app_logger.info(f"[Wan2GP] Python Env missing or broken (no torch). Simulating fallback.")
         app_logger.info(f"[Wan2GP] Awaiting GPU compute (simulated 5 secs over native repo)...")
         
         job_dir = OUTPUTS_DIR / f"{job_id}_tmp"
         job_dir.mkdir(parents=True, exist_ok=True)
-        import shutil
         sample_file = DATA_DIR / "models" / "sample.mp4"
         output_file = job_dir / f"{job_id}_mocked.mp4"
         
@@ -70,7 +251,10 @@ async def run_native_wan2gp_job(job_id, settings, is_voice_clone=False):
                 update_job_status(job_id, {"progress": 10 + i * 16, "message": "检测到环境不完整，已启动模拟渲染..."})
                 
         if sample_file.exists():
-            shutil.copy(sample_file, output_file)
+            try:
+                os.link(sample_file, output_file) # no need to duplicate the sample on disk
+            except OSError:
+                shutil.copy(sample_file, output_file)
         else:
             with open(output_file, 'wb') as f:
                 f.write(b"dummy video content")
@@ -82,64 +266,51 @@ async def run_native_wan2gp_job(job_id, settings, is_voice_clone=False):
     job_dir = OUTPUTS_DIR / f"{job_id}_tmp"
     job_dir.mkdir(parents=True, exist_ok=True)
     
-    # Create process settings list
-    queue_file = job_dir / "job_queue.json"
-    with open(queue_file, "w", encoding="utf-8") as f:
-        json.dump([settings], f) # wgp expects a list of jobs
+    tracker = Wan2GPProgress(job_id, is_voice_clone)
         
-    real_cmd = f'"{venv_python}" "{wgp_script}" --process "{queue_file}" --output-dir "{job_dir}"'
-    app_logger.info(f"[Wan2GP-Runner] Native PyTorch execution via: {real_cmd}")
+    generated_files = []
+    if WAN2GP_WORKER_MODE == "persistent":
+        worker = get_wan2gp_worker_pool(venv_python, wgp_script, repo_path).get(slot)
+        app_logger.info(f"[Wan2GP-Runner] Dispatching {job_id} to persistent worker {slot} on {worker.gpu or 'default device'} (resident model: {worker.loaded_model_type})")
+        reply = await worker.run_job(job_id, [settings], job_dir, on_line=tracker.on_line, on_event=tracker.on_event)
+        if not reply.get("success", False):
+            raise RuntimeError(f"Wan2GP worker failed to process job {job_id}")
+        generated_files = [Path(f) for f in reply.get("files", []) if Path(f).exists()]
+    else:
+        # Create process settings list
+        queue_file = job_dir / "job_queue.json"
+        with open(queue_file, "w", encoding="utf-8") as f:
+            json.dump([settings], f) # wgp expects a list of jobs
     
-    process = await asyncio.create_subprocess_shell(
-        real_cmd,
-        cwd=str(repo_path),
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.STDOUT
-    )
+        real_cmd = f'"{venv_python}" "{wgp_script}" --process "{queue_file}" --output-dir "{job_dir}" --json-progress'
+        device = _worker_devices[slot % len(_worker_devices)]
+        if device:
+            real_cmd += f' --gpu "{device}"'
+        app_logger.info(f"[Wan2GP-Runner] Native PyTorch execution via: {real_cmd}")
     
-    progress_pattern = re.compile(r'(\d+)%')
+        process = await asyncio.create_subprocess_shell(
+            real_cmd,
+            cwd=str(repo_path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
     
-    async for line in process.stdout:
-        line_text = line.decode(errors='replace').strip()
-        if not line_text:
-            continue
+        async for line in process.stdout:
+            line_text, event = split_worker_reply(line.decode(errors='replace').strip())
+            if line_text:
+                tracker.on_line(line_text)
+            if event is not None:
+                tracker.on_event(event)
         
-        app_logger.debug(f"[Wan2GP-STDOUT] {line_text}")
+        await process.wait()
         
-        # Check for progress indicators
-        match = progress_pattern.search(line_text)
-        
-        # HuggingFace download regex: 'pytorch_model.bin:  45%' or 'Downloading: 25%'
-        is_downloading = "ownload" in line_text or ".safetensors" in line_text or ".bin" in line_text or ".pth" in line_text
-        
-        if match:
-            try:
-                percent = int(match.group(1))
-                if is_voice_clone:
-                    msg = f"语音克隆模型加载中: {percent}%..." if is_downloading else "正在提取特征..."
-                    pass # We do not currently have a progress bar integer column for voice in the UI schema, just states.
-                else:    
-                    msg = f"正在下载庞大的AI模型 (请耐心等待...): {percent}%" if is_downloading else "正在渲染视频帧..."
-                    # If downloading, scale progress from 0 to 10%. If rendering, scale from 10% to 90%
-                    if is_downloading:
-                        overall_prog = int(percent * 0.1) 
-                    else:
-                        overall_prog = 10 + int(percent * 0.8)
-                        
-                    update_job_status(job_id, {"progress": overall_prog, "message": msg})
-            except:
-                pass
-        elif "RuntimeError" in line_text or "Exception" in line_text:
-            app_logger.error(f"[Wan2GP-Runner] Error snippet caught: {line_text}")
-
-    await process.wait()
-    
-    if process.returncode != 0:
-        raise RuntimeError(f"Wan2GP Process exited with code {process.returncode}")
+        if process.returncode != 0:
+            raise RuntimeError(f"Wan2GP Process exited with code {process.returncode}")
         
     # Find the output
     # Wan2GP TTS outputs audio formats. Video Gen outputs mp4.
-    generated_files = list(job_dir.glob("*.[mM][pP]4")) + list(job_dir.glob("*.[wW][aA][vV]"))
+    if not generated_files:
+        generated_files = list(job_dir.glob("*.[mM][pP]4")) + list(job_dir.glob("*.[wW][aA][vV]"))
     if not generated_files:
         app_logger.error(f"[Wan2GP-Runner] Native Exec succeeded but no output media found in {job_dir}")
         raise RuntimeError("Media file generation failed silently (no output produced by engine).")
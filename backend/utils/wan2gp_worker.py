@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import re
+from pathlib import Path
+from backend.utils.logger import app_logger
+
+# Must match WORKER_REPLY_PREFIX in wan2gp_core/wgp.py
+WORKER_REPLY_PREFIX = "@@wgp@@ "
+LINE_BREAK_PATTERN = re.compile(rb"[\r\n]")
+
+def split_worker_reply(line_text: str) -> tuple[str, dict | None]:
+    """
+    Separates console text from a worker reply on the same line.
+
+    Replies normally start a line, but may be glued after a carriage-return status line
+    or library output that did not end with a newline.
+    Returns (console_text, reply or None).
+    """
+    index = line_text.find(WORKER_REPLY_PREFIX)
+    if index < 0:
+        return line_text, None
+    try:
+        reply = json.loads(line_text[index + len(WORKER_REPLY_PREFIX):])
+    except json.JSONDecodeError:
+        return line_text, None
+    return line_text[:index].strip(), reply
+
+class Wan2GPWorker:
+    """
+    A long-lived `wgp.py --serve` process.
+
+    The worker imports torch and loads the model once, then receives jobs as JSON lines on stdin.
+    Consecutive jobs sharing a model_type reuse the resident model; wgp.py only calls
+    release_model()/load_models() when the type changes.
+    """
+
+    def __init__(self, venv_python: Path, wgp_script: Path, repo_path: Path, gpu: str = ""):
+        self.venv_python = venv_python
+        self.wgp_script = wgp_script
+        self.repo_path = repo_path
+        self.gpu = gpu
+        self.process = None
+        self.loaded_model_type = None
+        self.free_vram = None # bytes free on the worker's device, reported after each job
+        self._lock = asyncio.Lock()
+        self._pending = b""
+
+    @property
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        cmd = [str(self.venv_python), str(self.wgp_script), "--serve"]
+        if self.gpu:
+            cmd += ["--gpu", self.gpu]
+        app_logger.info(f"[Wan2GP-Worker] Starting persistent worker: {' '.join(cmd)}")
+
+        self._pending = b""
+        self.loaded_model_type = None
+        self.process = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=str(self.repo_path),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=dict(os.environ, PYTHONUNBUFFERED="1"),
+        )
+        reply = await self._wait_for_reply({"ready"})
+        self.free_vram = reply.get("free_vram")
+        app_logger.info(f"[Wan2GP-Worker] Worker ready on {self.gpu or 'default device'} (pid {reply.get('pid')})")
+
+    async def stop(self, timeout: float = 10):
+        if not self.is_running:
+            return
+        try:
+            await self._send({"cmd": "quit"})
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.process.kill()
+            await self.process.wait()
+        app_logger.info("[Wan2GP-Worker] Worker stopped.")
+
+    async def run_job(self, job_id: str, tasks: list, output_dir: Path, on_line=None, on_event=None) -> dict:
+        """
+        Sends one job to the worker and waits for its completion reply.
+
+        Structured progress events of the job (status, progress, output, ...) are forwarded to
+        on_event(reply) and any other console line to on_line(text).
+        Returns the "done" reply: {"success": bool, "files": [...], "model_type": str | None}.
+        """
+        async with self._lock:
+            if not self.is_running:
+                await self.start()
+            await self._send({"cmd": "process", "job_id": job_id, "tasks": tasks, "output_dir": str(output_dir)})
+            reply = await self._wait_for_reply({"done"}, job_id=job_id, on_line=on_line, on_event=on_event)
+            self.loaded_model_type = reply.get("model_type")
+            self.free_vram = reply.get("free_vram")
+            return reply
+
+    async def _send(self, request: dict):
+        self.process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+
+    async def _next_line(self) -> str | None:
+        # Split on "\r" as well as "\n" so carriage-return progress bars are seen as they update.
+        while True:
+            match = LINE_BREAK_PATTERN.search(self._pending)
+            if match:
+                line, self._pending = self._pending[:match.start()], self._pending[match.end():]
+                return line.decode(errors="replace")
+            chunk = await self.process.stdout.read(4096)
+            if not chunk:
+                line, self._pending = self._pending, b""
+                return line.decode(errors="replace") if line else None
+            self._pending += chunk
+
+    async def _wait_for_reply(self, events: set, job_id: str | None = None, on_line=None, on_event=None) -> dict:
+        while True:
+            line_text = await self._next_line()
+            if line_text is None:
+                returncode = await self.process.wait()
+                raise RuntimeError(f"Wan2GP worker exited with code {returncode}")
+
+            line_text, reply = split_worker_reply(line_text.strip())
+            if line_text:
+                if on_line is not None:
+                    on_line(line_text)
+                else:
+                    app_logger.debug(f"[Wan2GP-Worker] {line_text}")
+            if reply is None:
+                continue
+
+            if job_id is not None and reply.get("job_id") != job_id:
+                continue
+            if reply.get("event") == "error":
+                raise RuntimeError(f"Wan2GP worker error: {reply.get('error')}")
+            if reply.get("event") in events:
+                return reply
+            if on_event is not None:
+                on_event(reply)
+
+class Wan2GPWorkerPool:
+    """
+    One persistent worker per device slot, started lazily on the slot's first job.
+
+    factory(device) builds the worker of a slot; any object with run_job/stop and the
+    loaded_model_type/free_vram attributes can stand in for Wan2GPWorker (e.g. on CPU-only boxes).
+    """
+
+    def __init__(self, factory, devices: list[str] | None = None):
+        self.factory = factory
+        self.devices = devices or [""]
+        self._workers: dict[int, Wan2GPWorker] = {}
+
+    def configure(self, devices: list[str]):
+        self.devices = devices or [""]
+
+    def get(self, slot: int) -> Wan2GPWorker:
+        worker = self._workers.get(slot)
+        if worker is None:
+            worker = self._workers[slot] = self.factory(self.devices[slot % len(self.devices)])
+        return worker
+
+    def slot_status(self, slot: int) -> tuple[str | None, int | None]:
+        """Returns (resident model_type, free VRAM bytes) of a slot's worker, None when unknown."""
+        worker = self._workers.get(slot)
+        if worker is None:
+            return None, None
+        return worker.loaded_model_type, worker.free_vram
+
+    async def stop_all(self):
+        await asyncio.gather(*(worker.stop() for worker in self._workers.values()), return_exceptions=True)
+        self._workers.clear()
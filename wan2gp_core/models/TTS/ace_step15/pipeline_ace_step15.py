@@ -155,7 +155,7 @@ class ACEStep15Pipeline:
         self._load_tokenizers()
         self._load_text_encoder_2()
         self._load_silence_latent()
-        self.lm_code_cache = TextEncoderCache()
+        self.lm_code_cache = TextEncoderCache(persistent=False)
         self._lm_engine_impl: Qwen3LmEngine | None = None
         self._lm_last_failure_reason = ""
         self.lm_model = None
@@ -336,7 +336,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
                 return list(zip(prompt_embeds, attention_mask))
 
             prompt_list = prompt if isinstance(prompt, list) else [prompt]
-            cache_keys = [(id(text_encoder), name, data_type, clip_skip, text_encoder.max_length, text) for text in prompt_list]
+            cache_keys = [(text_encoder.text_encoder_type, name, data_type, clip_skip, text_encoder.max_length, text) for text in prompt_list]
             prompt_contexts = self.text_encoder_cache.encode(encode_fn, prompt_list, device=device, cache_keys=cache_keys)
             prompt_embeds = torch.stack([ctx[0] for ctx in prompt_contexts], dim=0)
             attention_mask = prompt_contexts[0][1]
@@ -400,7 +400,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
                     return [(negative_prompt_embeds[i], None) for i in range(negative_prompt_embeds.shape[0])]
                 return list(zip(negative_prompt_embeds, negative_attention_mask))
 
-            cache_keys = [("uncond", id(text_encoder), name, data_type, text_encoder.max_length, text) for text in uncond_tokens]
+            cache_keys = [("uncond", text_encoder.text_encoder_type, name, data_type, text_encoder.max_length, text) for text in uncond_tokens]
             negative_contexts = self.text_encoder_cache.encode(encode_uncond_fn, uncond_tokens, device=device, cache_keys=cache_keys)
             negative_prompt_embeds = torch.stack([ctx[0] for ctx in negative_contexts], dim=0)
             negative_attention_mask = negative_contexts[0][1]
@@ -534,7 +534,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
                     return list(zip(prompt_embeds, attention_mask))
 
                 prompt_list = prompt if isinstance(prompt, list) else [prompt]
-                cache_keys = [(id(text_encoder), name, data_type, clip_skip, lora_scale, text) for text in prompt_list]
+                cache_keys = [(text_encoder.text_encoder_type, name, data_type, clip_skip, lora_scale, text) for text in prompt_list]
                 prompt_contexts = self.text_encoder_cache.encode(encode_fn, prompt_list, device=device, cache_keys=cache_keys)
                 prompt_embeds = torch.stack([ctx[0] for ctx in prompt_contexts], dim=0)
                 attention_mask = prompt_contexts[0][1]
@@ -623,7 +623,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
                         return [(negative_prompt_embeds[i], None) for i in range(negative_prompt_embeds.shape[0])]
                     return list(zip(negative_prompt_embeds, negative_attention_mask))
 
-                cache_keys = [("uncond", id(text_encoder), name, data_type, lora_scale, text) for text in uncond_tokens]
+                cache_keys = [("uncond", text_encoder.text_encoder_type, name, data_type, lora_scale, text) for text in uncond_tokens]
                 negative_contexts = self.text_encoder_cache.encode(encode_uncond_fn, uncond_tokens, device=device, cache_keys=cache_keys)
                 negative_prompt_embeds = torch.stack([ctx[0] for ctx in negative_contexts], dim=0)
                 negative_attention_mask = negative_contexts[0][1]
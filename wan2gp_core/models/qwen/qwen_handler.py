@@ -26,6 +26,7 @@ class family_handler():
 
         if base_model_type in ["qwen_image_layered_20B"]:
             extra_model_def["batch_size_label"] = "Number of Layers"
+            extra_model_def["no_batched_repeats"] = True
             extra_model_def["set_video_prompt_type"] = "V"
             extra_model_def["guide_preprocessing"] = {
                 "selection": ["V"],
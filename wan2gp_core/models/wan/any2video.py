@@ -47,6 +47,7 @@ from .wanmove.trajectory import replace_feature, create_pos_feature_map
 from .alpha.utils import load_gauss_mask, apply_alpha_shift
 from shared.utils.audio_video import save_video
 from shared.utils.text_encoder_cache import TextEncoderCache
+from shared.utils.prepared_checkpoints import get_prepared_checkpoints
 from shared.utils.self_refiner import PnPHandler, create_self_refiner_handler
 from mmgp import safetensors2
 from shared.utils import files_locator as fl 
@@ -179,6 +180,22 @@ class WanAny2V:
             return WanModel.preprocess_sd_with_dtype(dtype, sd)
         kwargs= { "modelClass": WanModel,"do_quantize": quantizeTransformer and not save_quantized, "defaultConfigPath": base_config_file , "ignore_unused_weights": ignore_unused_weights, "writable_tensors": False, "default_dtype": dtype, "preprocess_sd": preprocess_sd, "forcedConfigPath": forcedConfigPath, }
         kwargs_light= { "modelClass": WanModel,"writable_tensors": False, "preprocess_sd": preprocess_sd , "forcedConfigPath" : base_config_file}
+        prepared_checkpoints = get_prepared_checkpoints()
+        prepared_options = {"dtype": str(dtype), "quantize": kwargs["do_quantize"], "mixed_precision": mixed_precision_transformer, "ignore_unused_weights": ignore_unused_weights, "config": base_config_file}
+        prepared_sources = {}
+        def load_transformer(filenames, modules = None):
+            # only worth it when the load does more than mapping one file: modules to merge or weights to quantize
+            sources = filenames + (modules or [])
+            modules_kwargs = {} if modules is None else {"modules": modules}
+            if prepared_checkpoints is None or not (len(sources) > 1 or kwargs["do_quantize"]):
+                return offload.fast_load_transformers_model(filenames, **modules_kwargs, **kwargs)
+            prepared_path = prepared_checkpoints.find(sources, **prepared_options)
+            if prepared_path is not None:
+                print(f"Loading prepared checkpoint '{prepared_path}'")
+                return offload.fast_load_transformers_model(prepared_path, modelClass= WanModel, writable_tensors= False, default_dtype= dtype, preprocess_sd= preprocess_sd, defaultConfigPath= base_config_file)
+            model = offload.fast_load_transformers_model(filenames, **modules_kwargs, **kwargs)
+            prepared_sources[id(model)] = sources
+            return model
         if module_source is not None:
             self.model = offload.fast_load_transformers_model(model_filename[:1] + [fl.locate_file(module_source)], **kwargs)
         if module_source2 is not None:
@@ -204,11 +221,11 @@ class WanAny2V:
                 else:
                     modules_for_1 =[ file_name for file_name, submodel_no in zip(model_filename[2:],submodel_no_list[2:] ) if submodel_no ==1 ]
                     modules_for_2 =[ file_name for file_name, submodel_no in zip(model_filename[2:],submodel_no_list[2:] ) if submodel_no ==2 ]
-                    self.model = offload.fast_load_transformers_model(model_filename[:1], modules = modules_for_1, **kwargs)
-                    self.model2 = offload.fast_load_transformers_model(model_filename[1:2], modules = modules_for_2, **kwargs)
+                    self.model = load_transformer(model_filename[:1], modules = modules_for_1)
+                    self.model2 = load_transformer(model_filename[1:2], modules = modules_for_2)
 
             else:
-                self.model = offload.fast_load_transformers_model(model_filename,  **kwargs)
+                self.model = load_transformer(model_filename)
         
 
         if self.model is not None:
@@ -219,6 +236,9 @@ class WanAny2V:
             self.model2.lock_layers_dtypes(torch.float32 if mixed_precision_transformer else dtype)
             offload.change_dtype(self.model2, dtype, True)
             self.model2.eval().requires_grad_(False)
+        for model in [self.model, self.model2]:
+            if model is not None and id(model) in prepared_sources:
+                prepared_checkpoints.save(model, prepared_sources[id(model)], **prepared_options)
 
         if module_source is not None:
             save_model(self.model, model_type, dtype, None, is_module=True, filter=list(torch_load_file(module_source)), module_source_no=1)
@@ -1397,8 +1417,13 @@ class WanAny2V:
         if image_outputs :
             x0 = [x[:,:1] for x in x0 ]
 
-        videos = self.vae.decode(x0, VAE_tile_size)
         any_vae2= self.vae2 is not None
+        color_correction = color_correction_strength > 0 and (window_start_frame_no + prefix_frames_count) >1 and color_reference_frame is not None
+        if isinstance(self.vae, WanVAE) and not (image_outputs or any_vae2 or alpha_class or color_correction):
+            # nothing left to process in float: frames go straight from the decoder to a uint8 cpu buffer
+            videos = self.vae.decode(x0, VAE_tile_size, to_uint8 = True)
+        else:
+            videos = self.vae.decode(x0, VAE_tile_size)
         if any_vae2:
             videos2 = self.vae2.decode(x0, VAE_tile_size)
 
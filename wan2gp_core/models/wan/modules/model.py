@@ -14,6 +14,7 @@ from typing import Union,Optional
 from mmgp import offload
 from mmgp.offload import get_cache, clear_caches
 from shared.attention import pay_attention
+from shared.utils.step_cache_profiles import solve_magcache_threshold, solve_teacache_threshold
 from torch.backends.cuda import sdp_kernel
 from ..multitalk.multitalk_utils import get_attn_map_with_target
 from ..animate.motion_encoder import Generator
@@ -1333,97 +1334,32 @@ class WanModel(ModelMixin, ConfigMixin):
         else:
             skips_step_cache.mag_ratios = def_mag_ratios
 
-
-        best_deltas = None
-        best_threshold = 0.01
-        best_diff = 1000
-        best_signed_diff = 1000
-        target_nb_steps= int(len(timesteps) / speed_factor)
-        threshold = 0.01
-        x_id_max = 1
-        while threshold <= 0.6:
-            nb_steps = 0
-            diff = 1000
-            accumulated_err, accumulated_steps, accumulated_ratio = [0] * x_id_max , [0] * x_id_max, [1.0] * x_id_max
-            for i, t in enumerate(timesteps):
-                if i<=start_step:
-                    skip  = False
-                    x_should_calc = [True] * x_id_max
-                else:
-                    x_should_calc = []
-                    for cur_x_id in range(x_id_max):
-                        cur_mag_ratio = skips_step_cache.mag_ratios[i * 2 + cur_x_id] # conditional and unconditional in one list
-                        accumulated_ratio[cur_x_id] *= cur_mag_ratio # magnitude ratio between current step and the cached step
-                        accumulated_steps[cur_x_id] += 1 # skip steps plus 1
-                        cur_skip_err = np.abs(1-accumulated_ratio[cur_x_id]) # skip error of current steps
-                        accumulated_err[cur_x_id] += cur_skip_err # accumulated error of multiple steps
-                        if accumulated_err[cur_x_id]<threshold and accumulated_steps[cur_x_id]<=skips_step_cache.magcache_K:
-                            skip  = True
-                        else:
-                            skip  = False
-                            accumulated_err[cur_x_id], accumulated_steps[cur_x_id], accumulated_ratio[cur_x_id] = 0, 0, 1.0
-                        x_should_calc.append(not skip)
-                if not skip:
-                    nb_steps += 1
-                    signed_diff = target_nb_steps - nb_steps               
-                    diff = abs(signed_diff)  
-            if diff < best_diff:
-                best_threshold = threshold
-                best_diff = diff
-                best_signed_diff = signed_diff
-            elif diff > best_diff:
-                break
-            threshold += 0.01
+        if getattr(skips_step_cache, "calibration", None) is not None:
+            # calibration run: every step is computed to measure the real ratios
+            skips_step_cache.magcache_thresh = 0
+            print(f"Mag Cache, calibrating: no step will be skipped")
+            return 0
+        best_threshold, nb_steps = solve_magcache_threshold(skips_step_cache.mag_ratios, start_step, speed_factor, skips_step_cache.magcache_K)
         skips_step_cache.magcache_thresh = best_threshold
-        print(f"Mag Cache, best threshold found:{best_threshold:0.2f} with gain x{len(timesteps)/(target_nb_steps - best_signed_diff):0.2f} for a target of x{speed_factor}")
+        print(f"Mag Cache, best threshold found:{best_threshold:0.3f} with gain x{len(timesteps)/nb_steps:0.2f} for a target of x{speed_factor}")
         return best_threshold
 
     def compute_teacache_threshold(self, start_step, timesteps = None, speed_factor =0): 
         skips_step_cache = self.cache
+        if getattr(skips_step_cache, "calibration", None) is not None:
+            skips_step_cache.rel_l1_thresh = 0
+            print(f"Tea Cache, calibrating: no step will be skipped")
+            return 0
         modulation_dtype = self.time_projection[1].weight.dtype
         rescale_func = np.poly1d(skips_step_cache.coefficients)
-        e_list = []
-        for t in timesteps:
-            t = torch.stack([t])
-            time_emb =  self.time_embedding( sinusoidal_embedding_1d(self.freq_dim, t.flatten()).to(modulation_dtype) )  # b, dim   
-            e_list.append(time_emb)
-        best_deltas = None
-        best_threshold = 0.01
-        best_diff = 1000
-        best_signed_diff = 1000
-        target_nb_steps= int(len(timesteps) / speed_factor)
-        threshold = 0.01
-        while threshold <= 0.6:
-            accumulated_rel_l1_distance =0
-            nb_steps = 0
-            diff = 1000
-            deltas = []
-            for i, t in enumerate(timesteps):
-                skip = False    
-                if not (i<=start_step or i== len(timesteps)-1):
-                    delta = abs(rescale_func(((e_list[i]-e_list[i-1]).abs().mean() / e_list[i-1].abs().mean()).cpu().item()))
-                    # deltas.append(delta)
-                    accumulated_rel_l1_distance += delta
-                    if accumulated_rel_l1_distance < threshold:
-                        skip = True
-                        # deltas.append("SKIP")
-                    else:
-                        accumulated_rel_l1_distance = 0
-                if not skip:
-                    nb_steps += 1
-                    signed_diff = target_nb_steps - nb_steps               
-                    diff = abs(signed_diff)  
-            if diff < best_diff:
-                best_threshold = threshold
-                best_deltas = deltas
-                best_diff = diff
-                best_signed_diff = signed_diff
-            elif diff > best_diff:
-                break
-            threshold += 0.01
+        # all the timesteps embeddings in one pass and a single transfer to the cpu
+        t = torch.stack([t for t in timesteps]).flatten()
+        e = self.time_embedding( sinusoidal_embedding_1d(self.freq_dim, t).to(modulation_dtype) ).float() # steps, dim
+        rel_l1 = ((e[1:] - e[:-1]).abs().mean(dim=1) / e[:-1].abs().mean(dim=1)).cpu().numpy()
+        deltas = np.abs(rescale_func(np.concatenate([[0.], rel_l1])))
+        best_threshold, nb_steps = solve_teacache_threshold(deltas, start_step, speed_factor)
         skips_step_cache.rel_l1_thresh = best_threshold
-        print(f"Tea Cache, best threshold found:{best_threshold:0.2f} with gain x{len(timesteps)/(target_nb_steps - best_signed_diff):0.2f} for a target of x{speed_factor}")
-        # print(f"deltas:{best_deltas}")
+        print(f"Tea Cache, best threshold found:{best_threshold:0.3f} with gain x{len(timesteps)/nb_steps:0.2f} for a target of x{speed_factor}")
         return best_threshold
 
     
@@ -1683,6 +1619,7 @@ class WanModel(ModelMixin, ConfigMixin):
         should_calc = True
         x_should_calc = None
         skips_steps_cache = self.cache
+        calibration = None if skips_steps_cache is None else getattr(skips_steps_cache, "calibration", None)
         if skips_steps_cache != None: 
             if skips_steps_cache.cache_type == "mag":
                 if real_step_no <= skips_steps_cache.start_step:
@@ -1719,7 +1656,9 @@ class WanModel(ModelMixin, ConfigMixin):
                         skips_steps_cache.accumulated_rel_l1_distance = 0
                     else:
                         rescale_func = np.poly1d(skips_steps_cache.coefficients)
-                        delta = abs(rescale_func(((e-skips_steps_cache.previous_modulated_input).abs().mean() / skips_steps_cache.previous_modulated_input.abs().mean()).cpu().item()))
+                        input_change = ((e-skips_steps_cache.previous_modulated_input).abs().mean() / skips_steps_cache.previous_modulated_input.abs().mean()).cpu().item()
+                        if calibration is not None: calibration.record_input_change(real_step_no, input_change)
+                        delta = abs(rescale_func(input_change))
                         skips_steps_cache.accumulated_rel_l1_distance += delta
                         if skips_steps_cache.accumulated_rel_l1_distance < skips_steps_cache.rel_l1_thresh:
                             should_calc = False
@@ -1802,6 +1741,9 @@ class WanModel(ModelMixin, ConfigMixin):
                 residual = ori_hidden_states[0] # just to have a readable code
                 torch.sub(x_list[0], ori_hidden_states[0], out=residual)
                 skips_steps_cache.previous_residual[x_id] = residual
+            if calibration is not None:
+                for i, should_calc in enumerate(x_should_calc):
+                    if should_calc: calibration.record_residual(real_step_no, i if joint_pass else x_id, skips_steps_cache.previous_residual[i if joint_pass else x_id])
             residual, ori_hidden_states = None, None
         if lynx_feature_extractor:
             return get_cache("lynx_ref_buffer")
@@ -523,7 +523,7 @@ def count_conv3d(model):
 
 class WanVAE_(nn.Module):
 
-    _offload_hooks = ['encode', 'decode']
+    _offload_hooks = ['encode', 'decode', 'decode_chunks', 'spatial_tiled_decode_chunks']
 
     def __init__(self,
                  dim=128,
@@ -636,6 +636,25 @@ class WanVAE_(nn.Module):
 
         return out
     
+    def decode_chunks(self, z, scale=None, any_end_frame = False):
+        """Same as decode() but yields (first_frame_no, frames) for each latent frame as soon as it is decoded."""
+        self.clear_cache()
+        if scale != None:
+            if isinstance(scale[0], torch.Tensor):
+                z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(1, self.z_dim, 1, 1, 1)
+            else:
+                z = z / scale[1] + scale[0]
+        iter_ = z.shape[2]
+        x = self.conv2(z)
+        frame_no = 0
+        try:
+            for i in range(iter_):
+                out = self._decoded_frames(x, i, i == iter_ - 1, any_end_frame, self._feat_map)
+                yield frame_no, out
+                frame_no += out.shape[2]
+        finally:
+            self.clear_cache()
+
     def blend_v(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
         for y in range(blend_extent):
@@ -648,48 +667,129 @@ class WanVAE_(nn.Module):
             b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (1 - x / blend_extent) + b[:, :, :, :, x] * (x / blend_extent)
         return b
     
-    def spatial_tiled_decode(self, z, scale, tile_size, any_end_frame= False):
-        tile_sample_min_size = tile_size
-        tile_latent_min_size = int(tile_sample_min_size / 8)
-        tile_overlap_factor = 0.25
+    def _tiled_decode_layout(self, z_shape, tile_size):
+        """
+        Latent tiles (top, left, height, width) of a tiled decode and their precomputed blend masks.
 
-        # z: [b,c,t,h,w]
+        Neighbouring tiles cross-fade with linear ramps over their overlap, so the masks of the tiles
+        covering a pixel sum to 1 and each tile is simply accumulated into the output.
+        """
+        key = (tuple(z_shape[-2:]), tile_size, self.upsampler_factor)
+        layout = getattr(self, "_tiled_decode_layouts", {}).get(key, None)
+        if layout is not None:
+            return layout
+        tile_latent_min_size = int(tile_size / 8)
+        overlap_size = int(tile_latent_min_size * (1 - 0.25))
+        blend_extent = int(tile_size * self.upsampler_factor * 0.25)
+        pixels_per_latent = 8 * self.upsampler_factor
+
+        def axis_ramps(length):
+            starts = list(range(0, length, overlap_size))
+            sizes = [min(tile_latent_min_size, length - start) for start in starts]
+            overlaps = [min(blend_extent, (start + size - next_start) * pixels_per_latent, next_size * pixels_per_latent) for start, size, next_start, next_size in zip(starts, sizes, starts[1:], sizes[1:])]
+            ramps = []
+            for no, size in enumerate(sizes):
+                ramp = torch.ones(size * pixels_per_latent)
+                head = overlaps[no - 1] if no > 0 else 0
+                tail = overlaps[no] if no < len(overlaps) else 0
+                if head > 0: ramp[:head] = torch.arange(head) / head
+                if tail > 0: ramp[-tail:] = 1 - torch.arange(tail) / tail
+                ramps.append(ramp)
+            return starts, sizes, ramps
+
+        rows_start, rows_size, rows_ramp = axis_ramps(z_shape[-2])
+        cols_start, cols_size, cols_ramp = axis_ramps(z_shape[-1])
+        tiles = [ (top, left, height, width, row_ramp[:, None] * col_ramp[None, :]) for top, height, row_ramp in zip(rows_start, rows_size, rows_ramp) for left, width, col_ramp in zip(cols_start, cols_size, cols_ramp) ]
+        layout = tiles
+        self._tiled_decode_layouts = {key: layout}
+        return layout
+
+    def _decoded_frames(self, x, latent_no, last_frame, any_end_frame, feat_map):
+        self._conv_idx = [0]
+        if any_end_frame and last_frame and latent_no > 0:
+            out = self.decoder(x[:, :, -1:], feat_cache=None, feat_idx=self._conv_idx)
+        else:
+            out = self.decoder(x[:, :, latent_no:latent_no + 1], feat_cache=feat_map, feat_idx=self._conv_idx)
+        if self.upsampler_factor > 1:
+            out = F.pixel_shuffle(out.movedim(2, 1), upscale_factor=self.upsampler_factor).movedim(1, 2)
+        return out
+
+    def spatial_tiled_decode_chunks(self, z, scale, tile_size, any_end_frame= False, tiles_per_batch = 4):
+        """
+        Tiled decode yielding (first_frame_no, frames) as soon as frames are complete.
 
+        When the causal caches of all the tiles fit in VRAM, every latent frame is decoded for all
+        the tiles (same size tiles batched in one decoder call) and the blended frames are yielded
+        one latent frame at a time. Otherwise tiles are decoded one by one over the whole clip and
+        accumulated into a single preallocated output, yielded at the end.
+        """
         if isinstance(scale[0], torch.Tensor):
             z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view( 1, self.z_dim, 1, 1, 1)
         else:
             z = z / scale[1] + scale[0]
+        tiles = self._tiled_decode_layout(z.shape, tile_size)
+        pixels_per_latent = 8 * self.upsampler_factor
+        frames_count = z.shape[2]
+        b = z.shape[0]
+        out_height, out_width = z.shape[-2] * pixels_per_latent, z.shape[-1] * pixels_per_latent
+
+        def accumulate(output, decoded, tile):
+            top, left, height, width, mask = tile
+            top, left = top * pixels_per_latent, left * pixels_per_latent
+            output[..., top:top + height * pixels_per_latent, left:left + width * pixels_per_latent] += decoded * mask.to(decoded.device, decoded.dtype)
+
+        streaming = torch.cuda.is_available() and z.is_cuda and frames_count > 1
+        if streaming:
+            # group the same size tiles (all of them but the last row / column) in batches
+            batches, groups = [], {}
+            for tile in tiles:
+                groups.setdefault(tile[2:4], []).append(tile)
+            for group in groups.values():
+                batches += [group[i:i + tiles_per_batch] for i in range(0, len(group), tiles_per_batch)]
+            x = self.conv2(z)
+            batches = [ (batch, torch.cat([x[:, :, :, top:top + height, left:left + width] for top, left, height, width, _ in batch]), [None] * count_conv3d(self.decoder)) for batch in batches ]
+            x = None
+            frame_no = 0
+            try:
+                for i in range(frames_count):
+                    chunk = None
+                    for batch, x_batch, feat_map in batches:
+                        decoded = self._decoded_frames(x_batch, i, i == frames_count - 1, any_end_frame, feat_map)
+                        if chunk is None:
+                            chunk = torch.zeros((b, decoded.shape[1], decoded.shape[2], out_height, out_width), dtype=torch.float32, device=decoded.device)
+                        for no, tile in enumerate(batch):
+                            accumulate(chunk, decoded[no * b:(no + 1) * b].float(), tile)
+                        decoded = None
+                    if i == 0:
+                        # the caches of all the tiles stay in VRAM, they will hold up to CACHE_T frames
+                        cache_bytes = sum(t.numel() * t.element_size() for _, _, feat_map in batches for t in feat_map if torch.is_tensor(t))
+                        free, _ = torch.cuda.mem_get_info(z.device)
+                        free += torch.cuda.memory_reserved(z.device) - torch.cuda.memory_allocated(z.device)
+                        if cache_bytes * (CACHE_T - 1) > free * 0.8:
+                            raise torch.cuda.OutOfMemoryError(f"Tiles decoding caches would need {cache_bytes * CACHE_T / 1024**3:0.1f} GB")
+                    yield frame_no, chunk
+                    frame_no += chunk.shape[2]
+                    chunk = None
+                return
+            except torch.cuda.OutOfMemoryError:
+                if frame_no > 0: raise
+            finally:
+                batches = None
+            torch.cuda.empty_cache()
+
+        output = None
+        for tile in tiles:
+            top, left, height, width, _ = tile
+            decoded = self.decode(z[:, :, :, top:top + height, left:left + width], any_end_frame= any_end_frame)
+            if output is None:
+                output = torch.zeros((b, decoded.shape[1], decoded.shape[2], out_height, out_width), dtype=decoded.dtype, device=decoded.device)
+            accumulate(output, decoded, tile)
+            decoded = None
+        yield 0, output
 
-
-        overlap_size = int(tile_latent_min_size * (1 - tile_overlap_factor)) #8 0.75
-        tile_sample_min_size *=  self.upsampler_factor
-        blend_extent = int(tile_sample_min_size * tile_overlap_factor) #256 0.25
-        row_limit = tile_sample_min_size - blend_extent
-
-        # Split z into overlapping tiles and decode them separately.
-        # The tiles have an overlap to avoid seams between tiles.
-        rows = []
-        for i in range(0, z.shape[-2], overlap_size):
-            row = []
-            for j in range(0, z.shape[-1], overlap_size):
-                tile = z[:, :, :, i: i + tile_latent_min_size, j: j + tile_latent_min_size]
-                decoded = self.decode(tile, any_end_frame= any_end_frame)
-                row.append(decoded)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
-
-        return torch.cat(result_rows, dim=-2)
+    def spatial_tiled_decode(self, z, scale, tile_size, any_end_frame= False):
+        chunks = [chunk for _, chunk in self.spatial_tiled_decode_chunks(z, scale, tile_size, any_end_frame=any_end_frame)]
+        return chunks[0] if len(chunks) == 1 else torch.cat(chunks, dim=2)
 
 
     def spatial_tiled_encode(self, x, scale, tile_size, any_end_frame = False) :
@@ -852,9 +952,35 @@ class WanVAE:
             return [ self.model.encode(u.to(self.dtype).unsqueeze(0), scale, any_end_frame=any_end_frame).float().squeeze(0) for u in videos ]
 
 
-    def decode(self, zs, tile_size, any_end_frame = False):
+    def decode(self, zs, tile_size, any_end_frame = False, to_uint8 = False):
+        """
+        Returns the decoded videos [C, T, H, W] in [-1, 1], or as uint8 cpu tensors if to_uint8.
+        With to_uint8 the frames are converted and moved to a preallocated buffer as soon as they
+        are decoded, so the float video never exists in full. The whole clip is still returned at
+        once: the chunks are not streamed to the video encoder, whose input goes through the window
+        trimming and post processing of generate_video first.
+        """
         scale = [u.to(device = self.device) for u in self.scale]  
+        if to_uint8:
+            return [ self.decode_to_uint8(u, scale, tile_size, any_end_frame=any_end_frame) for u in zs ]
         if tile_size > 0:
             return [ self.model.spatial_tiled_decode(u.to(self.dtype).unsqueeze(0), scale, tile_size, any_end_frame=any_end_frame).clamp_(-1, 1).float().squeeze(0) for u in zs ]
         else:
             return [ self.model.decode(u.to(self.dtype).unsqueeze(0), scale, any_end_frame=any_end_frame).clamp_(-1, 1).float().squeeze(0) for u in zs ]
+
+    def decode_to_uint8(self, z, scale, tile_size, any_end_frame = False):
+        z = z.to(self.dtype).unsqueeze(0)
+        latent_frames = z.shape[2]
+        temporal_scale = 2 ** sum(self.model.temperal_upsample)
+        frames_count = 1 + temporal_scale * (latent_frames - 1) - (temporal_scale - 1 if any_end_frame and latent_frames > 1 else 0)
+        pixels_per_latent = 8 * self.model.upsampler_factor
+        video = torch.empty((3, frames_count, z.shape[-2] * pixels_per_latent, z.shape[-1] * pixels_per_latent), dtype=torch.uint8, pin_memory=torch.cuda.is_available())
+        chunks = self.model.spatial_tiled_decode_chunks(z, scale, tile_size, any_end_frame=any_end_frame) if tile_size > 0 else self.model.decode_chunks(z, scale, any_end_frame=any_end_frame)
+        written = 0
+        for frame_no, chunk in chunks:
+            chunk = chunk[0].float().clamp_(-1, 1).add_(1).mul_(127.5).round_().to(torch.uint8)
+            video[:, frame_no:frame_no + chunk.shape[1]].copy_(chunk, non_blocking=True)
+            written = max(written, frame_no + chunk.shape[1])
+            chunk = None
+        if torch.cuda.is_available(): torch.cuda.synchronize()
+        return video[:, :written]
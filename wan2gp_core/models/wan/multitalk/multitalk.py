@@ -19,7 +19,9 @@ from einops import rearrange
 import soundfile as sf
 import re
 import math
+import hashlib
 from shared.utils import files_locator as fl 
+from shared.utils.file_cache import evict_least_recently_used, remove_quietly
 
 def custom_init(device, wav2vec):    
     from mmgp import offload
@@ -36,6 +38,71 @@ def custom_init(device, wav2vec):
     )
     return wav2vec_feature_extractor, audio_encoder
 
+_audio_encoders = {}
+
+def get_audio_encoder(device = "cpu"):
+    # the encoder stays loaded for the next generations, only for the last device asked and only on the CPU:
+    # on the GPU it is outside of mmgp's VRAM budget and is released once the embeddings are computed
+    wav2vec_folder = fl.locate_folder("chinese-wav2vec2-base")
+    key = (wav2vec_folder, str(device))
+    if key not in _audio_encoders:
+        _audio_encoders.clear()
+        _audio_encoders[key] = custom_init(device, wav2vec_folder)
+    return _audio_encoders[key]
+
+def release_audio_encoder():
+    _audio_encoders.clear()
+
+
+class AudioEmbeddingsCache:
+    """
+    Full audio embeddings saved on disk, named after a hash of the content of the audio files and of the
+    parameters used to prepare them, so that the same voice track is only encoded once whatever its file name.
+    """
+    def __init__(self, cache_dir, max_size_mb = 2048):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+
+    def key(self, audio_files, **params):
+        h = hashlib.sha256()
+        for filename in audio_files:
+            if filename is None:
+                h.update(b"none")
+                continue
+            with open(filename, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            h.update(b"|")
+        h.update(repr(sorted(params.items())).encode("utf-8"))
+        return h.hexdigest()
+
+    def load(self, key):
+        path = os.path.join(self.cache_dir, key + ".pt")
+        if not os.path.isfile(path):
+            return None
+        try:
+            full_audio_embs = torch.load(path, map_location="cpu", weights_only=True)
+            os.utime(path)
+        except Exception as e:
+            print(f"Discarding unreadable audio embeddings {path}: {e}")
+            remove_quietly(path)
+            return None
+        return full_audio_embs
+
+    def save(self, key, full_audio_embs):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, key + ".pt")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            torch.save(full_audio_embs, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Unable to save audio embeddings {path}: {e}")
+            remove_quietly(tmp_path)
+            return
+        evict_least_recently_used(self.cache_dir, self.max_size_bytes, ".pt", keep=path)
+
+
 def loudness_norm(audio_array, sr=16000, lufs=-23):
     meter = pyln.Meter(sr)
     loudness = meter.integrated_loudness(audio_array)
@@ -45,30 +112,84 @@ def loudness_norm(audio_array, sr=16000, lufs=-23):
     return normalized_audio
 
  
-def get_embedding(speech_array, wav2vec_feature_extractor, audio_encoder, sr=16000, device='cpu', fps = 25):
-    audio_duration = len(speech_array) / sr
-    video_length = audio_duration * fps
-
-    # wav2vec_feature_extractor
-    audio_feature = np.squeeze(
-        wav2vec_feature_extractor(speech_array, sampling_rate=sr).input_values
-    )
-    audio_feature = torch.from_numpy(audio_feature).float().to(device=device)
-    audio_feature = audio_feature.unsqueeze(0)
-
-    # audio encoder
-    with torch.no_grad():
-        embeddings = audio_encoder(audio_feature, seq_len=int(video_length), output_hidden_states=True)
-
-    if len(embeddings) == 0:
-        print("Fail to extract audio embedding")
-        return None
+class StreamedAudioEmbedding:
+    """
+    Wav2vec embedding of a speech track computed by chunks of video frames, only when they are needed.
+
+    By default (chunk_frames = 0) the whole track is encoded in a single pass, on the first request. With
+    chunk_frames > 0, tracks longer than chunk_frames + 2 * context_frames are encoded by chunks of
+    chunk_frames frames with context_frames of audio on each side, only the central part of each chunk
+    being kept, and the chunks are only encoded when a window needs them. Chunks of the same length are
+    encoded in batches of batch_size and only then is the encoder memory bounded by the chunk size: the
+    default single pass still grows with the audio length.
+    Chunked embeddings are an approximation of the single pass: the wav2vec transformer attends over the
+    whole sequence it is given, and its positional convolution and the group norm of its first feature
+    conv layer depend on the whole chunk, so the stitched hidden states differ slightly from a single pass.
+    This stitching error has not been measured against the lip sync quality yet, hence no default chunking.
+    """
+
+    def __init__(self, speech_array, wav2vec_feature_extractor, audio_encoder, sr=16000, device='cpu', fps = 25, chunk_frames = 0, context_frames = 50, batch_size = 4):
+        self.audio_encoder = audio_encoder
+        self.device = device
+        self.batch_size = batch_size
+        self.on_complete = None
+        audio_feature = np.squeeze(wav2vec_feature_extractor(speech_array, sampling_rate=sr).input_values)
+        self.audio_feature = torch.from_numpy(audio_feature).float()
+        self.seq_len = seq_len = int(len(speech_array) / sr * fps)
+        config = audio_encoder.config
+        self.buffer = torch.empty(seq_len, config.num_hidden_layers, config.hidden_size)
+        n_samples = len(self.audio_feature)
+        if chunk_frames <= 0 or seq_len <= chunk_frames + 2 * context_frames:
+            self.chunks = [(0, seq_len, 0, seq_len, 0, n_samples)]
+        else:
+            self.chunks = []
+            for start in range(0, seq_len, chunk_frames):
+                end = min(start + chunk_frames, seq_len)
+                context_start, context_end = max(0, start - context_frames), min(seq_len, end + context_frames)
+                sample_start = round(context_start * sr / fps)
+                sample_end = n_samples if context_end == seq_len else min(n_samples, sample_start + round((context_end - context_start) * sr / fps))
+                self.chunks.append((start, end, context_start, context_end, sample_start, sample_end))
+        self.chunks_done = 0
+
+    @property
+    def complete(self):
+        return self.chunks_done == len(self.chunks)
+
+    def _encode_batch(self, chunks):
+        audio_feature = torch.stack([self.audio_feature[sample_start:sample_end] for _, _, _, _, sample_start, sample_end in chunks]).to(device=self.device)
+        context_start, context_end = chunks[0][2:4]
+        with torch.no_grad():
+            embeddings = self.audio_encoder(audio_feature, seq_len=context_end - context_start, output_hidden_states=True)
+        audio_emb = torch.stack(embeddings.hidden_states[1:], dim=1)
+        audio_emb = rearrange(audio_emb, "c b s d -> c s b d")
+        for audio_emb_chunk, (start, end, context_start, _, _, _) in zip(audio_emb, chunks):
+            self.buffer[start:end] = audio_emb_chunk[start - context_start: end - context_start].cpu()
+
+    def up_to(self, frames_count):
+        """Encodes the chunks needed for the first frames_count frames, returns the (seq_len, layers, dim) embedding."""
+        pending = []
+        while self.chunks_done < len(self.chunks) and self.chunks[self.chunks_done][0] < frames_count:
+            pending.append(self.chunks[self.chunks_done])
+            self.chunks_done += 1
+        while pending:
+            # batch consecutive chunks of the same audio / frames length
+            batch = [pending.pop(0)]
+            while pending and len(batch) < self.batch_size and pending[0][3] - pending[0][2] == batch[0][3] - batch[0][2] and pending[0][5] - pending[0][4] == batch[0][5] - batch[0][4]:
+                batch.append(pending.pop(0))
+            self._encode_batch(batch)
+        if self.complete:
+            self.audio_encoder = None
+            if self.on_complete is not None:
+                on_complete, self.on_complete = self.on_complete, None
+                on_complete()
+        return self.buffer
+
+    def full(self):
+        return self.up_to(self.seq_len)
 
-    audio_emb = torch.stack(embeddings.hidden_states[1:], dim=1).squeeze(0)
-    audio_emb = rearrange(audio_emb, "b s d -> s b d")
 
-    audio_emb = audio_emb.cpu().detach()
-    return audio_emb
+def get_embedding(speech_array, wav2vec_feature_extractor, audio_encoder, sr=16000, device='cpu', fps = 25):
+    return StreamedAudioEmbedding(speech_array, wav2vec_feature_extractor, audio_encoder, sr=sr, device=device, fps=fps).full()
 
 def extract_audio_from_video(filename, sample_rate):
     raw_audio_path = filename.split('/')[-1].split('.')[0]+'.wav'
@@ -224,19 +345,34 @@ def process_tts_multi(text, save_dir, voice1, voice2):
     return s1, s2, save_path_sum
 
 
-def get_full_audio_embeddings(audio_guide1 = None, audio_guide2 = None, combination_type ="add", num_frames =  0, fps = 25, sr = 16000, padded_frames_for_embeddings = 0, min_audio_duration = 0, return_sum_only = False):
-    wav2vec_feature_extractor, audio_encoder= custom_init('cpu', fl.locate_folder("chinese-wav2vec2-base"))
-    # wav2vec_feature_extractor, audio_encoder= custom_init('cpu', "ckpts/wav2vec")
+def get_full_audio_embeddings(audio_guide1 = None, audio_guide2 = None, combination_type ="add", num_frames =  0, fps = 25, sr = 16000, padded_frames_for_embeddings = 0, min_audio_duration = 0, return_sum_only = False, device = "cpu", cache_dir = None, cache_max_size_mb = 2048, streamed = False, chunk_frames = 0):
     pad = int(padded_frames_for_embeddings/ fps * sr)
     new_human_speech1, new_human_speech2, sum_human_speechs, duration_changed = audio_prepare_multi(audio_guide1, audio_guide2, combination_type, duration= num_frames / fps, pad = pad, min_audio_duration = min_audio_duration )
     if return_sum_only:
         full_audio_embs = None
     else:
-        audio_embedding_1 = get_embedding(new_human_speech1, wav2vec_feature_extractor, audio_encoder, sr=sr, fps= fps)
-        audio_embedding_2 = get_embedding(new_human_speech2, wav2vec_feature_extractor, audio_encoder, sr=sr, fps= fps)
-        full_audio_embs = []
-        if audio_guide1 != None: full_audio_embs.append(audio_embedding_1)
-        if audio_guide2 != None: full_audio_embs.append(audio_embedding_2)
+        cache = AudioEmbeddingsCache(cache_dir, cache_max_size_mb) if cache_dir is not None else None
+        if cache is not None:
+            cache_key = cache.key([audio_guide1, audio_guide2], combination_type = combination_type, num_frames = num_frames, fps = fps, sr = sr, pad = pad, min_audio_duration = min_audio_duration, encoder = "chinese-wav2vec2-base", chunk_frames = chunk_frames)
+            full_audio_embs = cache.load(cache_key)
+        else:
+            full_audio_embs = None
+        if full_audio_embs is None:
+            wav2vec_feature_extractor, audio_encoder= get_audio_encoder(device)
+            full_audio_embs = []
+            if audio_guide1 != None: full_audio_embs.append(StreamedAudioEmbedding(new_human_speech1, wav2vec_feature_extractor, audio_encoder, sr=sr, device = device, fps= fps, chunk_frames = chunk_frames))
+            if audio_guide2 != None: full_audio_embs.append(StreamedAudioEmbedding(new_human_speech2, wav2vec_feature_extractor, audio_encoder, sr=sr, device = device, fps= fps, chunk_frames = chunk_frames))
+            streams = list(full_audio_embs)
+            def on_streams_complete():
+                if all(stream.complete for stream in streams):
+                    if cache is not None:
+                        cache.save(cache_key, [stream.buffer for stream in streams])
+                    if torch.device(device).type == "cuda":
+                        release_audio_encoder()
+            for stream in streams:
+                stream.on_complete = on_streams_complete
+            if not streamed:
+                full_audio_embs = [stream.full() for stream in full_audio_embs]
         if audio_guide2 == None and not duration_changed: sum_human_speechs = None
     return full_audio_embs, sum_human_speechs
 
@@ -250,6 +386,10 @@ def get_window_audio_embeddings(full_audio_embs, audio_start_idx=0, clip_length
     audio_embs = []
     # split audio with window size
     for human_idx in range(HUMAN_NUMBER):   
+        full_audio_emb = full_audio_embs[human_idx]
+        if isinstance(full_audio_emb, StreamedAudioEmbedding):
+            # only the audio up to the end of this window (and its 2 frames of context) needs to be encoded
+            full_audio_emb = full_audio_emb.up_to(audio_end_idx + 2)
         center_indices = torch.arange(
             audio_start_idx,
             audio_end_idx,
@@ -257,8 +397,8 @@ def get_window_audio_embeddings(full_audio_embs, audio_start_idx=0, clip_length
         ).unsqueeze(
             1
         ) + indices.unsqueeze(0)
-        center_indices = torch.clamp(center_indices, min=0, max=full_audio_embs[human_idx].shape[0]-1).to(full_audio_embs[human_idx].device)
-        audio_emb = full_audio_embs[human_idx][center_indices][None,...] #.to(self.device)
+        center_indices = torch.clamp(center_indices, min=0, max=full_audio_emb.shape[0]-1).to(full_audio_emb.device)
+        audio_emb = full_audio_emb[center_indices][None,...] #.to(self.device)
         audio_embs.append(audio_emb)
     audio_embs = torch.concat(audio_embs, dim=0) #.to(self.param_dtype)
 
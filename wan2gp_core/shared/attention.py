@@ -5,6 +5,7 @@ from mmgp import offload
 import torch.nn.functional as F
 import warnings
 from importlib.metadata import version
+from .attention_tuner import AttentionTuner
 
 major, minor = torch.cuda.get_device_capability(None)
 bfloat16_supported =  major >= 8 
@@ -221,6 +222,9 @@ __all__ = [
     'attention',
 ]
 
+# used when the attention mode is 'auto', configured by the application with the supported modes
+attention_tuner = AttentionTuner()
+
 def get_cu_seqlens(batch_size, lens, max_len):
     cu_seqlens = torch.zeros([2 * batch_size + 1], dtype=torch.int32, device="cuda")
 
@@ -256,6 +260,13 @@ def pay_attention(
         if  attention_mask.dtype == torch.bfloat16 and not bfloat16_supported:
             attention_mask = attention_mask.to(torch.float16)
     attn = offload.shared_state["_attention"] if force_attention== None else force_attention
+    if attn == "auto":
+        q, k, v = qkv_list
+        def run(mode):
+            return pay_attention([q, k, v], dropout_p=dropout_p, softmax_scale=softmax_scale, causal=causal, window_size=window_size, deterministic=deterministic,
+                                  version=version, force_attention=mode, cross_attn=cross_attn, q_lens=q_lens, k_lens=k_lens)
+        attn = attention_tuner.select(q, k, run, cross_attn=cross_attn, varlen=q_lens != None or k_lens != None)
+        del q, k, v, run
 
     q,k,v = qkv_list
     qkv_list.clear()
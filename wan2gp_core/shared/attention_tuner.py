@@ -0,0 +1,181 @@
+import json
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+
+# quantized modes that change the output noticeably (sage3, radial) are never picked automatically
+AUTOTUNE_MODES = ["sdpa", "flash", "sage", "sage2", "xformers"]
+
+
+def _bucket(n):
+    # ~12% wide buckets: 1024 -> 1024, 1100 -> 1152, 32760 -> 32768
+    step = 1 << max(0, n.bit_length() - 4)
+    return (n + step - 1) // step * step
+
+
+class AttentionTuner:
+    """
+    Picks the fastest attention backend per shape bucket when the attention mode is 'auto'.
+
+    The first time a (self / cross attention, batch, q_len, k_len, heads, head_dim, dtype, variable
+    lengths) bucket is seen on a device, every candidate backend is run on the actual q, k, v and
+    timed. The winner is reused for all the following calls and persisted in a json file so that
+    the benchmark only happens once per machine. A backend that fails for a shape (unsupported head
+    dim, dtype or variable lengths) is simply ruled out for that bucket. Buckets are tuples and the
+    modes already resolved are kept in a dict, so a tuned call costs a single lookup.
+    """
+
+    _device_names = {}
+
+    def __init__(self, cache_path=None, candidates=("sdpa",), warmup=1, repeats=3):
+        self.cache_path = cache_path
+        self.candidates = list(candidates)
+        self.warmup = warmup
+        self.repeats = repeats
+        self.choices = self._load()
+        self._modes = {}
+
+    def configure(self, cache_path, candidates):
+        if cache_path != self.cache_path:
+            self.cache_path = cache_path
+            self.choices = self._load()
+        self.candidates = [mode for mode in AUTOTUNE_MODES if mode in candidates]
+        self._modes = {}
+
+    @classmethod
+    def _device_name(cls, device):
+        name = cls._device_names.get(device, None)
+        if name is None:
+            name = cls._device_names[device] = torch.cuda.get_device_name(device) if device.type == "cuda" else device.type
+        return name
+
+    @classmethod
+    def bucket_key(cls, q, k, cross_attn=False, varlen=False):
+        b, lq, heads, head_dim = q.shape
+        return (cls._device_name(q.device), cross_attn, b, _bucket(lq), _bucket(k.shape[1]), heads, head_dim, q.dtype, varlen)
+
+    @staticmethod
+    def key_name(key):
+        """Name of a bucket in the json file."""
+        device, cross_attn, b, lq, lk, heads, head_dim, dtype, varlen = key
+        kind = "cross" if cross_attn else "self"
+        dtype = str(dtype).replace("torch.", "")
+        return f"{device}|{kind}|b{b}|q{lq}|k{lk}|h{heads}|d{head_dim}|{dtype}{'|varlen' if varlen else ''}"
+
+    def select(self, q, k, run, cross_attn=False, varlen=False):
+        """Returns the backend to use for these q / k. run(mode) must compute the attention with the given backend."""
+        if len(self.candidates) <= 1:
+            return self.candidates[0] if self.candidates else "sdpa"
+        key = self.bucket_key(q, k, cross_attn, varlen)
+        mode = self._modes.get(key, None)
+        if mode is not None:
+            return mode
+        name = self.key_name(key)
+        choice = self.choices.get(name, None)
+        if choice is not None and choice["mode"] in self.candidates:
+            mode = self._modes[key] = choice["mode"]
+            return mode
+        timings = self.benchmark(run, self.candidates, q.device)
+        valid = {mode: t for mode, t in timings.items() if t is not None}
+        mode = min(valid, key=valid.get) if valid else "sdpa"
+        self.choices[name] = {"mode": mode, "timings_ms": {m: None if t is None else round(t * 1000, 3) for m, t in timings.items()}}
+        self._modes[key] = mode
+        self._save(name)
+        print(f"Attention autotune {name}: {mode} ({', '.join(f'{m} {t * 1000:.2f}ms' for m, t in valid.items())})")
+        return mode
+
+    def benchmark(self, run, candidates, device):
+        def synchronize():
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+
+        timings = {}
+        for mode in candidates:
+            try:
+                for _ in range(self.warmup):
+                    run(mode)
+                synchronize()
+                start = time.perf_counter()
+                for _ in range(self.repeats):
+                    run(mode)
+                synchronize()
+                timings[mode] = (time.perf_counter() - start) / self.repeats
+            except Exception:
+                timings[mode] = None
+        return timings
+
+    def _load(self):
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Unable to read attention autotune choices {self.cache_path}: {e}")
+            return {}
+
+    def _save(self, key):
+        if self.cache_path is None:
+            return
+        # merge with the choices saved meanwhile by other processes
+        choices = self._load()
+        choices[key] = self.choices[key]
+        self.choices.update(choices)
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(choices, f, indent=1)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Unable to save attention autotune choices {self.cache_path}: {e}")
+
+
+def _sdpa(q, k, v):
+    # [batches, tokens, heads, head_features] layout as in pay_attention
+    return F.scaled_dot_product_attention(q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2)).transpose(1, 2)
+
+
+def run_benchmark(cache_path=None, device="cpu", dtype=torch.float32, shapes=None):
+    """
+    Benchmark harness that only needs torch: runs the tuner on self / cross attention shapes with the sdpa
+    fallback (math kernels on CPU, the fused kernels on GPU, selected through the torch sdpa backends).
+    """
+    device = torch.device(device)
+    shapes = shapes or [(1, 1024, 1024, 12, 64, False), (1, 1024, 512, 12, 64, True), (1, 4096, 4096, 12, 128, False), (2, 4096, 512, 12, 128, True)]
+    backends = {"sdpa": _sdpa}
+    if hasattr(torch.nn, "attention") and hasattr(torch.nn.attention, "sdpa_kernel"):
+        from torch.nn.attention import sdpa_kernel, SDPBackend
+
+        def with_backend(backend):
+            def fn(q, k, v):
+                with sdpa_kernel(backend):
+                    return _sdpa(q, k, v)
+            return fn
+        backends["sdpa_math"] = with_backend(SDPBackend.MATH)
+        backends["sdpa_efficient"] = with_backend(SDPBackend.EFFICIENT_ATTENTION)
+        if device.type == "cuda":
+            backends["sdpa_flash"] = with_backend(SDPBackend.FLASH_ATTENTION)
+    tuner = AttentionTuner(cache_path, candidates=list(backends))
+    results = {}
+    for b, lq, lk, heads, head_dim, cross_attn in shapes:
+        q = torch.randn(b, lq, heads, head_dim, device=device, dtype=dtype)
+        k = torch.randn(b, lk, heads, head_dim, device=device, dtype=dtype)
+        v = torch.randn(b, lk, heads, head_dim, device=device, dtype=dtype)
+        key = tuner.key_name(tuner.bucket_key(q, k, cross_attn))
+        results[key] = tuner.select(q, k, lambda mode: backends[mode](q, k, v), cross_attn=cross_attn)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Attention autotune benchmark")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--cache", default=None, help="json file where the choices are persisted")
+    cli_args = parser.parse_args()
+    for key, mode in run_benchmark(cli_args.cache, cli_args.device, getattr(torch, cli_args.dtype)).items():
+        print(f"{key}: {mode}")
@@ -0,0 +1,100 @@
+import gc
+import threading
+from collections import OrderedDict
+
+import psutil
+import torch
+
+
+class _PooledAnnotator:
+    def __init__(self, annotator):
+        self.annotator = annotator
+        self.lock = threading.Lock()
+        self.offloaded = False
+
+
+class AnnotatorPool:
+    """
+    Keeps the control video annotators (pose, depth, scribble, flow, ...) loaded across sliding windows and tasks.
+
+    Annotators are keyed by process type and config, built on first use and reused afterwards instead of
+    recreating their ONNX sessions or reloading their weights. Between two preprocessings offload() moves
+    their torch modules to RAM so that they don't hold VRAM while denoising, the next use moves them back.
+    At most max_entries annotators are kept (least recently used evicted first). When the available RAM falls
+    below min_free_ram_perc they are dropped one at a time, only as long as each drop actually frees RAM (the
+    pressure usually comes from the pinned main model). Calls to the same annotator are serialized so that
+    it can be shared by several worker threads.
+    """
+
+    min_freed_bytes = 32 * 1024**2 # a drop freeing less than this did not relieve the RAM pressure
+
+    def __init__(self, max_entries=4, min_free_ram_perc=15):
+        self.max_entries = max_entries
+        self.min_free_ram_perc = min_free_ram_perc
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _modules(annotator):
+        return [module for module in vars(annotator).values() if isinstance(module, torch.nn.Module)]
+
+    def _get_entry(self, key, factory):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        # built outside of the pool lock, loading weights can take a while
+        entry = _PooledAnnotator(factory())
+        with self._lock:
+            existing = self._entries.get(key, None)
+            if existing is not None:
+                return existing
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def forward(self, key, factory, *args, **kwargs):
+        entry = self._get_entry(key, factory)
+        with entry.lock:
+            if entry.offloaded:
+                device = getattr(entry.annotator, "device", None)
+                for module in self._modules(entry.annotator):
+                    module.to(device)
+                entry.offloaded = False
+            return entry.annotator.forward(*args, **kwargs)
+
+    def _ram_is_low(self):
+        memory = psutil.virtual_memory()
+        return memory.available * 100 < memory.total * self.min_free_ram_perc, memory.available
+
+    def offload(self):
+        """Moves the torch modules of the idle annotators to RAM and drops annotators if RAM is running low."""
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            with entry.lock:
+                modules = self._modules(entry.annotator)
+                if not entry.offloaded and len(modules) > 0:
+                    for module in modules:
+                        module.to("cpu")
+                    entry.offloaded = True
+        entries = entry = None
+        low, available = self._ram_is_low()
+        while low:
+            with self._lock:
+                if len(self._entries) == 0:
+                    break
+                key, _ = self._entries.popitem(last=False)
+            # the annotator is only freed once collected
+            gc.collect()
+            print(f"Annotator '{key[0]}' unloaded to free RAM")
+            previous_available = available
+            low, available = self._ram_is_low()
+            if available - previous_available < self.min_freed_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,4 +1,5 @@
 import subprocess
+import shutil
 import tempfile, os
 import ffmpeg
 import torchvision.transforms.functional as TF
@@ -455,6 +456,56 @@ def _get_codec_params(codec_type, container):
         return {'codec': 'libx264', 'pixelformat': 'yuv420p'}
 
 
+class VideoSegmentWriter:
+    """
+    Incremental writer for sliding window generations.
+
+    Each append() encodes only the frames it is given into a new segment, so the frames of
+    previous windows are neither re-encoded nor kept in RAM. write() joins the segments encoded
+    so far into a playable video with ffmpeg's concat demuxer (stream copy, no re-encoding).
+    """
+
+    def __init__(self, codec_type='libx264_8', container='mp4'):
+        self.codec_type = codec_type
+        self.container = container
+        self.segments = []
+        self.frame_count = 0
+        self.work_dir = None
+
+    def append(self, frames, fps):
+        """Encodes frames (c, f, h, w tensor or list of chunks) as the next segment."""
+        if frames is None:
+            return
+        if self.work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix="wgp_segments_")
+        segment = osp.join(self.work_dir, f"segment{len(self.segments):04d}.{self.container}")
+        if save_video(frames, save_file=segment, fps=fps, codec_type=self.codec_type, container=self.container, nrow=1, normalize=True, value_range=(-1, 1)) is None:
+            raise Exception(f"Unable to encode video segment {segment}")
+        self.segments.append(segment)
+        self.frame_count += sum(chunk.shape[1] for chunk in frames) if isinstance(frames, (list, tuple)) else frames.shape[1]
+
+    def write(self, save_file):
+        """Writes all the frames appended so far to save_file."""
+        if not self.segments:
+            raise Exception("No video segment to write")
+        list_file = osp.join(self.work_dir, "segments.txt")
+        with open(list_file, "w", encoding="utf-8") as f:
+            for segment in self.segments:
+                escaped = segment.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', save_file]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception(f"FFmpeg error:\n{result.stderr}")
+        return save_file
+
+    def close(self):
+        if self.work_dir is not None:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+        self.segments = []
+
+
 
 
 def save_image(tensor,
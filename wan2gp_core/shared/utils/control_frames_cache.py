@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+import threading
+
+import numpy as np
+
+from shared.utils.file_cache import evict_least_recently_used, remove_quietly
+
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """sha256 of the content of a file, memoized per path, size and modification time."""
+    stat = os.stat(path)
+    signature = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_digests_lock:
+        digest = _file_digests.get(signature, None)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with _file_digests_lock:
+            _file_digests[signature] = digest
+    return digest
+
+
+class ControlFramesCache:
+    """
+    Persistent cache of preprocessed control frames and masks (pose, depth, scribble, ... already resized,
+    masked and outpainted), so that the sliding windows of a generation and the later generations that
+    reuse a control video only decode and annotate the frames that were never processed.
+
+    Entries are keyed by the content of the source video / mask files and by every parameter that changes
+    the output (process types, target fps, resolution, fit / crop / expand options, ...). Frames are indexed
+    by their frame number at the target fps and stored as uint8 in compressed chunks of chunk_frames
+    frames, each chunk can be filled by several calls. The chunk holding the last frame of the source
+    remembers where the video ends, so that ranges running past the end can be served too. The least
+    recently used chunks are deleted when the folder exceeds max_size_mb.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=4096, chunk_frames=16):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_mb * 1024 ** 2)
+        self.chunk_frames = chunk_frames
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(sources, **params):
+        """Returns the key of the frames derived from the source files with these parameters."""
+        digests = [None if source is None else file_digest(source) for source in sources]
+        text = repr(digests) + "|" + repr(sorted(params.items()))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key, chunk_no):
+        return os.path.join(self.cache_dir, f"{key}_{chunk_no:06d}.npz")
+
+    def _load_chunk(self, path):
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                chunk = {name: data[name] for name in data.files}
+            os.utime(path)
+        except Exception as e:
+            print(f"Unable to read control frames chunk {path}: {e}")
+            remove_quietly(path)
+            return None
+        return chunk
+
+    def load(self, key, start_frame, frames_count):
+        """
+        Returns (frames, masks, end): dictionaries frame number -> H, W, C uint8 array of the frames of
+        [start_frame, start_frame + frames_count) found in the cache (masks is None if the entry has no
+        masks), and end the number of frames of the source if it is known and within that range, else None.
+        """
+        frames, masks, end = {}, None, None
+        last_frame = start_frame + frames_count
+        for chunk_no in range(start_frame // self.chunk_frames, (last_frame - 1) // self.chunk_frames + 1):
+            chunk = self._load_chunk(self._path(key, chunk_no))
+            if chunk is None:
+                continue
+            for i, frame_no in enumerate(chunk["frame_nos"].tolist()):
+                if start_frame <= frame_no < last_frame:
+                    frames[frame_no] = chunk["frames"][i]
+                    if "masks" in chunk:
+                        if masks is None: masks = {}
+                        masks[frame_no] = chunk["masks"][i]
+            if "end" in chunk:
+                end = int(chunk["end"])
+                break
+        return frames, masks, end
+
+    def save(self, key, start_frame, frames, masks=None, end=None):
+        """
+        Stores frames (and masks) as the frames start_frame, start_frame + 1, ... of the entry. end is the
+        number of frames of the source if the frames reach its end.
+        """
+        if len(frames) == 0:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        last_frame = start_frame + len(frames)
+        written = []
+        with self._lock:
+            for chunk_no in range(start_frame // self.chunk_frames, (last_frame - 1) // self.chunk_frames + 1):
+                path = self._path(key, chunk_no)
+                chunk_start, chunk_end = max(start_frame, chunk_no * self.chunk_frames), min(last_frame, (chunk_no + 1) * self.chunk_frames)
+                chunk_frames = {frame_no: np.asarray(frames[frame_no - start_frame]) for frame_no in range(chunk_start, chunk_end)}
+                chunk_masks = None if masks is None else {frame_no: np.asarray(masks[frame_no - start_frame]) for frame_no in range(chunk_start, chunk_end)}
+                chunk_end_of_video = end if end is not None and chunk_end == end else None
+                existing = self._load_chunk(path)
+                if existing is not None and existing["frames"].shape[1:] == chunk_frames[chunk_start].shape and ("masks" in existing) == (chunk_masks is not None):
+                    for i, frame_no in enumerate(existing["frame_nos"].tolist()):
+                        if frame_no not in chunk_frames:
+                            chunk_frames[frame_no] = existing["frames"][i]
+                            if chunk_masks is not None:
+                                chunk_masks[frame_no] = existing["masks"][i]
+                    if chunk_end_of_video is None and "end" in existing:
+                        chunk_end_of_video = int(existing["end"])
+                frame_nos = sorted(chunk_frames)
+                arrays = {"frame_nos": np.array(frame_nos, dtype=np.int64), "frames": np.stack([chunk_frames[frame_no] for frame_no in frame_nos])}
+                if chunk_masks is not None:
+                    arrays["masks"] = np.stack([chunk_masks[frame_no] for frame_no in frame_nos])
+                if chunk_end_of_video is not None:
+                    arrays["end"] = np.array(chunk_end_of_video, dtype=np.int64)
+                tmp_path = os.path.join(self.cache_dir, f"tmp_{os.getpid()}_{threading.get_ident()}_{os.path.basename(path)}")
+                try:
+                    buffer = io.BytesIO()
+                    np.savez_compressed(buffer, **arrays)
+                    with open(tmp_path, "wb") as f:
+                        f.write(buffer.getbuffer())
+                    os.replace(tmp_path, path)
+                    written.append(path)
+                except OSError as e:
+                    print(f"Unable to save control frames chunk {path}: {e}")
+                    remove_quietly(tmp_path)
+            if len(written) > 0:
+                evict_least_recently_used(self.cache_dir, self.max_size_bytes, ".npz", keep=written[-1])
+
+_control_frames_cache = None
+
+
+def configure(cache_dir, max_size_mb=4096):
+    """No cache if cache_dir is None or max_size_mb is 0."""
+    global _control_frames_cache
+    _control_frames_cache = ControlFramesCache(cache_dir, max_size_mb) if cache_dir is not None and max_size_mb > 0 else None
+
+
+def get_control_frames_cache():
+    return _control_frames_cache
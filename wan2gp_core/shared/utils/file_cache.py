@@ -0,0 +1,62 @@
+import hashlib
+import os
+import time
+
+STALE_TMP_SECONDS = 3600
+
+
+def _is_tmp(name):
+    return name.endswith(".tmp") or name.startswith("tmp_")
+
+
+def evict_least_recently_used(cache_dir, max_size_bytes, suffix, keep=None):
+    """
+    Deletes the least recently used files (oldest modification time, caches touch the files they read) of
+    cache_dir ending with suffix until they fit in max_size_bytes, keep excepted. Temporary files left by
+    a crashed writer are deleted once stale, the ones being written are left alone. Files removed meanwhile
+    by another process are ignored.
+    """
+    files = []
+    now = time.time()
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if _is_tmp(entry.name):
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        remove_quietly(entry.path)
+                elif entry.name.endswith(suffix):
+                    files.append((entry.path == keep, stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, _, size, _ in files)
+    # the kept file sorts last
+    for _, _, size, path in sorted(files):
+        if total <= max_size_bytes or path == keep:
+            break
+        remove_quietly(path)
+        total -= size
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def checkpoint_signature(*filenames: str | None) -> str:
+    """Cheap identity of checkpoint files (name, size and modification time) instead of hashing several GB."""
+    parts = []
+    for filename in filenames:
+        if not filename:
+            continue
+        try:
+            stat = os.stat(filename)
+            parts.append(f"{os.path.basename(filename)}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(os.path.basename(filename))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,62 @@
+import time
+import torch
+
+
+class LatentPreviewRenderer:
+    """Turns the latents of a denoising step into a small RGB preview on the GPU.
+
+    Only the few latent frames shown in the preview are selected on the device, they are projected
+    to RGB with the latent to RGB factors of the model (kept as tensors per device / dtype), shrunk
+    to the preview height if they are larger and converted to uint8 before being copied to the CPU.
+    Previews are throttled to max_fps so most steps cost nothing, except the forced ones (last step).
+    The factor tensors are shared by all the renderers.
+    """
+
+    _factors = {}
+
+    def __init__(self, max_fps=2, height=200, latents_to_preview=4):
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0
+        self.height = height
+        self.latents_to_preview = latents_to_preview
+        self.last_preview_time = None
+
+    def due(self, force=False):
+        """Returns True (and starts a new period) if a preview can be produced now or is forced."""
+        now = time.time()
+        if not force and self.last_preview_time is not None and now - self.last_preview_time < self.min_interval:
+            return False
+        self.last_preview_time = now
+        return True
+
+    def _get_factors(self, key, get_rgb_factors, device, dtype):
+        cache_key = (key, device, dtype)
+        factors = self._factors.get(cache_key, None)
+        if factors is None:
+            latent_rgb_factors, latent_rgb_factors_bias = get_rgb_factors()
+            if latent_rgb_factors is None:
+                factors = (None, None)
+            else:
+                weight = torch.tensor(latent_rgb_factors, device=device, dtype=dtype).transpose(0, 1).contiguous()
+                bias = torch.tensor(latent_rgb_factors_bias, device=device, dtype=dtype)
+                factors = (weight, bias)
+            self._factors[cache_key] = factors
+        return factors
+
+    @torch.no_grad()
+    def render(self, key, get_rgb_factors, latents):
+        """latents: C, T, H, W tensor. Returns a H, T * W, 3 uint8 tensor on the CPU or None if the model has no factors."""
+        weight, bias = self._get_factors(key, get_rgb_factors, latents.device, latents.dtype)
+        if weight is None or weight.shape[1] != latents.shape[0]:
+            return None
+        nb_latents = latents.shape[1]
+        latents_to_preview = min(nb_latents, self.latents_to_preview)
+        frames_no = [int(i * nb_latents / latents_to_preview) for i in range(latents_to_preview)]
+        latents = latents.detach().index_select(1, torch.tensor(frames_no, device=latents.device))
+        images = torch.einsum("rc,cthw->rthw", weight, latents).add_(bias[:, None, None, None])
+        _, T, H, W = images.shape
+        if H > self.height:
+            images = torch.nn.functional.interpolate(images.float(), size=(self.height, max(1, round(W * self.height / H))), mode="area")
+        images = images.float().add_(1.0).mul_(127.5).clamp_(0, 255).to(torch.uint8)
+        images = images.permute(2, 1, 3, 0).flatten(1, 2) # r t h w -> h (t w) r
+        # blocking copy: the preview is read right away and is tiny
+        return images.cpu()
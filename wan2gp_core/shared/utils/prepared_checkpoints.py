@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+from shared.utils.file_cache import checkpoint_signature, evict_least_recently_used, remove_quietly
+
+
+class PreparedCheckpoints:
+    """
+    Cache of transformer checkpoints as they are once loaded: modules merged, state dict preprocessed,
+    weights quantized and converted to the target dtype.
+
+    Building such a model from its source files costs a full read plus the conversions at each model
+    switch. The prepared model is saved once with offload.save_model and later switches load it with
+    fast_load_transformers_model without writable tensors, which maps the file instead of reading it:
+    the weights are only paged in when mmgp moves a module to the GPU (or pins it).
+
+    Files are named after a hash of the source files signatures and of the preparation options. The least
+    recently used ones are deleted when the folder exceeds max_size_gb. Saving writes the whole prepared
+    model before the first generation can start, so the cache is off unless a size budget is configured.
+    """
+
+    def __init__(self, cache_dir, max_size_gb=64):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_gb * 1024 ** 3)
+
+    def _path(self, filenames, options):
+        key = checkpoint_signature(*filenames) + "|" + repr(sorted(options.items()))
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:24] + ".safetensors")
+
+    def find(self, filenames, **options):
+        """Returns the prepared checkpoint of these source files and options, None if it has not been created yet."""
+        path = self._path(filenames, options)
+        if not os.path.isfile(path):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def save(self, model, filenames, **options):
+        from mmgp import offload
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(filenames, options)
+        tmp_path = os.path.join(self.cache_dir, f"tmp_{os.getpid()}_{os.path.basename(path)}")
+        try:
+            offload.save_model(model, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Unable to save prepared checkpoint {path}: {e}")
+            remove_quietly(tmp_path)
+            return None
+        print(f"Prepared checkpoint saved to '{path}', next loads of this model will map it")
+        evict_least_recently_used(self.cache_dir, self.max_size_bytes, ".safetensors", keep=path)
+        return path
+
+_prepared_checkpoints = None
+
+
+def configure(cache_dir, max_size_gb=0):
+    """No prepared checkpoints if cache_dir is None or max_size_gb is 0 (the default)."""
+    global _prepared_checkpoints
+    _prepared_checkpoints = PreparedCheckpoints(cache_dir, max_size_gb) if cache_dir is not None and max_size_gb > 0 else None
+
+
+def get_prepared_checkpoints():
+    return _prepared_checkpoints
@@ -0,0 +1,78 @@
+import gc
+import time
+import torch
+
+
+class WindowResidency:
+    """Residency policy for the mmgp offload object across the windows of one task.
+
+    By default every window ends with offloadobj.unload_all(), so the next window streams the
+    transformer, text encoder and VAE back from pinned RAM. When another window (or repeat) of
+    the same task follows, no VRAM hungry post-processing runs in between and enough VRAM is
+    left, the models are kept loaded instead. mmgp still evicts whatever a later phase cannot
+    share the GPU with when it loads it (ensure_model_loaded), so only the modules that really
+    need the space are unloaded.
+
+    Each window prints its wall time and the time until its first denoising step completed,
+    which is where the weight reload shows up.
+    """
+
+    def __init__(self, offloadobj, enabled=True, min_free_vram_perc=20, device=None):
+        self.offloadobj = offloadobj
+        self.enabled = enabled and torch.cuda.is_available()
+        self.min_free_vram_perc = min_free_vram_perc
+        self.device = device
+        self.models_resident = False
+        self.window_start = None
+        self.first_step_time = None
+        self.timings = []
+
+    def start_window(self):
+        self.window_start = time.time()
+        self.first_step_time = None
+
+    def track_steps(self, callback):
+        """Wraps a denoising callback to time the first completed step of the window."""
+        def tracked_callback(step_idx=-1, *args, **kwargs):
+            if self.first_step_time is None and step_idx >= 0 and self.window_start is not None:
+                self.first_step_time = time.time() - self.window_start
+            return callback(step_idx, *args, **kwargs)
+        return tracked_callback
+
+    def _vram_allows(self):
+        free, total = torch.cuda.mem_get_info(self.device)
+        # Blocks cached by torch are reused before asking the driver for more memory
+        free += torch.cuda.memory_reserved(self.device) - torch.cuda.memory_allocated(self.device)
+        return free * 100 >= total * self.min_free_vram_perc
+
+    def end_window(self, window_no, more_windows, needs_vram):
+        """Unloads the models unless they can stay for the next window. Returns True if kept."""
+        keep = self.enabled and more_windows and not needs_vram and self._vram_allows()
+        if keep:
+            self.models_resident = True
+        else:
+            self.release()
+
+        elapsed = time.time() - self.window_start if self.window_start is not None else 0
+        self.timings.append({"window_no": window_no, "elapsed": elapsed, "first_step": self.first_step_time, "kept": keep})
+        first_step = f", first step after {self.first_step_time:.1f}s" if self.first_step_time is not None else ""
+        print(f"Window {window_no}: {elapsed:.1f}s{first_step}, models {'kept in VRAM' if keep else 'unloaded'}")
+        return keep
+
+    def release(self):
+        self.offloadobj.unload_all()
+        self.models_resident = False
+        gc.collect()
+        torch.cuda.empty_cache()
+
+    def release_if_resident(self):
+        if self.models_resident:
+            self.release()
+
+    def summary(self):
+        if len(self.timings) < 2:
+            return None
+        total = sum(t["elapsed"] for t in self.timings)
+        first_steps = [t["first_step"] for t in self.timings[1:] if t["first_step"] is not None]
+        average = f", average time to first step after window 1: {sum(first_steps) / len(first_steps):.1f}s" if first_steps else ""
+        return f"{len(self.timings)} windows in {total:.1f}s{average}"
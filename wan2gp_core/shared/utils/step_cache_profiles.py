@@ -0,0 +1,153 @@
+import json
+import os
+
+import numpy as np
+
+
+def profile_key(model_type, cache_type, sample_solver, num_steps, width, height):
+    """Profiles are specific to a model / solver / number of steps and a resolution bucket (~0.25 MPixels)."""
+    pixels_bucket = max(1, round(int(width) * int(height) / (512 * 512)))
+    solver = sample_solver if sample_solver else "default"
+    return f"{model_type}_{cache_type}_{solver}_{num_steps}steps_{pixels_bucket}"
+
+
+class StepCacheProfiles:
+    """
+    Calibrated MagCache / TeaCache profiles stored as one json file per profile key.
+
+    A MagCache profile holds the residual magnitude ratios measured at each step (same layout as
+    def_mag_ratios: conditional / unconditional pairs, the first step excluded). A TeaCache profile
+    holds the polynomial coefficients fitted between the modulated input changes and the residual
+    changes.
+    """
+
+    def __init__(self, profiles_dir):
+        self.profiles_dir = profiles_dir
+
+    def _path(self, key):
+        return os.path.join(self.profiles_dir, key + ".json")
+
+    def load(self, key):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Unable to read steps skipping profile {path}: {e}")
+            return None
+
+    def save(self, key, profile):
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=1)
+        os.replace(tmp_path, path)
+        return path
+
+
+class StepCacheCalibration:
+    """
+    Records, during a run that computes every step, what the steps skipping heuristics estimate:
+    the residual magnitude ratio between consecutive steps (MagCache) and pairs of
+    (modulated input change, residual change) (TeaCache). Windows of a sliding window generation
+    are averaged.
+    """
+
+    def __init__(self, cache_type, num_steps):
+        self.cache_type = cache_type
+        self.num_steps = num_steps
+        self.ratio_sums = np.zeros(num_steps * 2)
+        self.ratio_counts = np.zeros(num_steps * 2)
+        self.input_changes = []
+        self.output_changes = []
+        self._input_change = None
+        self._previous = {}
+
+    def record_input_change(self, step_no, value):
+        self._input_change = (step_no, value)
+
+    def record_residual(self, step_no, x_id, residual):
+        if x_id > 1 or residual is None:
+            return
+        norm = residual.float().norm(dim=-1)
+        previous = self._previous.get(x_id, None)
+        if previous is not None and previous[0] == step_no - 1:
+            _, previous_norm, previous_residual = previous
+            self.ratio_sums[step_no * 2 + x_id] += (norm / previous_norm).mean().item()
+            self.ratio_counts[step_no * 2 + x_id] += 1
+            if x_id == 0 and previous_residual is not None and self._input_change is not None and self._input_change[0] == step_no:
+                output_change = ((residual - previous_residual).abs().mean() / previous_residual.abs().mean()).item()
+                self.input_changes.append(self._input_change[1])
+                self.output_changes.append(output_change)
+        # the residual buffers are reused in place, TeaCache needs its own copy
+        self._previous[x_id] = (step_no, norm, residual.clone() if self.cache_type == "tea" and x_id == 0 else None)
+
+    def build_profile(self):
+        """Returns the profile measured so far, None if nothing usable was recorded."""
+        if self.cache_type == "mag":
+            counts = self.ratio_counts[2:]
+            if len(counts) == 0 or counts[0::2].min() == 0:
+                return None
+            ratios = self.ratio_sums[2:] / np.maximum(counts, 1)
+            # no unconditional pass (guidance 1): reuse the conditional ratios
+            ratios[1::2] = np.where(counts[1::2] > 0, ratios[1::2], ratios[0::2])
+            return {"mag_ratios": [round(float(r), 5) for r in ratios]}
+        if len(self.input_changes) < 5:
+            return None
+        coefficients = np.polyfit(np.array(self.input_changes), np.array(self.output_changes), 4)
+        return {"coefficients": [float(c) for c in coefficients]}
+
+
+def _closest_to_target(thresholds, nb_steps, num_steps, speed_factor):
+    target_nb_steps = int(num_steps / speed_factor)
+    best = int(np.argmin(np.abs(target_nb_steps - nb_steps))) # first minimum, i.e. the smallest threshold
+    return float(thresholds[best]), int(nb_steps[best])
+
+
+def solve_magcache_threshold(mag_ratios, start_step, speed_factor, magcache_K, thresholds=None):
+    """
+    Finds the MagCache threshold whose number of computed steps is closest to num_steps / speed_factor.
+    All the candidate thresholds are simulated at once. Returns (threshold, nb computed steps).
+    """
+    mag_ratios = np.asarray(mag_ratios, dtype=np.float64)
+    num_steps = len(mag_ratios) // 2
+    thresholds = np.arange(0.001, 0.6005, 0.001) if thresholds is None else np.asarray(thresholds)
+    accumulated_err = np.zeros(len(thresholds))
+    accumulated_steps = np.zeros(len(thresholds), dtype=np.int64)
+    accumulated_ratio = np.ones(len(thresholds))
+    nb_steps = np.zeros(len(thresholds), dtype=np.int64)
+    for i in range(num_steps):
+        if i <= start_step:
+            nb_steps += 1
+            continue
+        accumulated_ratio *= mag_ratios[i * 2]
+        accumulated_steps += 1
+        accumulated_err += np.abs(1 - accumulated_ratio)
+        calc = ~((accumulated_err < thresholds) & (accumulated_steps <= magcache_K))
+        accumulated_err[calc], accumulated_steps[calc], accumulated_ratio[calc] = 0, 0, 1.0
+        nb_steps += calc
+    return _closest_to_target(thresholds, nb_steps, num_steps, speed_factor)
+
+
+def solve_teacache_threshold(deltas, start_step, speed_factor, thresholds=None):
+    """
+    Finds the TeaCache threshold whose number of computed steps is closest to num_steps / speed_factor.
+    deltas[i] is the rescaled modulated input change at step i. Returns (threshold, nb computed steps).
+    """
+    deltas = np.asarray(deltas, dtype=np.float64)
+    num_steps = len(deltas)
+    thresholds = np.arange(0.001, 0.6005, 0.001) if thresholds is None else np.asarray(thresholds)
+    accumulated_rel_l1_distance = np.zeros(len(thresholds))
+    nb_steps = np.zeros(len(thresholds), dtype=np.int64)
+    for i in range(num_steps):
+        if i <= start_step or i == num_steps - 1:
+            nb_steps += 1
+            continue
+        accumulated_rel_l1_distance += deltas[i]
+        calc = accumulated_rel_l1_distance >= thresholds
+        accumulated_rel_l1_distance[calc] = 0
+        nb_steps += calc
+    return _closest_to_target(thresholds, nb_steps, num_steps, speed_factor)
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import threading
 from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Any, Callable, Iterable, Hashable
 
 import torch
 
+from shared.utils.file_cache import evict_least_recently_used, remove_quietly
+
 
 @dataclass
 class _CacheEntry:
@@ -13,11 +19,122 @@ class _CacheEntry:
     size_bytes: int
 
 
+class _UnsupportedValue(Exception):
+    pass
+
+
+class TextEncoderDiskCache:
+    """
+    Persistent tier shared by all the text encoder caches (and by all the processes using the same folder).
+
+    Each embedding is a safetensors file named after a hash of the namespace (encoder checkpoint signature),
+    the encode function and the cache key. The nesting of lists / tuples / dicts around the tensors is kept
+    in the safetensors metadata. Files are written under a temporary name then renamed so that a reader
+    never sees a partial file, the least recently used files are deleted when the folder exceeds max_size_mb.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 2048) -> None:
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, file_key: str) -> str:
+        return os.path.join(self.cache_dir, file_key + ".safetensors")
+
+    def load(self, file_key: str) -> Any:
+        from safetensors import safe_open
+
+        path = self._path(file_key)
+        try:
+            with safe_open(path, framework="pt", device="cpu") as f:
+                structure = json.loads(f.metadata()["structure"])
+                tensors = {name: f.get_tensor(name) for name in f.keys()}
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable text encoder cache file {path}: {e}")
+            remove_quietly(path)
+            return None
+        return _unflatten(structure, tensors)
+
+    def save(self, file_key: str, value: Any) -> None:
+        from safetensors.torch import save_file
+
+        tensors: dict[str, torch.Tensor] = {}
+        try:
+            structure = _flatten(value, tensors)
+        except _UnsupportedValue:
+            return
+        if not tensors or sum(t.numel() * t.element_size() for t in tensors.values()) > self.max_size_bytes:
+            return
+        path = self._path(file_key)
+        tmp_path = f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+        try:
+            save_file(tensors, tmp_path, metadata={"structure": json.dumps(structure)})
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Unable to write text encoder cache file {path}: {e}")
+            remove_quietly(tmp_path)
+            return
+        evict_least_recently_used(self.cache_dir, self.max_size_bytes, ".safetensors")
+
+
+def _flatten(value: Any, tensors: dict[str, torch.Tensor]) -> Any:
+    if torch.is_tensor(value):
+        name = str(len(tensors))
+        # clone: safetensors refuses tensors sharing the same storage
+        tensors[name] = value.detach().to("cpu").contiguous().clone()
+        return {"tensor": name}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {"value": value}
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise _UnsupportedValue()
+        return {"dict": {k: _flatten(v, tensors) for k, v in value.items()}}
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return {"tuple": [_flatten(v, tensors) for v in value]}
+    if isinstance(value, list):
+        return {"list": [_flatten(v, tensors) for v in value]}
+    raise _UnsupportedValue()
+
+
+def _unflatten(structure: Any, tensors: dict[str, torch.Tensor]) -> Any:
+    if "tensor" in structure:
+        return tensors[structure["tensor"]]
+    if "value" in structure:
+        return structure["value"]
+    if "dict" in structure:
+        return {k: _unflatten(v, tensors) for k, v in structure["dict"].items()}
+    if "tuple" in structure:
+        return tuple(_unflatten(v, tensors) for v in structure["tuple"])
+    return [_unflatten(v, tensors) for v in structure["list"]]
+
+
+_disk_cache: TextEncoderDiskCache | None = None
+_disk_namespace: str | None = None
+
+
+def configure_disk_cache(cache_dir: str | None, max_size_mb: float = 2048, namespace: str | None = None) -> None:
+    """
+    Sets the persistent tier used by the TextEncoderCache instances created afterwards. namespace must identify
+    the text encoder weights (see file_cache.checkpoint_signature), no persistent tier if cache_dir is None or max_size_mb is 0.
+    """
+    global _disk_cache, _disk_namespace
+    if cache_dir is None or max_size_mb <= 0:
+        _disk_cache = None
+    elif _disk_cache is None or _disk_cache.cache_dir != cache_dir or _disk_cache.max_size_bytes != int(max_size_mb * 1024 * 1024):
+        _disk_cache = TextEncoderDiskCache(cache_dir, max_size_mb)
+    _disk_namespace = namespace
+
+
 class TextEncoderCache:
-    def __init__(self, max_size_mb: float = 100) -> None:
+    def __init__(self, max_size_mb: float = 100, persistent: bool = True) -> None:
         self.max_size_bytes = int(max_size_mb * 1024 * 1024)
         self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
         self._size_bytes = 0
+        self._disk = _disk_cache if persistent and _disk_namespace is not None else None
+        self._namespace = _disk_namespace
 
     def encode(
         self,
@@ -46,9 +163,8 @@ class TextEncoderCache:
         if not parallel:
             results: list[Any] = []
             for prompt, cache_key in zip(prompts_list, keys_list):
-                cached = self._entries.get(cache_key)
+                cached = self._lookup(encode_fn, cache_key)
                 if cached is not None:
-                    self._entries.move_to_end(cache_key)
                     results.append(self._to_device(cached.value, device))
                     continue
                 encoded = encode_fn([prompt])
@@ -58,7 +174,7 @@ class TextEncoderCache:
                     encoded_item = encoded[0]
                 else:
                     encoded_item = encoded
-                results.append(self._store(cache_key, encoded_item, device))
+                results.append(self._store(encode_fn, cache_key, encoded_item, device))
             return results
 
         results = [None] * len(prompts_list)
@@ -67,13 +183,12 @@ class TextEncoderCache:
         missing_keys: list[Hashable] = []
 
         for idx, (prompt, cache_key) in enumerate(zip(prompts_list, keys_list)):
-            cached = self._entries.get(cache_key)
+            cached = self._lookup(encode_fn, cache_key)
             if cached is None:
                 missing_prompts.append(prompt)
                 missing_indices.append(idx)
                 missing_keys.append(cache_key)
                 continue
-            self._entries.move_to_end(cache_key)
             results[idx] = self._to_device(cached.value, device)
 
         if missing_prompts:
@@ -83,12 +198,36 @@ class TextEncoderCache:
             if len(encoded_batch) != len(missing_prompts):
                 raise ValueError("encode_fn returned unexpected number of embeddings.")
             for cache_key, idx, encoded in zip(missing_keys, missing_indices, encoded_batch):
-                results[idx] = self._store(cache_key, encoded, device)
+                results[idx] = self._store(encode_fn, cache_key, encoded, device)
 
         return results
 
-    def _store(self, cache_key: Hashable, encoded: Any, device: torch.device | str | None) -> Any:
+    def _disk_key(self, encode_fn: Callable, cache_key: Hashable) -> str:
+        # the encode function tells apart the caches of different pipelines / encoders sharing a namespace
+        key = f"{self._namespace}\0{getattr(encode_fn, '__qualname__', '')}\0{cache_key!r}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _lookup(self, encode_fn: Callable, cache_key: Hashable) -> _CacheEntry | None:
+        cached = self._entries.get(cache_key)
+        if cached is not None:
+            self._entries.move_to_end(cache_key)
+            return cached
+        if self._disk is None:
+            return None
+        value = self._disk.load(self._disk_key(encode_fn, cache_key))
+        if value is None:
+            return None
+        self._remember(cache_key, value)
+        return _CacheEntry(value, 0)
+
+    def _store(self, encode_fn: Callable, cache_key: Hashable, encoded: Any, device: torch.device | str | None) -> Any:
         cached_value = self._detach_to_cpu(encoded)
+        self._remember(cache_key, cached_value)
+        if self._disk is not None:
+            self._disk.save(self._disk_key(encode_fn, cache_key), cached_value)
+        return self._to_device(encoded, device)
+
+    def _remember(self, cache_key: Hashable, cached_value: Any) -> None:
         size_bytes = self._estimate_size_bytes(cached_value)
         if size_bytes <= self.max_size_bytes:
             existing = self._entries.pop(cache_key, None)
@@ -100,7 +239,6 @@ class TextEncoderCache:
         else:
             if cache_key in self._entries:
                 self._entries.move_to_end(cache_key)
-        return self._to_device(encoded, device)
 
     def _purge_if_needed(self) -> None:
         if self._size_bytes <= self.max_size_bytes:
@@ -18,7 +18,6 @@ import tempfile
 import subprocess
 import json
 import time
-from functools import lru_cache
 os.environ["U2NET_HOME"] = os.path.join(os.getcwd(), "ckpts", "rembg")
 
 
@@ -157,32 +156,19 @@ def process_images_multithread(image_processor, items, process_type, wrap_in_lis
     # print(f"duration:{end_time-start_time:.1f}")
 
     return results
-@lru_cache(maxsize=100)
 def get_video_info(video_path):
-    global video_info_cache
-    import cv2
-    cap = cv2.VideoCapture(video_path)
-    
-    # Get FPS
-    fps = round(cap.get(cv2.CAP_PROP_FPS))
-    
-    # Get resolution
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) 
-    cap.release()
-    
-    return fps, width, height, frame_count
+    from shared.utils.video_reader import video_readers
+    try:
+        # fps, width, height, frame_count, without keeping the file open
+        return video_readers.probe(video_path)
+    except (OSError, ValueError):
+        return 0, 0, 0, 0
 
 def get_video_frame(file_name: str, frame_no: int, return_last_if_missing: bool = False, target_fps = None,  return_PIL = True) -> torch.Tensor:
     """Extract nth frame from video as PyTorch tensor normalized to [-1, 1]."""
-    cap = cv2.VideoCapture(file_name)
-    
-    if not cap.isOpened():
-        raise ValueError(f"Cannot open video: {file_name}")
-    
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = round(cap.get(cv2.CAP_PROP_FPS))
+    from shared.utils.video_reader import video_readers
+
+    fps, _, _, total_frames = video_readers.info(file_name)
     if target_fps is not None:
         frame_no = round(target_fps * frame_no /fps)
 
@@ -191,19 +177,10 @@ def get_video_frame(file_name: str, frame_no: int, return_last_if_missing: bool
         if return_last_if_missing:
             frame_no = total_frames - 1
         else:
-            cap.release()
             raise IndexError(f"Frame {frame_no} out of bounds (0-{total_frames-1})")
     
-    # Get frame
-    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-    ret, frame = cap.read()
-    cap.release()
-    
-    if not ret:
-        raise ValueError(f"Failed to read frame {frame_no}")
-    
-    # Convert BGR->RGB, reshape to (C,H,W), normalize to [-1,1]
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    # Get frame (RGB), reshape to (C,H,W), normalize to [-1,1]
+    frame = video_readers.get_frames(file_name, [frame_no])[0]
     if return_PIL:
           return Image.fromarray(frame)
     else:
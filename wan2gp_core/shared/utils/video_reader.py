@@ -0,0 +1,131 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class _OpenedVideo:
+    def __init__(self, signature, reader):
+        self.signature = signature
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.info = None
+
+
+class VideoReaderPool:
+    """
+    Shared video readers, so that the sliding windows of a generation (guide and mask extraction, single
+    frames, video infos) stop reopening and reindexing the same source files.
+
+    Opening a decord.VideoReader demuxes the whole file once to build its frame / keyframe index, the
+    readers are therefore kept open (at most max_readers, least recently used closed first) and reused
+    while the file is unchanged (same size and modification time). Batched requests are served in sorted
+    decode order, each keyframe interval being decoded once, and returned as numpy arrays that torch can
+    wrap without copy. Calls on the same file are serialized since a decord reader is not thread safe.
+    Open readers lock their file on Windows: close() them before the files are renamed or deleted
+    (wgp closes them at the end of each generation). Metadata only queries (probe) therefore don't open
+    a reader, they read the container properties with cv2 unless the file already has an open reader.
+    """
+
+    def __init__(self, max_readers=4, max_probes=100):
+        self.max_readers = max_readers
+        self.max_probes = max_probes
+        self._videos = OrderedDict()
+        self._probes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _get_video(self, path):
+        path = os.path.abspath(path)
+        signature = self._signature(path)
+        with self._lock:
+            video = self._videos.get(path, None)
+            if video is not None and video.signature == signature:
+                self._videos.move_to_end(path)
+                return video
+        import decord
+        try:
+            video = _OpenedVideo(signature, decord.VideoReader(path))
+        except Exception as e:
+            raise ValueError(f"Cannot open video: {path}") from e
+        with self._lock:
+            self._videos[path] = video
+            self._videos.move_to_end(path)
+            while len(self._videos) > self.max_readers:
+                self._videos.popitem(last=False)
+        return video
+
+    @staticmethod
+    def _to_numpy(frames):
+        # the native bridge returns decord NDArrays, the torch bridge shares the decoded memory through dlpack
+        return frames.asnumpy() if hasattr(frames, "asnumpy") else frames.numpy()
+
+    def probe(self, path):
+        """Same as info() without opening a reader (the frame count is the container's estimate)."""
+        path = os.path.abspath(path)
+        signature = self._signature(path)
+        with self._lock:
+            video = self._videos.get(path, None)
+            if video is not None and video.signature == signature and video.info is not None:
+                return video.info
+            probed = self._probes.get(path, None)
+            if probed is not None and probed[0] == signature:
+                self._probes.move_to_end(path)
+                return probed[1]
+        import cv2
+        capture = cv2.VideoCapture(path)
+        try:
+            if not capture.isOpened():
+                raise ValueError(f"Cannot open video: {path}")
+            info = (round(capture.get(cv2.CAP_PROP_FPS)), int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        finally:
+            capture.release()
+        with self._lock:
+            self._probes[path] = (signature, info)
+            self._probes.move_to_end(path)
+            while len(self._probes) > self.max_probes:
+                self._probes.popitem(last=False)
+        return info
+
+    def info(self, path):
+        """Returns the rounded fps, width, height and number of frames of a video, as decoded by its reader."""
+        video = self._get_video(path)
+        with video.lock:
+            if video.info is None:
+                reader = video.reader
+                height, width, _ = self._to_numpy(reader.get_batch([0])).shape[1:]
+                video.info = (round(reader.get_avg_fps()), width, height, len(reader))
+        return video.info
+
+    def get_frames(self, path, frame_nos):
+        """Returns the frames frame_nos (in this order) as a N, H, W, 3 uint8 RGB numpy array."""
+        frame_nos = np.asarray(frame_nos, dtype=np.int64)
+        if len(frame_nos) == 0:
+            _, width, height, _ = self.info(path)
+            return np.zeros((0, height, width, 3), dtype=np.uint8)
+        video = self._get_video(path)
+        decode_order, positions = np.unique(frame_nos, return_inverse=True)
+        with video.lock:
+            frames = self._to_numpy(video.reader.get_batch(decode_order.tolist()))
+        if len(decode_order) == len(frame_nos) and np.array_equal(decode_order, frame_nos):
+            return frames
+        return frames[positions]
+
+    def close(self, path=None):
+        """Closes the reader of path, all the readers if path is None."""
+        with self._lock:
+            if path is None:
+                self._videos.clear()
+            else:
+                self._videos.pop(os.path.abspath(path), None)
+
+video_readers = VideoReaderPool()
+
+
+def configure(max_readers=4):
+    video_readers.max_readers = max(1, max_readers)
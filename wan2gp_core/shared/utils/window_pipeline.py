@@ -0,0 +1,81 @@
+import contextlib
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_exit_stacks = threading.local()
+
+
+def run_exit_callbacks(func):
+    """Decorator: the callbacks registered with on_exit() while func runs are called (last registered first) however it returns or raises."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stacks = _exit_stacks.__dict__.setdefault("stacks", [])
+        with contextlib.ExitStack() as stack:
+            stacks.append(stack)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stacks.pop()
+    return wrapper
+
+
+def on_exit(callback, *args, **kwargs):
+    """Registers callback(*args, **kwargs) to run when the innermost run_exit_callbacks function exits."""
+    _exit_stacks.stacks[-1].callback(callback, *args, **kwargs)
+
+
+class WindowOutputPipeline:
+    """Saves the output of a sliding window on a worker thread while the next window denoises.
+
+    Encoding, audio muxing and metadata writing of window N only need the CPU and the disk, so
+    they are handed to a single worker thread (outputs are still written in window order) and the
+    GPU starts on window N+1 right away. At most one save is pending: submitting the next one or
+    calling finish() waits for it and re-raises its exception, if any.
+    """
+
+    def __init__(self, enabled=True):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="window_output") if enabled else None
+        self._pending = None
+        self._finished = False
+        self.background_time = 0
+        self.blocked_time = 0
+
+    def _run_timed(self, fn, args, kwargs):
+        start = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.background_time += time.time() - start
+
+    def submit(self, fn, *args, background=True, **kwargs):
+        """Runs fn(*args, **kwargs) after the previous save, on the worker thread if background."""
+        self.wait()
+        if self._executor is None or not background:
+            fn(*args, **kwargs)
+        else:
+            self._pending = self._executor.submit(self._run_timed, fn, args, kwargs)
+
+    def wait(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            start = time.time()
+            try:
+                pending.result()
+            finally:
+                self.blocked_time += time.time() - start
+
+    def finish(self):
+        """Waits for the pending save and stops the worker thread. Can be called more than once."""
+        if self._finished:
+            return
+        self._finished = True
+        try:
+            self.wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        if self.background_time > 0:
+            print(f"Window outputs saved in background: {self.background_time:.1f}s, {max(0, self.background_time - self.blocked_time):.1f}s overlapped with denoising")
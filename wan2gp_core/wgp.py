@@ -39,14 +39,24 @@ from shared.utils.loras_mutipliers import preparse_loras_multipliers, parse_lora
 from shared.utils.utils import convert_tensor_to_image, save_image, get_video_info, get_file_creation_date, convert_image_to_video, calculate_new_dimensions, convert_image_to_tensor, calculate_dimensions_and_resize_image, rescale_and_crop, get_video_frame, resize_and_remove_background, rgb_bw_to_rgba_mask, to_rgb_tensor
 from shared.utils.utils import calculate_new_dimensions, get_outpainting_frame_location, get_outpainting_full_area_dimensions
 from shared.utils.utils import has_video_file_extension, has_image_file_extension, has_audio_file_extension
-from shared.utils.audio_video import extract_audio_tracks, combine_video_with_audio_tracks, combine_and_concatenate_video_with_audio_tracks, cleanup_temp_audio_files, normalize_audio_pair_volumes_to_temp_files, save_video, save_image
+from shared.utils.audio_video import extract_audio_tracks, combine_video_with_audio_tracks, combine_and_concatenate_video_with_audio_tracks, cleanup_temp_audio_files, normalize_audio_pair_volumes_to_temp_files, save_video, save_image, VideoSegmentWriter
 from shared.utils.audio_video import save_image_metadata, read_image_metadata, extract_audio_track_to_wav, write_wav_file, save_audio_file, get_audio_codec_extension
 from shared.utils.audio_metadata import save_audio_metadata, read_audio_metadata, extract_creation_datetime_from_metadata, resolve_audio_creation_datetime
 from shared.utils.video_metadata import save_video_metadata
 from shared.match_archi import match_nvidia_architecture
-from shared.attention import get_attention_modes, get_supported_attention_modes
+from shared.attention import get_attention_modes, get_supported_attention_modes, attention_tuner
 from shared.utils.utils import truncate_for_filesystem, sanitize_file_name, process_images_multithread, get_default_workers
 from shared.utils.process_locks import acquire_GPU_ressources, release_GPU_ressources, any_GPU_process_running, gen_lock
+from shared.utils.residency import WindowResidency
+from shared.utils.window_pipeline import WindowOutputPipeline, run_exit_callbacks, on_exit
+from shared.utils.step_cache_profiles import StepCacheProfiles, StepCacheCalibration, profile_key
+from shared.utils.live_preview import LatentPreviewRenderer
+from shared.utils.annotator_pool import AnnotatorPool
+from shared.utils.text_encoder_cache import configure_disk_cache as configure_text_encoder_disk_cache
+from shared.utils.file_cache import checkpoint_signature
+from shared.utils.prepared_checkpoints import configure as configure_prepared_checkpoints
+from shared.utils.control_frames_cache import configure as configure_control_frames_cache, get_control_frames_cache
+from shared.utils.video_reader import configure as configure_video_readers, video_readers
 from shared.loras_migration import migrate_loras_layout
 from huggingface_hub import hf_hub_download, snapshot_download
 from shared.utils import files_locator as fl 
@@ -2210,6 +2220,16 @@ def _parse_args():
         default="",
         help="Override output directory for CLI processing (use with --process)"
     )
+    parser.add_argument(
+        "--json-progress",
+        action="store_true",
+        help="Also emit machine readable JSON progress events on stdout (use with --process; always on with --serve)"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as a persistent headless worker reading JSON job requests on stdin (one per line) and keeping the loaded model between jobs"
+    )
     parser.add_argument(
         "--refresh-catalog",
         action="store_true",
@@ -2299,6 +2319,7 @@ if config_dir:
 else:
     AUTOSAVE_PATH = AUTOSAVE_FILENAME
     AUTOSAVE_TEMPLATE_PATH = AUTOSAVE_FILENAME
+step_cache_profiles = StepCacheProfiles(os.path.join(config_dir if config_dir else wgp_root, "steps_skipping_profiles"))
 
 if not os.path.isdir("settings"):
     os.mkdir("settings")
@@ -2376,6 +2397,9 @@ checkpoints_paths = server_config.get("checkpoints_paths", None)
 if checkpoints_paths is None: checkpoints_paths = server_config["checkpoints_paths"] = fl.default_checkpoints_paths
 fl.set_checkpoints_paths(checkpoints_paths)
 three_levels_hierarchy = server_config.get("model_hierarchy_type", 1) == 1
+annotator_pool = AnnotatorPool(max_entries= server_config.get("annotators_pool_size", 4), min_free_ram_perc= server_config.get("annotators_min_free_ram_perc", 15))
+configure_control_frames_cache(os.path.join(config_dir if config_dir else wgp_root, "control_frames"), server_config.get("control_frames_cache_mb", 4096))
+configure_video_readers(server_config.get("video_readers_pool_size", 4))
 
 MMAUDIO_MODE_OFF = 0
 MMAUDIO_MODE_V2 = 1
@@ -3661,6 +3685,10 @@ def load_models(model_type, override_profile = -1, output_type="video", **model_
             download_models(text_encoder_filename, file_model_type, 2, -1, force_path =text_encoder_folder)
             text_encoder_filename =  get_local_model_filename(text_encoder_filename, extra_paths=text_encoder_folder)
             print(f"Loading Text Encoder '{text_encoder_filename}' ...")
+    # prompt embeddings persist across processes, keyed by the text encoder weights (or the model weights if it embeds its encoders)
+    text_encoder_signature = checkpoint_signature(*([text_encoder_filename] if text_encoder_filename else local_model_file_list))
+    configure_prepared_checkpoints(os.path.join(fl.get_download_location(), "prepared"), server_config.get("prepared_checkpoints_max_gb", 0))
+    configure_text_encoder_disk_cache(os.path.join(config_dir if config_dir else wgp_root, "text_encoder_cache"), server_config.get("text_encoder_disk_cache_mb", 2048), namespace= f"{base_model_type}_{text_encoder_signature}")
 
 
     profile = compute_profile(override_profile, output_type)
@@ -3773,10 +3801,11 @@ def get_gen_info(state):
         state["gen"] = cache
     return cache
 
-def build_callback(state, pipe, send_cmd, status, num_inference_steps, preview_meta=None):
+def build_callback(state, pipe, send_cmd, status, num_inference_steps, preview_meta=None, model_type=None):
     gen = get_gen_info(state)
     gen["num_inference_steps"] = num_inference_steps
     start_time = time.time()    
+    preview_renderer = LatentPreviewRenderer(max_fps= server_config.get("preview_max_fps", 2))
     def callback(step_idx = -1, latent = None, force_refresh = True, read_state = False, override_num_inference_steps = -1, pass_no = -1, preview_meta=preview_meta, denoising_extra ="", progress_unit = None):
         in_pause = False
         with gen_lock:
@@ -3862,9 +3891,12 @@ def build_callback(state, pipe, send_cmd, status, num_inference_steps, preview_m
         
         # progress(*progress_args)
         send_cmd("progress", progress_args)
-        if latent is not None:
+        if latent is not None and preview_renderer.due(force= step_idx == num_inference_steps):
             payload = pipe.prepare_preview_payload(latent, preview_meta) if hasattr(pipe, "prepare_preview_payload") else latent
-            if isinstance(payload, dict):
+            device_preview = render_device_preview(preview_renderer, model_type, payload)
+            if device_preview is not None:
+                payload = device_preview
+            elif isinstance(payload, dict):
                 data = payload.copy()
                 lat = data.get("latents")
                 if torch.is_tensor(lat):
@@ -4335,6 +4367,7 @@ def select_video(state, current_gallery_tab, input_file_list, file_selected, aud
                 if video_window_no > 0: video_length_summary +=f", Window no {video_window_no }" 
                 if is_image:
                     video_length_summary = configs.get("batch_size", 1)
+                    if "batch_index" in configs: video_length_summary = f"{video_length_summary} (image {configs['batch_index'] + 1} of a batch of {configs['denoising_batch_size']})"
                     video_length_label = "Number of Images"
                 else:
                     video_length_summary += " ("
@@ -4611,16 +4644,15 @@ def get_resampled_video(video_in, start_frame, max_frames, target_fps, bridge='t
 
     import decord
     decord.bridge.set_bridge(bridge)
-    reader = decord.VideoReader(video_in)
-    fps = round(reader.get_avg_fps())
+    fps, _, _, frames_count = video_readers.info(video_in)
     if max_frames < 0:
-        max_frames = int(max(len(reader)/ fps * target_fps + max_frames, 0))
+        max_frames = int(max(frames_count/ fps * target_fps + max_frames, 0))
 
 
-    frame_nos = resample(fps, len(reader), max_target_frames_count= max_frames, target_fps=target_fps, start_target_frame= start_frame)
-    frames_list = reader.get_batch(frame_nos)
+    frame_nos = resample(fps, frames_count, max_target_frames_count= max_frames, target_fps=target_fps, start_target_frame= start_frame)
+    frames_list = video_readers.get_frames(video_in, frame_nos)
     # print(f"frame nos: {frame_nos}")
-    return frames_list
+    return torch.from_numpy(frames_list) if bridge == 'torch' else frames_list
 
 # def get_resampled_video(video_in, start_frame, max_frames, target_fps):
 #     from torchvision.io import VideoReader
@@ -4664,53 +4696,62 @@ def get_resampled_video(video_in, start_frame, max_frames, target_fps, bridge='t
 #     return frames
 
 
-def get_preprocessor(process_type, inpaint_color):
+def get_preprocessor_config(process_type):
+    """Config of the annotator of process_type (model files and variant), None if it has no model."""
     if process_type=="pose":
-        from preprocessing.dwpose.pose import PoseBodyFaceVideoAnnotator
-        cfg_dict = {
+        return {
             "DETECTION_MODEL": fl.locate_file("pose/yolox_l.onnx"),
             "POSE_MODEL": fl.locate_file("pose/dw-ll_ucoco_384.onnx"),
             "RESIZE_SIZE": 1024
         }
-        anno_ins = lambda img: PoseBodyFaceVideoAnnotator(cfg_dict).forward(img)
     elif process_type=="depth":
-
-        from preprocessing.depth_anything_v2.depth import DepthV2VideoAnnotator
-
         if server_config.get("depth_anything_v2_variant", "vitl") == "vitl":
-            cfg_dict = {
+            return {
                 "PRETRAINED_MODEL": fl.locate_file("depth/depth_anything_v2_vitl.pth"),
                 'MODEL_VARIANT': 'vitl'
             }
         else:
-            cfg_dict = {
+            return {
                 "PRETRAINED_MODEL": fl.locate_file("depth/depth_anything_v2_vitb.pth"),
                 'MODEL_VARIANT': 'vitb',
             }
+    elif process_type=="gray":
+        return {}
+    elif process_type in ["canny", "scribble"]:
+        return {
+                "PRETRAINED_MODEL": fl.locate_file("scribble/netG_A_latest.pth")
+            }
+    elif process_type=="flow":
+        return {
+                "PRETRAINED_MODEL": fl.locate_file("flow/raft-things.pth")
+            }
+    return None
+
+def get_preprocessor(process_type, inpaint_color):
+    def pooled(annotator_class, cfg_dict):
+        # annotators stay loaded in the pool across windows and tasks
+        key = (process_type, annotator_class.__name__, tuple(sorted(cfg_dict.items())))
+        return lambda img: annotator_pool.forward(key, lambda: annotator_class(cfg_dict), img)
 
-        anno_ins = lambda img: DepthV2VideoAnnotator(cfg_dict).forward(img)
+    cfg_dict = get_preprocessor_config(process_type)
+    if process_type=="pose":
+        from preprocessing.dwpose.pose import PoseBodyFaceVideoAnnotator
+        anno_ins = pooled(PoseBodyFaceVideoAnnotator, cfg_dict)
+    elif process_type=="depth":
+        from preprocessing.depth_anything_v2.depth import DepthV2VideoAnnotator
+        anno_ins = pooled(DepthV2VideoAnnotator, cfg_dict)
     elif process_type=="gray":
         from preprocessing.gray import GrayVideoAnnotator
-        cfg_dict = {}
-        anno_ins = lambda img: GrayVideoAnnotator(cfg_dict).forward(img)
+        anno_ins = pooled(GrayVideoAnnotator, cfg_dict)
     elif process_type=="canny":
         from preprocessing.canny import CannyVideoAnnotator
-        cfg_dict = {
-                "PRETRAINED_MODEL": fl.locate_file("scribble/netG_A_latest.pth")
-            }
-        anno_ins = lambda img: CannyVideoAnnotator(cfg_dict).forward(img)
+        anno_ins = pooled(CannyVideoAnnotator, cfg_dict)
     elif process_type=="scribble":
         from preprocessing.scribble import ScribbleVideoAnnotator
-        cfg_dict = {
-                "PRETRAINED_MODEL": fl.locate_file("scribble/netG_A_latest.pth")
-            }
-        anno_ins = lambda img: ScribbleVideoAnnotator(cfg_dict).forward(img)
+        anno_ins = pooled(ScribbleVideoAnnotator, cfg_dict)
     elif process_type=="flow":
         from preprocessing.flow import FlowVisAnnotator
-        cfg_dict = {
-                "PRETRAINED_MODEL": fl.locate_file("flow/raft-things.pth")
-            }
-        anno_ins = lambda img: FlowVisAnnotator(cfg_dict).forward(img)
+        anno_ins = pooled(FlowVisAnnotator, cfg_dict)
     elif process_type=="inpaint":
         color = tuple(int(v) for v in inpaint_color.view(-1).tolist())
         anno_ins = lambda img :  len(img) * [color]
@@ -4780,6 +4821,39 @@ def extract_faces_from_video_with_mask(input_video_path, input_mask_path, max_fr
     return face_tensor
 
 
+def get_cached_control_frames(sources, start_frame, max_frames, process_frames, with_masks = False, temporal = False, **params):
+    """
+    Returns the frames (and masks) start_frame, ..., start_frame + max_frames - 1 produced from the source files by
+    process_frames(start_frame, max_frames), which returns lists of uint8 H, W, C tensors (or None). Frames already
+    preprocessed with the same params are read from the control frames cache and only the range of the missing ones
+    is processed. Frames of temporal processes depend on the whole range and are only reused for the same range. A
+    max_frames <= 0 (relative to the end of the video) bypasses the cache.
+    """
+    frames_cache = get_control_frames_cache()
+    if frames_cache is None or max_frames <= 0 or any(source is not None and not (isinstance(source, str) and os.path.isfile(source)) for source in sources):
+        return process_frames(start_frame, max_frames)
+    cache_key = frames_cache.key(sources, range = (start_frame, max_frames) if temporal else None, **params)
+    cached_frames, cached_masks, end_frame = frames_cache.load(cache_key, start_frame, max_frames)
+    last_frame = start_frame + max_frames if end_frame is None else min(start_frame + max_frames, end_frame)
+    missing_frames = [frame_no for frame_no in range(start_frame, last_frame) if frame_no not in cached_frames or with_masks and (cached_masks is None or frame_no not in cached_masks)]
+    if len(missing_frames) > 0:
+        span_start, span_end = (start_frame, start_frame + max_frames) if temporal else (missing_frames[0], missing_frames[-1] + 1)
+        new_frames, new_masks = process_frames(span_start, span_end - span_start)
+        new_frames = [] if new_frames is None else [frame.numpy() for frame in new_frames]
+        new_masks = [mask.numpy() for mask in new_masks] if with_masks and len(new_frames) > 0 else None
+        if len(new_frames) < span_end - span_start:
+            last_frame = end_frame = span_start + len(new_frames)
+        frames_cache.save(cache_key, span_start, new_frames, new_masks, end = end_frame)
+        cached_frames.update((span_start + i, frame) for i, frame in enumerate(new_frames))
+        if new_masks is not None:
+            if cached_masks is None: cached_masks = {}
+            cached_masks.update((span_start + i, mask) for i, mask in enumerate(new_masks))
+    if last_frame <= start_frame:
+        return None, None
+    frames = [torch.from_numpy(cached_frames[frame_no]) for frame_no in range(start_frame, last_frame)]
+    masks = [torch.from_numpy(cached_masks[frame_no]) for frame_no in range(start_frame, last_frame)] if with_masks else []
+    return frames, masks
+
 def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,  max_frames, start_frame=0, fit_canvas = None, fit_crop = False, target_fps = 16, block_size= 16, expand_scale = 2, process_type = "inpaint", process_type2 = None, to_bbox = False, RGB_Mask = False, negate_mask = False, process_outside_mask = None, inpaint_color = 127, outpainting_dims = None, proc_no = 1):
 
     def mask_to_xyxy_box(mask):
@@ -4813,168 +4887,181 @@ def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,
         any_identity_mask = True
         negate_mask = False
         process_outside_mask = None
-    preproc = get_preprocessor(process_type, inpaint_color)
-    preproc2 = None
-    if process_type2 != None:
-        preproc2 = get_preprocessor(process_type2, inpaint_color) if process_type != process_type2 else preproc
-    if process_outside_mask == process_type :
-        preproc_outside = preproc
-    elif preproc2 != None and process_outside_mask == process_type2 :
-        preproc_outside = preproc2
-    else:
-        preproc_outside = get_preprocessor(process_outside_mask, inpaint_color)
-    video = get_resampled_video(input_video_path, start_frame, max_frames, target_fps)
-    if any_mask:
-        mask_video = get_resampled_video(input_mask_path, start_frame, max_frames, target_fps)
-
-    if len(video) == 0 or any_mask and len(mask_video) == 0:
-        return None, None
+    any_mask = any_mask or any_identity_mask
     if fit_crop and outpainting_dims != None:
         fit_crop = False
         fit_canvas = 0 if fit_canvas is not None else None
 
-    frame_height, frame_width, _ = video[0].shape
-
-    if outpainting_dims != None:
-        if fit_canvas != None:
-            frame_height, frame_width = get_outpainting_full_area_dimensions(frame_height,frame_width, outpainting_dims)
+    def process_frames(start_frame, max_frames, height, width):
+        preproc = get_preprocessor(process_type, inpaint_color)
+        preproc2 = None
+        if process_type2 != None:
+            preproc2 = get_preprocessor(process_type2, inpaint_color) if process_type != process_type2 else preproc
+        if process_outside_mask == process_type :
+            preproc_outside = preproc
+        elif preproc2 != None and process_outside_mask == process_type2 :
+            preproc_outside = preproc2
         else:
-            frame_height, frame_width = height, width
+            preproc_outside = get_preprocessor(process_outside_mask, inpaint_color)
+        video = get_resampled_video(input_video_path, start_frame, max_frames, target_fps)
+        if input_mask_path != None:
+            mask_video = get_resampled_video(input_mask_path, start_frame, max_frames, target_fps)
 
-    if fit_canvas != None:
-        height, width = calculate_new_dimensions(height, width, frame_height, frame_width, fit_into_canvas = fit_canvas, block_size = block_size)
+        if len(video) == 0 or input_mask_path != None and len(mask_video) == 0:
+            return None, None
 
-    if outpainting_dims != None:
-        final_height, final_width = height, width
-        height, width, margin_top, margin_left =  get_outpainting_frame_location(final_height, final_width,  outpainting_dims, 1)        
+        frame_height, frame_width, _ = video[0].shape
 
-    if any_mask:
-        num_frames = min(len(video), len(mask_video))
-    else:
-        num_frames = len(video)
+        if outpainting_dims != None:
+            if fit_canvas != None:
+                frame_height, frame_width = get_outpainting_full_area_dimensions(frame_height,frame_width, outpainting_dims)
+            else:
+                frame_height, frame_width = height, width
 
-    if any_identity_mask:
-        any_mask = True
+        if fit_canvas != None:
+            height, width = calculate_new_dimensions(height, width, frame_height, frame_width, fit_into_canvas = fit_canvas, block_size = block_size)
 
-    proc_list =[]
-    proc_list_outside =[]
-    proc_mask = []
+        if outpainting_dims != None:
+            final_height, final_width = height, width
+            height, width, margin_top, margin_left =  get_outpainting_frame_location(final_height, final_width,  outpainting_dims, 1)        
 
-    # for frame_idx in range(num_frames):
-    def prep_prephase(frame_idx):
-        frame = Image.fromarray(video[frame_idx].cpu().numpy()) #.asnumpy()
-        if fit_crop:
-            frame = rescale_and_crop(frame, width, height)
+        if input_mask_path != None:
+            num_frames = min(len(video), len(mask_video))
         else:
-            frame = frame.resize((width, height), resample=Image.Resampling.LANCZOS) 
-        frame = np.array(frame) 
-        if any_mask:
-            if any_identity_mask:
-                mask = np.full( (height, width, 3), 0, dtype= np.uint8)
+            num_frames = len(video)
+
+        proc_list =[]
+        proc_list_outside =[]
+        proc_mask = []
+
+        # for frame_idx in range(num_frames):
+        def prep_prephase(frame_idx):
+            frame = Image.fromarray(video[frame_idx].cpu().numpy()) #.asnumpy()
+            if fit_crop:
+                frame = rescale_and_crop(frame, width, height)
             else:
-                mask = Image.fromarray(mask_video[frame_idx].cpu().numpy()) #.asnumpy()
-                if fit_crop:
-                    mask = rescale_and_crop(mask, width, height)
+                frame = frame.resize((width, height), resample=Image.Resampling.LANCZOS) 
+            frame = np.array(frame) 
+            if any_mask:
+                if any_identity_mask:
+                    mask = np.full( (height, width, 3), 0, dtype= np.uint8)
                 else:
-                    mask = mask.resize((width, height), resample=Image.Resampling.LANCZOS) 
-                mask = np.array(mask)
-
-            if len(mask.shape) == 3 and mask.shape[2] == 3:
-                mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-            _, mask = cv2.threshold(mask, 127.5, 255, cv2.THRESH_BINARY)
-            original_mask = mask.copy()
-            if expand_scale != 0:
-                kernel_size = abs(expand_scale)
-                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
-                op_expand = cv2.dilate if expand_scale > 0 else cv2.erode
-                mask = op_expand(mask, kernel, iterations=3)
-
-            if to_bbox and np.sum(mask == 255) > 0 : #or True 
-                x0, y0, x1, y1 = mask_to_xyxy_box(mask)
-                mask = mask * 0
-                mask[y0:y1, x0:x1] = 255
-            if negate_mask:
-                mask = 255 - mask
-                if pose_special:
-                    original_mask = 255 - original_mask
-
-        if pose_special and any_mask:            
-            target_frame = np.where(original_mask[..., None], frame, 0) 
-        else:
-            target_frame = frame 
+                    mask = Image.fromarray(mask_video[frame_idx].cpu().numpy()) #.asnumpy()
+                    if fit_crop:
+                        mask = rescale_and_crop(mask, width, height)
+                    else:
+                        mask = mask.resize((width, height), resample=Image.Resampling.LANCZOS) 
+                    mask = np.array(mask)
+
+                if len(mask.shape) == 3 and mask.shape[2] == 3:
+                    mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
+                _, mask = cv2.threshold(mask, 127.5, 255, cv2.THRESH_BINARY)
+                original_mask = mask.copy()
+                if expand_scale != 0:
+                    kernel_size = abs(expand_scale)
+                    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+                    op_expand = cv2.dilate if expand_scale > 0 else cv2.erode
+                    mask = op_expand(mask, kernel, iterations=3)
+
+                if to_bbox and np.sum(mask == 255) > 0 : #or True 
+                    x0, y0, x1, y1 = mask_to_xyxy_box(mask)
+                    mask = mask * 0
+                    mask[y0:y1, x0:x1] = 255
+                if negate_mask:
+                    mask = 255 - mask
+                    if pose_special:
+                        original_mask = 255 - original_mask
+
+            if pose_special and any_mask:            
+                target_frame = np.where(original_mask[..., None], frame, 0) 
+            else:
+                target_frame = frame 
 
+            if any_mask:
+                return (target_frame, frame, mask) 
+            else:
+                return (target_frame, None, None)
+        max_workers = get_default_workers()
+        proc_lists = process_images_multithread(prep_prephase, [frame_idx for frame_idx in range(num_frames)], "prephase", wrap_in_list= False, max_workers=max_workers, in_place= True)
+        proc_list, proc_list_outside, proc_mask = [None] * len(proc_lists), [None] * len(proc_lists), [None] * len(proc_lists)
+        for frame_idx, frame_group in enumerate(proc_lists): 
+            proc_list[frame_idx], proc_list_outside[frame_idx], proc_mask[frame_idx] = frame_group
+        prep_prephase = None
+        video = None
+        mask_video = None
+
+        if preproc2 != None:
+            proc_list2 = process_images_multithread(preproc2, proc_list, process_type2, max_workers=max_workers)
+            #### to be finished ...or not
+        proc_list = process_images_multithread(preproc, proc_list, process_type, max_workers=max_workers)
         if any_mask:
-            return (target_frame, frame, mask) 
+            proc_list_outside = process_images_multithread(preproc_outside, proc_list_outside, process_outside_mask, max_workers=max_workers)
         else:
-            return (target_frame, None, None)
-    max_workers = get_default_workers()
-    proc_lists = process_images_multithread(prep_prephase, [frame_idx for frame_idx in range(num_frames)], "prephase", wrap_in_list= False, max_workers=max_workers, in_place= True)
-    proc_list, proc_list_outside, proc_mask = [None] * len(proc_lists), [None] * len(proc_lists), [None] * len(proc_lists)
-    for frame_idx, frame_group in enumerate(proc_lists): 
-        proc_list[frame_idx], proc_list_outside[frame_idx], proc_mask[frame_idx] = frame_group
-    prep_prephase = None
-    video = None
-    mask_video = None
-
-    if preproc2 != None:
-        proc_list2 = process_images_multithread(preproc2, proc_list, process_type2, max_workers=max_workers)
-        #### to be finished ...or not
-    proc_list = process_images_multithread(preproc, proc_list, process_type, max_workers=max_workers)
-    if any_mask:
-        proc_list_outside = process_images_multithread(preproc_outside, proc_list_outside, process_outside_mask, max_workers=max_workers)
-    else:
-        proc_list_outside = proc_mask = len(proc_list) * [None]
-
-    masked_frames = []
-    masks = []
-    for frame_no, (processed_img, processed_img_outside, mask) in enumerate(zip(proc_list, proc_list_outside, proc_mask)):
-        if isinstance(processed_img, (list, tuple)):
-            processed_img = np.full((height, width, 3), processed_img, dtype=np.uint8)
-        if isinstance(processed_img_outside, (list, tuple)):
-            processed_img_outside = np.full((height, width, 3), processed_img_outside, dtype=np.uint8)
-        if any_mask :
-            masked_frame = np.where(mask[..., None], processed_img, processed_img_outside)
-            if process_outside_mask != None:
-                mask = np.full_like(mask, 255)
-            mask = torch.from_numpy(mask)
-            if RGB_Mask:
-                mask =  mask.unsqueeze(-1).repeat(1,1,3)
-            if outpainting_dims != None:
-                full_frame= torch.full( (final_height, final_width, mask.shape[-1]), 255, dtype= torch.uint8, device= mask.device)
-                full_frame[margin_top:margin_top+height, margin_left:margin_left+width] = mask
-                mask = full_frame 
-            masks.append(mask[:, :, 0:1].clone())
-        else:
-            masked_frame = processed_img
+            proc_list_outside = proc_mask = len(proc_list) * [None]
+
+        masked_frames = []
+        masks = []
+        for frame_no, (processed_img, processed_img_outside, mask) in enumerate(zip(proc_list, proc_list_outside, proc_mask)):
+            if isinstance(processed_img, (list, tuple)):
+                processed_img = np.full((height, width, 3), processed_img, dtype=np.uint8)
+            if isinstance(processed_img_outside, (list, tuple)):
+                processed_img_outside = np.full((height, width, 3), processed_img_outside, dtype=np.uint8)
+            if any_mask :
+                masked_frame = np.where(mask[..., None], processed_img, processed_img_outside)
+                if process_outside_mask != None:
+                    mask = np.full_like(mask, 255)
+                mask = torch.from_numpy(mask)
+                if RGB_Mask:
+                    mask =  mask.unsqueeze(-1).repeat(1,1,3)
+                if outpainting_dims != None:
+                    full_frame= torch.full( (final_height, final_width, mask.shape[-1]), 255, dtype= torch.uint8, device= mask.device)
+                    full_frame[margin_top:margin_top+height, margin_left:margin_left+width] = mask
+                    mask = full_frame 
+                masks.append(mask[:, :, 0:1].clone())
+            else:
+                masked_frame = processed_img
 
-        if isinstance(masked_frame, (int, float, np.integer)) or (isinstance(masked_frame, (list, tuple)) and len(masked_frame) == 3):
-            masked_frame= np.full( (height, width, 3), inpaint_color_np, dtype= np.uint8)
+            if isinstance(masked_frame, (int, float, np.integer)) or (isinstance(masked_frame, (list, tuple)) and len(masked_frame) == 3):
+                masked_frame= np.full( (height, width, 3), inpaint_color_np, dtype= np.uint8)
 
-        masked_frame = torch.from_numpy(masked_frame)
-        if masked_frame.shape[-1] == 1:
-            masked_frame =  masked_frame.repeat(1,1,3).to(torch.uint8)
+            masked_frame = torch.from_numpy(masked_frame)
+            if masked_frame.shape[-1] == 1:
+                masked_frame =  masked_frame.repeat(1,1,3).to(torch.uint8)
+
+            if outpainting_dims != None:
+                color = inpaint_color.to(masked_frame.device).view(1, 1, 3)
+                full_frame = color.expand(final_height, final_width, masked_frame.shape[-1]).clone()
+                full_frame[margin_top:margin_top+height, margin_left:margin_left+width] = masked_frame
+                masked_frame = full_frame 
+
+            masked_frames.append(masked_frame)
+            proc_list[frame_no] = proc_list_outside[frame_no] = proc_mask[frame_no] = None
+
+
+        # if args.save_masks:
+        #     from preprocessing.dwpose.pose import save_one_video
+        #     saved_masked_frames = [mask.cpu().numpy() for mask in masked_frames ]
+        #     save_one_video(f"masked_frames{'' if proc_no==1 else str(proc_no)}.mp4", saved_masked_frames, fps=target_fps, quality=8, macro_block_size=None)
+        #     if any_mask:
+        #         saved_masks = [mask.cpu().numpy() for mask in masks ]
+        #         save_one_video("masks.mp4", saved_masks, fps=target_fps, quality=8, macro_block_size=None)
+        preproc = None
+        preproc_outside = None
+        annotator_pool.offload()
+        gc.collect()
+        torch.cuda.empty_cache()
+        return masked_frames, masks
+
+    # the flow of a frame depends on its neighbours, flow frames are only reused for the same range
+    temporal = "flow" in (process_type, process_type2, process_outside_mask)
+    masked_frames, masks = get_cached_control_frames([input_video_path, input_mask_path], start_frame, max_frames, lambda start_frame, max_frames: process_frames(start_frame, max_frames, height, width), with_masks = any_mask, temporal = temporal,
+                                                     height=height, width=width, fit_canvas=fit_canvas, fit_crop=fit_crop, target_fps=target_fps, block_size=block_size, expand_scale=expand_scale,
+                                                     process_type=process_type, process_type2=process_type2, to_bbox=to_bbox, RGB_Mask=RGB_Mask, negate_mask=negate_mask, process_outside_mask=process_outside_mask,
+                                                     inpaint_color=inpaint_color_np, outpainting_dims=None if outpainting_dims is None else tuple(outpainting_dims),
+                                                     annotators=[None if cfg is None else sorted(cfg.items()) for cfg in map(get_preprocessor_config, (process_type, process_type2, process_outside_mask))])
+    if masked_frames is None:
+        return None, None
 
-        if outpainting_dims != None:
-            color = inpaint_color.to(masked_frame.device).view(1, 1, 3)
-            full_frame = color.expand(final_height, final_width, masked_frame.shape[-1]).clone()
-            full_frame[margin_top:margin_top+height, margin_left:margin_left+width] = masked_frame
-            masked_frame = full_frame 
-
-        masked_frames.append(masked_frame)
-        proc_list[frame_no] = proc_list_outside[frame_no] = proc_mask[frame_no] = None
-
-
-    # if args.save_masks:
-    #     from preprocessing.dwpose.pose import save_one_video
-    #     saved_masked_frames = [mask.cpu().numpy() for mask in masked_frames ]
-    #     save_one_video(f"masked_frames{'' if proc_no==1 else str(proc_no)}.mp4", saved_masked_frames, fps=target_fps, quality=8, macro_block_size=None)
-    #     if any_mask:
-    #         saved_masks = [mask.cpu().numpy() for mask in masks ]
-    #         save_one_video("masks.mp4", saved_masks, fps=target_fps, quality=8, macro_block_size=None)
-    preproc = None
-    preproc_outside = None
-    gc.collect()
-    torch.cuda.empty_cache()
     if pad_frames > 0:
         masked_frames = masked_frames[0] * pad_frames + masked_frames
         if any_mask: masked_frames = masks[0] * pad_frames + masks
@@ -4984,7 +5071,13 @@ def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,
     return masked_frames, masks
 
 def preprocess_video(height, width, video_in, max_frames, start_frame=0, fit_canvas = None, fit_crop = False, target_fps = 16, block_size = 16):
+    frames_list, _ = get_cached_control_frames([video_in], start_frame, max_frames, lambda start_frame, max_frames: (get_resized_video_frames(height, width, video_in, max_frames, start_frame, fit_canvas, fit_crop, target_fps, block_size), None),
+                                               height=height, width=width, fit_canvas=fit_canvas, fit_crop=fit_crop, target_fps=target_fps, block_size=block_size, process_type="resize")
+    if frames_list is None:
+        return None
+    return torch.stack(frames_list) 
 
+def get_resized_video_frames(height, width, video_in, max_frames, start_frame, fit_canvas, fit_crop, target_fps, block_size):
     frames_list = get_resampled_video(video_in, start_frame, max_frames, target_fps)
 
     if len(frames_list) == 0:
@@ -5032,7 +5125,7 @@ def preprocess_video(height, width, video_in, max_frames, start_frame=0, fit_can
     # from preprocessing.dwpose.pose import save_one_video
     # save_one_video("test.mp4", frames_list, fps=8, quality=8, macro_block_size=None)
 
-    return torch.stack(frames_list) 
+    return frames_list
 
  
 def parse_keep_frames_video_guide(keep_frames, video_length):
@@ -5670,6 +5763,24 @@ def _video_tensor_to_uint8_chunk_inplace(sample, value_range=(-1, 1)):
     sample = sample.sub_(min_val).mul_(255.0 / (max_val - min_val)).to(torch.uint8)
     return sample
 
+def get_batched_repeats(profile, batch_size, width, height, repeat_generation):
+    """Number of repeats of an image generation that fit in one batched denoising pass.
+
+    The VRAM left to activations depends on the offload profile: profiles 1 and 3 may keep the
+    whole model in VRAM and budget more megapixels per call than the low VRAM ones, scaled by
+    the VRAM of the device (24 GB reference). server_config batch_repeats_max_megapixels
+    overrides the budget.
+    """
+    if repeat_generation <= 1 or server_config.get("batch_repeats", 1) != 1 or not torch.cuda.is_available():
+        return 1
+    budget_megapixels = server_config.get("batch_repeats_max_megapixels", 0)
+    if budget_megapixels <= 0:
+        total_vram_gb = torch.cuda.get_device_properties(processing_device).total_memory / 1024**3
+        budget_megapixels = (4 if profile in (1, 3) else 1.5) * total_vram_gb / 24
+    megapixels_per_call = batch_size * width * height / 1e6
+    return max(1, min(repeat_generation, int(budget_megapixels // megapixels_per_call)))
+
+@run_exit_callbacks
 def generate_video(
     task,
     send_cmd,
@@ -5782,6 +5893,8 @@ def generate_video(
 
 
     def remove_temp_filenames(temp_filenames_list):
+        # open readers would keep the files locked on Windows
+        video_readers.close()
         for temp_filename in temp_filenames_list: 
             if temp_filename!= None and os.path.isfile(temp_filename):
                 os.remove(temp_filename)
@@ -5871,7 +5984,11 @@ def generate_video(
     # if overridden_attention is not None and overridden_attention !=  attention_mode: print(f"Attention mode has been overriden to {overridden_attention} for model type '{model_type}'")
     attn = overridden_attention if overridden_attention is not None else attention_mode
     if attn == "auto":
-        attn = get_auto_attention()
+        if server_config.get("attention_autotune", 1) == 1:
+            # backend chosen per attention shape by pay_attention, benchmarked once per machine
+            attention_tuner.configure(os.path.join(config_dir if config_dir else wgp_root, "attention_autotune.json"), attention_modes_supported)
+        else:
+            attn = get_auto_attention()
     elif not attn in attention_modes_supported:
         send_cmd("info", f"You have selected attention mode '{attention_mode}'. However it is not installed or supported on your system. You should either install it or switch to the default 'sdpa' attention.")
         send_cmd("exit")
@@ -6072,6 +6189,18 @@ def generate_video(
             if def_tea_coefficients is not None: skip_steps_cache.coefficients = def_tea_coefficients
         else:
             raise Exception(f"unknown cache type {skip_steps_cache_type}")
+        # Calibrated profile measured on a previous run of the same model / solver / steps / resolution bucket
+        skip_steps_profile_key = profile_key(model_type, skip_steps_cache_type, sample_solver, num_inference_steps, *resolution.split("x"))
+        skip_steps_profile = step_cache_profiles.load(skip_steps_profile_key)
+        skip_steps_cache.calibration = None
+        if skip_steps_profile is not None:
+            if skip_steps_cache_type == "mag" and "mag_ratios" in skip_steps_profile:
+                skip_steps_cache.def_mag_ratios = skip_steps_profile["mag_ratios"]
+            elif skip_steps_cache_type == "tea" and "coefficients" in skip_steps_profile:
+                skip_steps_cache.coefficients = skip_steps_profile["coefficients"]
+            print(f"Using calibrated steps skipping profile '{skip_steps_profile_key}'")
+        elif server_config.get("skip_steps_calibration", 0) == 1:
+            skip_steps_cache.calibration = StepCacheCalibration(skip_steps_cache_type, num_inference_steps)
     trans.cache = skip_steps_cache
     if trans2 is not None: trans2.cache = skip_steps_cache
     face_arc_embeds = None
@@ -6134,7 +6263,10 @@ def generate_video(
             from models.wan.multitalk.multitalk import get_full_audio_embeddings
             # pad audio_proj_full if aligned to beginning of window to simulate source window overlap
             min_audio_duration =  current_video_length/fps if reset_control_aligment else video_source_duration + current_video_length/fps
-            audio_proj_full, output_new_audio_data = get_full_audio_embeddings(audio_guide1 = audio_guide, audio_guide2= audio_guide2, combination_type= combination_type , num_frames= max_source_video_frames, sr= audio_sampling_rate, fps =fps, padded_frames_for_embeddings = (reuse_frames if reset_control_aligment else 0), min_audio_duration = min_audio_duration) 
+            audio_embeddings_cache_mb = server_config.get("audio_embeddings_cache_mb", 2048)
+            audio_proj_full, output_new_audio_data = get_full_audio_embeddings(audio_guide1 = audio_guide, audio_guide2= audio_guide2, combination_type= combination_type , num_frames= max_source_video_frames, sr= audio_sampling_rate, fps =fps, padded_frames_for_embeddings = (reuse_frames if reset_control_aligment else 0), min_audio_duration = min_audio_duration,
+                                                                                device = processing_device if server_config.get("audio_encoder_on_gpu", 0) == 1 else "cpu", cache_dir = os.path.join(config_dir if config_dir else wgp_root, "audio_embeddings") if audio_embeddings_cache_mb > 0 else None, cache_max_size_mb = audio_embeddings_cache_mb, streamed = True,
+                                                                                chunk_frames = server_config.get("audio_encoder_chunk_frames", 0)) 
             if output_new_audio_data is not None: # not none if modified
                 if clean_audio_files: # need to rebuild the sum of audios with original audio
                     _, output_new_audio_data = get_full_audio_embeddings(audio_guide1 = original_audio_guide, audio_guide2= original_audio_guide2, combination_type= combination_type , num_frames= max_source_video_frames, sr= audio_sampling_rate, fps =fps, padded_frames_for_embeddings = (reuse_frames if reset_control_aligment else 0), min_audio_duration = min_audio_duration, return_sum_only= True) 
@@ -6174,8 +6306,201 @@ def generate_video(
         initial_total_windows = 1
 
     first_window_video_length = current_video_length
+    def mux_window_audio(video_path, video_segments, any_mmaudio, output_frame_count, output_audio_sampling_rate, output_new_audio_filepath, output_new_audio_data, full_generated_audio, source_video_frames_count, seed, time_flag):
+        container = server_config.get("video_container", "mp4")
+        save_path_tmp = video_path.rsplit('.', 1)[0] + f"_tmp.{container}"
+        video_segments.write(save_path_tmp)
+        output_new_audio_temp_filepath = None
+        new_audio_added_from_audio_start =  reset_control_aligment or full_generated_audio is not None # if not beginning of audio will be skipped
+        source_audio_duration = source_video_frames_count / fps
+        if any_mmaudio:
+            send_cmd("progress", [0, get_latest_status(state,"MMAudio Soundtrack Generation")])
+            from postprocessing.mmaudio.mmaudio import video_to_audio
+            output_new_audio_filepath = output_new_audio_temp_filepath = get_available_filename(save_path, f"tmp{time_flag}.wav" )
+            video_to_audio(save_path_tmp, prompt = MMAudio_prompt, negative_prompt = MMAudio_neg_prompt, seed = seed, num_steps = 25, cfg_strength = 4.5, duration= output_frame_count / fps, save_path = output_new_audio_filepath, persistent_models = mmaudio_persistence == MMAUDIO_PERSIST_RAM, audio_file_only = True, verboseLevel = verbose_level, model_name = mmaudio_model_name, model_path = mmaudio_model_path)
+            new_audio_added_from_audio_start =  False
+        elif audio_source is not None:
+            output_new_audio_filepath = audio_source
+            new_audio_added_from_audio_start =  True
+        elif output_new_audio_data is not None:
+            output_new_audio_filepath = output_new_audio_temp_filepath = get_available_filename(save_path, f"tmp{time_flag}.wav" )
+            write_wav_file(output_new_audio_filepath, output_new_audio_data, output_audio_sampling_rate)
+        if output_new_audio_filepath is not None:
+            new_audio_tracks = [output_new_audio_filepath]
+        else:
+            new_audio_tracks = control_audio_tracks
+
+        combine_and_concatenate_video_with_audio_tracks(
+            video_path,
+            save_path_tmp,
+            source_audio_tracks,
+            new_audio_tracks,
+            source_audio_duration,
+            output_audio_sampling_rate,
+            new_audio_from_start=new_audio_added_from_audio_start,
+            source_audio_metadata=source_audio_metadata,
+            verbose=verbose_level >= 2,
+        )
+        os.remove(save_path_tmp)
+        if output_new_audio_temp_filepath is not None: os.remove(output_new_audio_temp_filepath)
+
+    # last window saved as a silent preview while more windows were expected: (video_path, configs, embedded_images, audio_mux_args)
+    pending_audio_mux = {}
+    def finish_window_audio(video_segments):
+        """Muxes the audio tracks into the last window if it was saved as a preview (the generation stopped sooner than expected)."""
+        pending = pending_audio_mux.pop("window", None)
+        if pending is None:
+            return
+        video_path, configs, embedded_images, audio_mux_args = pending
+        mux_window_audio(video_path, video_segments, *audio_mux_args)
+        if server_config.get("metadata_type","metadata") == "metadata":
+            save_video_metadata(video_path, configs, embedded_images)
+
+    def save_window_output(sample, output_video_frames, output_frame_count, output_fps, any_mmaudio, inputs, seed, start_time, window_no, sliding_window, prompts, output_audio_sampling_rate,
+                           output_new_audio_filepath, output_new_audio_data, full_generated_audio, source_video_frames_count, BGRA_frames, video_segments, batch_repeats = 1, final_window = True):
+        # Everything a later window changes is passed explicitly, as this may run while the next window is generated
+        pending_audio_mux.pop("window", None)
+        deferred_audio_mux = None
+        time_flag = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss")
+        save_prompt = original_prompts[0]
+        if audio_only:
+            audio_codec = server_config.get("audio_stand_alone_output_codec", "wav")
+            extension = get_audio_codec_extension(audio_codec)
+            output_dir = audio_save_path
+        elif is_image:
+            extension = "jpg"
+            output_dir = image_save_path
+        else:
+            container = server_config.get("video_container", "mp4")
+            extension = container
+            output_dir = save_path
+        if len(output_filename):
+            from shared.utils.filename_formatter import FilenameFormatter
+            file_name = FilenameFormatter.format_filename(output_filename, inputs)                    
+            file_name = f"{sanitize_file_name(truncate_for_filesystem(os.path.splitext(os.path.basename(file_name))[0])).strip()}.{extension}"
+            file_name = os.path.basename(get_available_filename(output_dir, file_name))
+        else:
+            file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(truncate_for_filesystem(save_prompt)).strip()}.{extension}"
+        video_path = os.path.join(output_dir, file_name)
+
+        if BGRA_frames is not None:
+            from models.wan.alpha.utils import write_zip_file
+            write_zip_file(os.path.splitext(video_path)[0] + ".zip", BGRA_frames)
+        if audio_only:
+            audio_path = os.path.join(output_dir, file_name)
+            audio_path = save_audio_file(audio_path, sample.squeeze(0), output_audio_sampling_rate, audio_codec)
+            video_path = audio_path
+        elif is_image:
+            image_path = os.path.join(output_dir, file_name)
+            sample =  sample.transpose(1,0)  #c f h w -> f c h w 
+            new_image_path = []
+            for no, img in enumerate(sample):  
+                img_path = os.path.splitext(image_path)[0] + ("" if no==0 else f"_{no}") + ".jpg" 
+                new_image_path.append(save_image(img, save_file = img_path, quality = server_config.get("image_output_codec", None)))
+
+            video_path= new_image_path
+        elif len(control_audio_tracks) > 0 or len(source_audio_tracks) > 0 or output_new_audio_filepath is not None or any_mmaudio or output_new_audio_data is not None or audio_source is not None:
+            video_path = os.path.join(save_path, file_name)
+            video_segments.append(output_video_frames, output_fps)
+            audio_mux_args = (any_mmaudio, output_frame_count, output_audio_sampling_rate, output_new_audio_filepath, output_new_audio_data, full_generated_audio, source_video_frames_count, seed, time_flag)
+            if final_window:
+                mux_window_audio(video_path, video_segments, *audio_mux_args)
+            else:
+                # Intermediate windows are silent previews: the audio tracks are only muxed into the last window
+                video_segments.write(video_path)
+                deferred_audio_mux = audio_mux_args
+
+        else:
+            video_segments.append(output_video_frames, output_fps)
+            video_segments.write(video_path)
+
+        end_time = time.time()
+
+        inputs.pop("send_cmd")
+        inputs.pop("task")
+        inputs.pop("mode")
+        inputs["model_type"] = model_type
+        inputs["model_filename"] = get_model_filename(model_type, transformer_quantization, transformer_dtype_policy)
+        if is_image:
+            inputs["image_quality"] = server_config.get("image_output_codec", None)
+        else:
+            inputs["video_quality"] = server_config.get("video_output_codec", None)
+
+        modules = get_model_recursive_prop(model_type, "modules", return_list= True)
+        if len(modules) > 0 : inputs["modules"] = modules
+        if len(transformer_loras_filenames) > 0:
+            inputs.update({
+            "transformer_loras_filenames" : transformer_loras_filenames,
+            "transformer_loras_multipliers" : transformer_loras_multipliers
+            })
+        embedded_images = {img_name: inputs[img_name] for img_name in image_names_list } if server_config.get("embed_source_images", False) else None
+        configs = prepare_inputs_dict("metadata", inputs, model_type)
+        if sliding_window: configs["window_no"] = window_no
+        configs["prompt"] = "\n".join(original_prompts)
+        if prompt_enhancer_image_caption_model != None and prompt_enhancer !=None and len(prompt_enhancer)>0 and enhancer_mode != 1:
+            configs["enhanced_prompt"] = "\n".join(prompts)
+        configs["generation_time"] = round(end_time-start_time)
+        configs["creation_date"] = datetime.fromtimestamp(end_time).isoformat(timespec="seconds")
+        configs["creation_timestamp"] = int(end_time)
+        # if sample_is_image: configs["is_image"] = True
+        metadata_choice = server_config.get("metadata_type","metadata")
+        video_path = [video_path] if not isinstance(video_path, list) else video_path
+        for no, path in enumerate(video_path):
+            if batch_repeats > 1:
+                # Batched repeats share the seed: image no is reproduced by rerunning the whole denoising batch with this seed
+                configs = dict(configs, denoising_batch_size = batch_size * batch_repeats, batch_index = no)
+            if metadata_choice == "json":
+                json_path = os.path.splitext(path)[0] + ".json"
+                with open(json_path, 'w') as f:
+                    json.dump(configs, f, indent=4)
+            elif metadata_choice == "metadata":
+                if audio_only:
+                    save_audio_metadata(path, configs)
+                if is_image:
+                    save_image_metadata(path, configs)
+                else:
+                    save_video_metadata(path, configs, embedded_images)
+            if audio_only:
+                print(f"New audio file saved to Path: "+ path)
+            elif is_image:
+                print(f"New image saved to Path: "+ path)
+            else:
+                print(f"New video saved to Path: "+ path)
+            with lock:
+                if audio_only:
+                    audio_file_list.append(path)
+                    audio_file_settings_list.append(configs if no > 0 else configs.copy())
+                else:
+                    file_list.append(path)
+                    file_settings_list.append(configs if no > 0 else configs.copy())
+                gen["last_was_audio"] = audio_only
+
+        if deferred_audio_mux is not None:
+            pending_audio_mux["window"] = (video_path[0], configs, embedded_images, deferred_audio_mux)
+        embedded_images = None
+        # Play notification sound for single video
+        try:
+            if server_config.get("notification_sound_enabled", 0):
+                volume = server_config.get("notification_sound_volume", 50)
+                notification_sound.notify_video_completion(
+                    video_path=video_path, 
+                    volume=volume
+                )
+        except Exception as e:
+            print(f"Error playing notification sound for individual video: {e}")
+
+        send_cmd("output")
+
     original_prompts = prompts.copy()
     gen["sliding_window"] = sliding_window 
+    window_outputs = WindowOutputPipeline(enabled= server_config.get("save_window_outputs_in_background", 1) == 1)
+    # Several repeats of an image generation share one batched denoising pass (and its seed): their metadata records their place in the batch
+    repeats_per_call = get_batched_repeats(profile, batch_size, width, height, repeat_generation) if is_image and not model_def.get("no_batched_repeats", False) and model_def.get("batch_size_label", None) is None else 1
+    residency = WindowResidency(offloadobj, enabled= server_config.get("keep_models_between_windows", 1) == 1, min_free_vram_perc= server_config.get("keep_models_min_free_vram_perc", 20), device= args.gpu if len(args.gpu) > 0 else None)
+    # also when the generation fails or is aborted: the pending window save completes before the models are released and the readers closed
+    on_exit(video_readers.close)
+    on_exit(residency.release_if_resident)
+    on_exit(window_outputs.finish)
     while not abort: 
         extra_generation += gen.get("extra_orders",0)
         gen["extra_orders"] = 0
@@ -6185,11 +6510,14 @@ def generate_video(
         if repeat_no >= total_generation: break
         repeat_no +=1
         gen["repeat_no"] = repeat_no
+        batch_repeats = min(repeats_per_call, total_generation - repeat_no + 1)
+        if batch_repeats > 1: print(f"Generating samples {repeat_no} to {repeat_no + batch_repeats - 1} in a single batch of {batch_size * batch_repeats}")
         src_video = src_video2 = src_mask = src_mask2 = src_faces = sparse_video_image = full_generated_audio =None
         prefix_video = pre_video_frame = None
         source_video_overlap_frames_count = 0 # number of frames overalapped in source video for first window
         source_video_frames_count = 0  # number of frames to use in source video (processing starts source_video_overlap_frames_count frames before )
-        frames_already_processed = []
+        # Each window only encodes its new frames, previous ones are neither kept in RAM nor re-encoded
+        video_segments = VideoSegmentWriter(codec_type= server_config.get("video_output_codec", None), container= server_config.get("video_container", "mp4"))
         frames_already_processed_count = 0
         overlapped_latents = None
         context_scale = None
@@ -6242,6 +6570,7 @@ def generate_video(
                 break
             window_no += 1
             gen["window_no"] = window_no
+            residency.start_window()
             return_latent_slice = None 
             if reuse_frames > 0:                
                 return_latent_slice = slice(- max(1, (reuse_frames + discard_last_frames ) // latent_size) , None if discard_last_frames == 0 else -(discard_last_frames // latent_size) )
@@ -6334,7 +6663,7 @@ def generate_video(
                 guide_frames_extract_start = aligned_window_start_frame if extract_guide_from_window_start else aligned_guide_start_frame
                 extra_control_frames = model_def.get("extra_control_frames", 0)
                 if extra_control_frames > 0 and aligned_guide_start_frame >= extra_control_frames: guide_frames_extract_start -= extra_control_frames
-                        
+                    
                 keep_frames_parsed = [True] * -guide_frames_extract_start if guide_frames_extract_start  <0 else []
                 keep_frames_parsed += keep_frames_parsed_full[max(0, guide_frames_extract_start): aligned_guide_end_frame ] 
                 guide_frames_extract_count = len(keep_frames_parsed)
@@ -6399,7 +6728,7 @@ def generate_video(
                     video_mask_processed =  None if cached_video_mask_processed is None else cached_video_mask_processed[:, process_slice] 
                     video_guide_processed2 =  None if cached_video_guide_processed2 is None else cached_video_guide_processed2[:, process_slice] 
                     video_mask_processed2 = None if cached_video_mask_processed2 is None else cached_video_mask_processed2[:, process_slice] 
-                    
+                
             if window_no == 1 and image_refs is not None and len(image_refs) > 0:
                 if sample_fit_canvas is not None and (nb_frames_positions > 0 or "K" in video_prompt_type) :
                     from shared.utils.utils import get_outpainting_full_area_dimensions
@@ -6522,7 +6851,7 @@ def generate_video(
             gen["progress_status"] = status
             progress_phase = "Generating Audio" if audio_only else "Encoding Prompt"
             gen["progress_phase"] = (progress_phase , -1 )
-            callback = build_callback(state, trans, send_cmd, status, num_inference_steps)
+            callback = residency.track_steps(build_callback(state, trans, send_cmd, status, num_inference_steps, model_type = model_type))
             progress_args = [0, merge_status_context(status, progress_phase )]
             send_cmd("progress", progress_args)
 
@@ -6565,7 +6894,7 @@ def generate_video(
                     masking_strength=masking_strength,
                     prefix_frames_count = prefix_frames_count,
                     frame_num= (current_video_length // latent_size)* latent_size + 1,
-                    batch_size = batch_size,
+                    batch_size = batch_size * batch_repeats,
                     height = image_size[0],
                     width = image_size[1],
                     fit_into_canvas = fit_canvas,
@@ -6649,11 +6978,16 @@ def generate_video(
                     set_progress_status=set_progress_status,                     
                 )
             except Exception as e:
+                # the previous window may still be saved in background from the temporary files
+                try:
+                    window_outputs.finish()
+                except Exception as save_error:
+                    print(f"Error saving the previous window: {save_error}")
                 if len(control_audio_tracks) > 0 or len(source_audio_tracks) > 0:
                     cleanup_temp_audio_files(control_audio_tracks + source_audio_tracks)
                 remove_temp_filenames(temp_filenames_list)
                 clear_gen_cache()
-                offloadobj.unload_all()
+                residency.release()
                 trans.cache = None 
                 if trans2 is not None: 
                     trans2.cache = None 
@@ -6692,6 +7026,10 @@ def generate_video(
                 skip_steps_cache.previous_residual = None
                 skip_steps_cache.previous_modulated_input = None
                 print(f"Skipped Steps:{skip_steps_cache.skipped_steps}/{skip_steps_cache.num_steps}" )
+                if skip_steps_cache.calibration is not None:
+                    skip_steps_profile = skip_steps_cache.calibration.build_profile()
+                    if skip_steps_profile is not None:
+                        print(f"Steps skipping profile saved to {step_cache_profiles.save(skip_steps_profile_key, skip_steps_profile)}")
             generated_audio = None
             BGRA_frames = None
             post_decode_pre_trim = 0
@@ -6717,9 +7055,10 @@ def generate_video(
                     samples = samples.to("cpu")
   
             clear_gen_cache()
-            offloadobj.unload_all()
-            gc.collect()
-            torch.cuda.empty_cache()
+            # Keep the models loaded for the next window / repeat of this task when nothing else needs the VRAM in between
+            more_windows = samples is not None and not abort_scheduled and not gen.get("abort", False) and (window_no < gen.get("total_windows", 1) or repeat_no < gen.get("total_generation", 1))
+            needs_vram = len(temporal_upsampling) > 0 or len(spatial_upsampling) > 0 or MMAudio_setting != 0
+            residency.end_window(window_no, more_windows, needs_vram)
 
             if samples == None:
                 abort = True
@@ -6784,7 +7123,7 @@ def generate_video(
 
                 if len(temporal_upsampling) > 0 or len(spatial_upsampling) > 0 and not "vae2" in spatial_upsampling:                
                     send_cmd("progress", [0, get_latest_status(state,"Upsampling")])
-                
+            
                 output_fps  = fps
                 if len(temporal_upsampling) > 0:
                     sample, previous_last_frame, output_fps = perform_temporal_upsampling(sample, previous_last_frame if sliding_window and window_no > 1 else None, temporal_upsampling, fps)
@@ -6800,168 +7139,35 @@ def generate_video(
                     output_frame_count = None
                     any_mmaudio = False
                 else:
-                    frames_already_processed.append(sample)
                     frames_already_processed_count += sample.shape[1]
-                    output_video_frames = frames_already_processed
+                    output_video_frames = sample
                     output_frame_count = frames_already_processed_count
                     sample = None
                     any_mmaudio = MMAudio_setting != 0 and mmaudio_enabled and output_frame_count >= fps
-                time_flag = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss")
-                save_prompt = original_prompts[0]
-                if audio_only:
-                    audio_codec = server_config.get("audio_stand_alone_output_codec", "wav")
-                    extension = get_audio_codec_extension(audio_codec)
-                    output_dir = audio_save_path
-                elif is_image:
-                    extension = "jpg"
-                    output_dir = image_save_path
-                else:
-                    container = server_config.get("video_container", "mp4")
-                    extension = container
-                    output_dir = save_path
+                # Audio tracks are muxed once, into the last window (finish_window_audio covers a generation that stops sooner)
+                final_window = abort or not sliding_window or gen.get("extra_windows", 0) == 0 and (window_no >= initial_total_windows + extra_windows or requested_frames_to_generate - num_frames_generated < latent_size)
                 inputs = get_function_arguments(generate_video, locals())
                 if overridden_inputs is not None: inputs.update(overridden_inputs)
-                if len(output_filename):
-                    from shared.utils.filename_formatter import FilenameFormatter
-                    file_name = FilenameFormatter.format_filename(output_filename, inputs)                    
-                    file_name = f"{sanitize_file_name(truncate_for_filesystem(os.path.splitext(os.path.basename(file_name))[0])).strip()}.{extension}"
-                    file_name = os.path.basename(get_available_filename(output_dir, file_name))
-                else:
-                    file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(truncate_for_filesystem(save_prompt)).strip()}.{extension}"
-                video_path = os.path.join(output_dir, file_name)
-
-                if BGRA_frames is not None:
-                    from models.wan.alpha.utils import write_zip_file
-                    write_zip_file(os.path.splitext(video_path)[0] + ".zip", BGRA_frames)
-                    BGRA_frames = None 
-                if audio_only:
-                    audio_path = os.path.join(output_dir, file_name)
-                    audio_path = save_audio_file(audio_path, sample.squeeze(0), output_audio_sampling_rate, audio_codec)
-                    video_path = audio_path
-                elif is_image:
-                    image_path = os.path.join(output_dir, file_name)
-                    sample =  sample.transpose(1,0)  #c f h w -> f c h w 
-                    new_image_path = []
-                    for no, img in enumerate(sample):  
-                        img_path = os.path.splitext(image_path)[0] + ("" if no==0 else f"_{no}") + ".jpg" 
-                        new_image_path.append(save_image(img, save_file = img_path, quality = server_config.get("image_output_codec", None)))
-
-                    video_path= new_image_path
-                elif len(control_audio_tracks) > 0 or len(source_audio_tracks) > 0 or output_new_audio_filepath is not None or any_mmaudio or output_new_audio_data is not None or audio_source is not None:
-                    video_path = os.path.join(save_path, file_name)
-                    save_path_tmp = video_path.rsplit('.', 1)[0] + f"_tmp.{container}"
-                    save_video( tensor=output_video_frames, save_file=save_path_tmp, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1), codec_type = server_config.get("video_output_codec", None), container=container)
-                    output_new_audio_temp_filepath = None
-                    new_audio_added_from_audio_start =  reset_control_aligment or full_generated_audio is not None # if not beginning of audio will be skipped
-                    source_audio_duration = source_video_frames_count / fps
-                    if any_mmaudio:
-                        send_cmd("progress", [0, get_latest_status(state,"MMAudio Soundtrack Generation")])
-                        from postprocessing.mmaudio.mmaudio import video_to_audio
-                        output_new_audio_filepath = output_new_audio_temp_filepath = get_available_filename(save_path, f"tmp{time_flag}.wav" )
-                        video_to_audio(save_path_tmp, prompt = MMAudio_prompt, negative_prompt = MMAudio_neg_prompt, seed = seed, num_steps = 25, cfg_strength = 4.5, duration= output_frame_count / fps, save_path = output_new_audio_filepath, persistent_models = mmaudio_persistence == MMAUDIO_PERSIST_RAM, audio_file_only = True, verboseLevel = verbose_level, model_name = mmaudio_model_name, model_path = mmaudio_model_path)
-                        new_audio_added_from_audio_start =  False
-                    elif audio_source is not None:
-                        output_new_audio_filepath = audio_source
-                        new_audio_added_from_audio_start =  True
-                    elif output_new_audio_data is not None:
-                        output_new_audio_filepath = output_new_audio_temp_filepath = get_available_filename(save_path, f"tmp{time_flag}.wav" )
-                        write_wav_file(output_new_audio_filepath, output_new_audio_data, output_audio_sampling_rate)
-                    if output_new_audio_filepath is not None:
-                        new_audio_tracks = [output_new_audio_filepath]
-                    else:
-                        new_audio_tracks = control_audio_tracks
-                    if generated_audio is not None: output_new_audio_filepath = None
-                     
-                    combine_and_concatenate_video_with_audio_tracks(
-                        video_path,
-                        save_path_tmp,
-                        source_audio_tracks,
-                        new_audio_tracks,
-                        source_audio_duration,
-                        output_audio_sampling_rate,
-                        new_audio_from_start=new_audio_added_from_audio_start,
-                        source_audio_metadata=source_audio_metadata,
-                        verbose=verbose_level >= 2,
-                    )
-                    os.remove(save_path_tmp)
-                    if output_new_audio_temp_filepath is not None: os.remove(output_new_audio_temp_filepath)
-
-                else:
-                    save_video( tensor=output_video_frames, save_file=video_path, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1),  codec_type= server_config.get("video_output_codec", None), container= container)
-
-                end_time = time.time()
-
-                inputs.pop("send_cmd")
-                inputs.pop("task")
-                inputs.pop("mode")
-                inputs["model_type"] = model_type
-                inputs["model_filename"] = get_model_filename(model_type, transformer_quantization, transformer_dtype_policy)
-                if is_image:
-                    inputs["image_quality"] = server_config.get("image_output_codec", None)
-                else:
-                    inputs["video_quality"] = server_config.get("video_output_codec", None)
-
-                modules = get_model_recursive_prop(model_type, "modules", return_list= True)
-                if len(modules) > 0 : inputs["modules"] = modules
-                if len(transformer_loras_filenames) > 0:
-                    inputs.update({
-                    "transformer_loras_filenames" : transformer_loras_filenames,
-                    "transformer_loras_multipliers" : transformer_loras_multipliers
-                    })
-                embedded_images = {img_name: inputs[img_name] for img_name in image_names_list } if server_config.get("embed_source_images", False) else None
-                configs = prepare_inputs_dict("metadata", inputs, model_type)
-                if sliding_window: configs["window_no"] = window_no
-                configs["prompt"] = "\n".join(original_prompts)
-                if prompt_enhancer_image_caption_model != None and prompt_enhancer !=None and len(prompt_enhancer)>0 and enhancer_mode != 1:
-                    configs["enhanced_prompt"] = "\n".join(prompts)
-                configs["generation_time"] = round(end_time-start_time)
-                configs["creation_date"] = datetime.fromtimestamp(end_time).isoformat(timespec="seconds")
-                configs["creation_timestamp"] = int(end_time)
-                # if sample_is_image: configs["is_image"] = True
-                metadata_choice = server_config.get("metadata_type","metadata")
-                video_path = [video_path] if not isinstance(video_path, list) else video_path
-                for no, path in enumerate(video_path):
-                    if metadata_choice == "json":
-                        json_path = os.path.splitext(path)[0] + ".json"
-                        with open(json_path, 'w') as f:
-                            json.dump(configs, f, indent=4)
-                    elif metadata_choice == "metadata":
-                        if audio_only:
-                            save_audio_metadata(path, configs)
-                        if is_image:
-                            save_image_metadata(path, configs)
-                        else:
-                            save_video_metadata(path, configs, embedded_images)
-                    if audio_only:
-                        print(f"New audio file saved to Path: "+ path)
-                    elif is_image:
-                        print(f"New image saved to Path: "+ path)
-                    else:
-                        print(f"New video saved to Path: "+ path)
-                    with lock:
-                        if audio_only:
-                            audio_file_list.append(path)
-                            audio_file_settings_list.append(configs if no > 0 else configs.copy())
-                        else:
-                            file_list.append(path)
-                            file_settings_list.append(configs if no > 0 else configs.copy())
-                        gen["last_was_audio"] = audio_only
-
-                embedded_images = None
-                # Play notification sound for single video
-                try:
-                    if server_config.get("notification_sound_enabled", 0):
-                        volume = server_config.get("notification_sound_volume", 50)
-                        notification_sound.notify_video_completion(
-                            video_path=video_path, 
-                            volume=volume
-                        )
-                except Exception as e:
-                    print(f"Error playing notification sound for individual video: {e}")
-
-                send_cmd("output")
-
+                # Encoding / muxing only needs the CPU: overlap it with the next window unless MMAudio needs the GPU
+                window_outputs.submit(save_window_output, sample, output_video_frames, output_frame_count, output_fps, any_mmaudio, inputs, seed, start_time, window_no, sliding_window, prompts, output_audio_sampling_rate,
+                                      output_new_audio_filepath, output_new_audio_data, full_generated_audio, source_video_frames_count, BGRA_frames, video_segments, batch_repeats, final_window, background = more_windows and not (any_mmaudio and final_window))
+                BGRA_frames = None
+                if generated_audio is not None: output_new_audio_filepath = None
+
+        window_outputs.submit(finish_window_audio, video_segments, background = False)
+        window_outputs.submit(video_segments.close)
+        repeat_no += batch_repeats - 1
+        gen["repeat_no"] = repeat_no
         seed = set_seed(-1)
+    # the pending window save must be done before the temporary files are removed
+    window_outputs.finish()
+    if residency.models_resident:
+        residency.release()
+    # don't keep handles on the sources and outputs between generations (they block renames and deletions on Windows)
+    video_readers.close()
+    window_summary = residency.summary()
+    if window_summary is not None:
+        print(f"Sliding windows: {window_summary}")
     clear_status(state)
     trans.cache = None
     offload.unload_loras_from_model(trans_lora)
@@ -6985,10 +7191,29 @@ def prepare_generate_video(state):
         return gr.Button(visible= False), gr.Button(visible= True), gr.Column(visible= True), gr.update(visible= False)
 
 
+def render_device_preview(preview_renderer, model_type, payload):
+    # Preview computed where the latents are, only a small uint8 image is moved to the CPU. Models without latent to RGB factors get their latents instead (custom previews)
+    if model_type is None or payload is None:
+        return None
+    latents = payload.get("latents") if isinstance(payload, dict) else payload
+    if not torch.is_tensor(latents) or latents.dim() != 4:
+        return None
+    model_handler = get_model_handler(model_type)
+    if not hasattr(model_handler, "get_rgb_factors"):
+        return None
+    base_model_type = get_base_model_type(model_type)
+    images = preview_renderer.render(base_model_type, lambda: model_handler.get_rgb_factors(base_model_type), latents)
+    return None if images is None else {"preview_rgb": images}
+
 def generate_preview(model_type, payload):
     import einops
     if payload is None:
         return None
+    if isinstance(payload, dict) and "preview_rgb" in payload:
+        images = Image.fromarray(payload["preview_rgb"].numpy())
+        w, h = images.size
+        scale = 200 / h
+        return images.resize(( int(w*scale),int(h*scale)), resample=Image.Resampling.BILINEAR) 
     if isinstance(payload, dict):
         meta = {k: v for k, v in payload.items() if k != "latents"}
         latents = payload.get("latents")
@@ -7273,8 +7498,14 @@ def validate_task(task, state):
     return inputs
 
 
-def process_tasks_cli(queue, state):
-    """Process queue tasks with console output for CLI mode. Returns True on success."""
+def process_tasks_cli(queue, state, json_events=False, job_id=None):
+    """Process queue tasks with console output for CLI mode. Returns True on success.
+
+    With json_events, the typed commands received from generate_video are also forwarded as
+    worker_reply() JSON lines (task_start, status, progress, output, info, task_error, task_end)
+    carrying step/total, window_no/total_windows, phase and timings, so a driving process does
+    not have to scrape the console output.
+    """
     from shared.utils.thread_utils import AsyncStream, async_run
     import inspect
 
@@ -7284,6 +7515,10 @@ def process_tasks_cli(queue, state):
     skipped = 0
     start_time = time.time()
 
+    def emit(event, **payload):
+        if json_events:
+            worker_reply(event, job_id=job_id, task_no=gen.get("prompt_no", 0), total_tasks=total_tasks, **payload)
+
     for task_idx, task in enumerate(queue):
         task_no = task_idx + 1
         prompt_preview = (task.get('prompt', '') or '')[:60]
@@ -7299,6 +7534,8 @@ def process_tasks_cli(queue, state):
         # Update gen state for this task
         gen["prompt_no"] = task_no
         gen["prompts_max"] = total_tasks
+        task_start_time = time.time()
+        emit("task_start", model_type=validated_params.get("model_type"))
 
         params = validated_params.copy()
         params['state'] = state
@@ -7328,6 +7565,8 @@ def process_tasks_cli(queue, state):
         task_error = False
         last_msg_len = 0
         in_status_line = False  # Track if we're in an overwritable line
+        phase_start_time, last_step, last_total = time.time(), 0, 0
+        files_count = len(gen.get("file_list", [])) + len(gen.get("audio_file_list", []))
         while True:
             cmd, data = com_stream.output_queue.next()
             if cmd == "exit":
@@ -7338,6 +7577,7 @@ def process_tasks_cli(queue, state):
                 print(f"\n  [ERROR] {data}")
                 in_status_line = False
                 task_error = True
+                emit("task_error", error=str(data))
             elif cmd == "progress":
                 if isinstance(data, list) and len(data) >= 2:
                     if isinstance(data[0], tuple):
@@ -7351,6 +7591,23 @@ def process_tasks_cli(queue, state):
                     print(status_line.ljust(max(last_msg_len, len(status_line))), end="", flush=True)
                     last_msg_len = len(status_line)
                     in_status_line = True
+                    if json_events:
+                        now = time.time()
+                        # A new denoising run (next window, pass or sample) restarts the step clock
+                        if step < last_step or total != last_total:
+                            phase_start_time = now
+                        last_step, last_total = step, total
+                        step_time = (now - phase_start_time) / step if step > 0 else None
+                        window_no, total_windows = gen.get("window_no", 1), gen.get("total_windows", 1)
+                        eta = None
+                        if step_time is not None and total > 1:
+                            eta = step_time * ((total - step) + max(total_windows - window_no, 0) * total)
+                        phase = gen.get("progress_phase", ("", -1))[0]
+                        emit("progress", step=step, total_steps=total, window_no=window_no, total_windows=total_windows,
+                             repeat_no=gen.get("repeat_no", 0), total_generation=gen.get("total_generation", 1),
+                             phase=phase, message=str(msg), elapsed=round(now - task_start_time, 2),
+                             step_time=round(step_time, 3) if step_time is not None else None,
+                             eta=round(eta, 1) if eta is not None else None)
             elif cmd == "status":
                 # "Loading..." messages are followed by external library output, so end with newline
                 if "Loading" in str(data):
@@ -7362,16 +7619,25 @@ def process_tasks_cli(queue, state):
                     print(status_line.ljust(max(last_msg_len, len(status_line))), end="", flush=True)
                     last_msg_len = len(status_line)
                     in_status_line = True
+                if json_events:
+                    phase = "loading" if "Loading" in str(data) else ("loaded" if data == "Model loaded" else "status")
+                    emit("status", phase=phase, message=str(data), elapsed=round(time.time() - task_start_time, 2))
             elif cmd == "output":
                 # "output" is used for UI refresh, not just video saves - don't print anything
-                pass
+                if json_events:
+                    files = gen.get("file_list", []) + gen.get("audio_file_list", [])
+                    if len(files) > files_count:
+                        emit("output", files=files[files_count:])
+                        files_count = len(files)
             elif cmd == "info":
                 print(f"\n  [INFO] {data}")
                 in_status_line = False
+                emit("info", message=str(data))
 
         if not task_error:
             completed += 1
             print(f"\n  Task {task_no} completed")
+        emit("task_end", success=not task_error, elapsed=round(time.time() - task_start_time, 2))
 
     elapsed = time.time() - start_time
     print(f"\n{'='*50}")
@@ -7382,6 +7648,124 @@ def process_tasks_cli(queue, state):
     return completed == (total_tasks - skipped)
 
 
+WORKER_REPLY_PREFIX = "@@wgp@@ "
+
+def set_cli_output_dir(output_dir):
+    """Redirect all saved outputs (video, image, audio) to output_dir for headless runs."""
+    global save_path, image_save_path, audio_save_path
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    server_config["save_path"] = output_dir
+    server_config["image_save_path"] = output_dir
+    server_config["audio_save_path"] = output_dir
+    # Keep module-level paths in sync (used by save_video / get_available_filename).
+    save_path = output_dir
+    image_save_path = output_dir
+    audio_save_path = output_dir
+
+
+def create_cli_state():
+    """Create minimal state with all required fields for headless processing."""
+    return {
+        "gen": {
+            "queue": [],
+            "in_progress": False,
+            "file_list": [],
+            "file_settings_list": [],
+            "audio_file_list": [],
+            "audio_file_settings_list": [],
+            "selected": 0,
+            "audio_selected": 0,
+            "prompt_no": 0,
+            "prompts_max": 0,
+            "repeat_no": 0,
+            "total_generation": 1,
+            "window_no": 0,
+            "total_windows": 0,
+            "progress_status": "",
+            "process_status": "process:main",
+        },
+        "loras": [],
+    }
+
+
+def worker_reply(event, **payload):
+    """Emit a machine readable reply line for the process driving a --serve worker."""
+    payload["event"] = event
+    print(WORKER_REPLY_PREFIX + json.dumps(payload, default=str), flush=True)
+
+
+def get_free_vram():
+    """Bytes this worker could still allocate on its device (None without CUDA).
+
+    Counts memory held in torch's cache by this process as free, since it is reused before
+    asking the driver for more."""
+    if not torch.cuda.is_available():
+        return None
+    device = args.gpu if len(args.gpu) > 0 else None
+    free, _ = torch.cuda.mem_get_info(device)
+    return free + torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+
+
+def serve_tasks_cli(state):
+    """Persistent worker loop used by --serve.
+
+    Reads one JSON request per stdin line:
+      {"cmd": "process", "job_id": ..., "tasks": [{"id": ..., "params": {...}}], "output_dir": ...}
+      {"cmd": "release"}   unloads the resident model
+      {"cmd": "quit"}
+    Models stay loaded between requests; generate_video only reloads when the model type changes.
+    """
+    gen = get_gen_info(state)
+    wgp_folder = os.path.dirname(os.path.abspath(__file__))
+    worker_reply("ready", pid=os.getpid(), free_vram=get_free_vram())
+
+    for line in sys.stdin:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            worker_reply("error", error=f"Invalid JSON: {e}")
+            continue
+
+        cmd = request.get("cmd", "process")
+        job_id = request.get("job_id", None)
+        if cmd == "quit":
+            break
+        if cmd == "release":
+            release_model()
+            worker_reply("released", job_id=job_id)
+            continue
+        if cmd != "process":
+            worker_reply("error", job_id=job_id, error=f"Unknown command '{cmd}'")
+            continue
+
+        try:
+            output_dir = request.get("output_dir", "")
+            if len(output_dir) > 0:
+                set_cli_output_dir(output_dir)
+            gen["file_list"], gen["file_settings_list"] = [], []
+            gen["audio_file_list"], gen["audio_file_settings_list"] = [], []
+            gen["abort"] = False
+            queue, error = _parse_task_manifest(request.get("tasks", []), state, wgp_folder, None, "[serve]")
+            if error or len(queue) == 0:
+                worker_reply("error", job_id=job_id, error=error or "No valid task in request")
+                continue
+            gen["queue"] = queue
+            success = process_tasks_cli(queue, state, json_events=True, job_id=job_id)
+            worker_reply("done", job_id=job_id, success=success,
+                         files=gen["file_list"] + gen["audio_file_list"],
+                         model_type=transformer_type if wan_model is not None else None,
+                         free_vram=get_free_vram())
+        except Exception as e:
+            traceback.print_exc()
+            worker_reply("error", job_id=job_id, error=str(e))
+        finally:
+            gen["queue"] = []
+
+
 def get_generation_status(prompt_no, prompts_max, repeat_no, repeat_max, window_no, total_windows):
     if prompts_max == 1:        
         if repeat_max <= 1:
@@ -11802,42 +12186,13 @@ if __name__ == "__main__":
 
         # Override output directory if specified
         if len(args.output_dir) > 0:
-            if not os.path.isdir(args.output_dir):
-                os.makedirs(args.output_dir, exist_ok=True)
-            server_config["save_path"] = args.output_dir
-            server_config["image_save_path"] = args.output_dir
-            server_config["audio_save_path"] = args.output_dir
-            # Keep module-level paths in sync (used by save_video / get_available_filename).
-            save_path = args.output_dir
-            image_save_path = args.output_dir
-            audio_save_path = args.output_dir
+            set_cli_output_dir(args.output_dir)
             print(f"Output directory: {args.output_dir}")
 
         # Headless CLI runs: disable notification sounds to avoid pygame/sounddevice issues.
         server_config["notification_sound_enabled"] = 0
 
-        # Create minimal state with all required fields
-        state = {
-            "gen": {
-                "queue": [],
-                "in_progress": False,
-                "file_list": [],
-                "file_settings_list": [],
-                "audio_file_list": [],
-                "audio_file_settings_list": [],
-                "selected": 0,
-                "audio_selected": 0,
-                "prompt_no": 0,
-                "prompts_max": 0,
-                "repeat_no": 0,
-                "total_generation": 1,
-                "window_no": 0,
-                "total_windows": 0,
-                "progress_status": "",
-                "process_status": "process:main",
-            },
-            "loras": [],
-        }
+        state = create_cli_state()
 
         # Parse file based on type
         if is_json:
@@ -11877,12 +12232,24 @@ if __name__ == "__main__":
         state["gen"]["queue"] = queue
 
         try:
-            success = process_tasks_cli(queue, state)
+            success = process_tasks_cli(queue, state, json_events=args.json_progress)
             sys.exit(0 if success else 1)
         except KeyboardInterrupt:
             print("\n\nAborted by user")
             sys.exit(130)
 
+    # Persistent Worker Mode
+    if args.serve:
+        download_ffmpeg()
+        server_config["notification_sound_enabled"] = 0
+        if len(args.output_dir) > 0:
+            set_cli_output_dir(args.output_dir)
+        try:
+            serve_tasks_cli(create_cli_state())
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
     # Normal Gradio mode continues below...
     atexit.register(autosave_queue)
 